@@ -1,15 +1,25 @@
 import os
 import re
-import threading
 from collections import defaultdict
 
 import pycountry
 import unicodedata
 from flask import request, jsonify, Blueprint, render_template
-import yt_dlp
 from uuid import uuid4
-from downloader_global import DOWNLOAD_FOLDER, download_sessions
+from bandwidth import bandwidth_shaper
+from download_engines import engine_for, engine_options
+from downloader_global import download_sessions
+from file_catalog import file_catalog
+from job_scheduler import scheduler, QueueFullError, PRIORITY_NORMAL, PRIORITY_LOW
+from extraction_strategy import EXTRACTION_HEDGING, cancellable, strategy_tracker
+from metadata_cache import cached_extract_info, download_with_info, peek_cached_info, video_identity, is_permanent_error, options_profile
+from postprocess import audio_settings, postprocess_pool
+from progress_stream import sse_response, wait_for_progress, parse_session_ids, parse_versions
+from rendition_cache import rendition_cache, rendition_key
 from request_logger import log_request
+from single_flight import download_flights, download_key
+from staging import create_job_dir, publish, remove_job_dir
+from ydl_pool import ydl_pool
 
 api_bp = Blueprint('api', __name__)
 
@@ -33,6 +43,42 @@ def get_progress_api():
         "size": None
     }))
 
+@api_bp.route('/api/progress/stream', methods=['GET'])
+def stream_progress_api():
+    """Server-Sent Events for one or more comma separated session IDs"""
+    session_ids = parse_session_ids(request.args.get('session_id') or request.headers.get('X-Session-ID'))
+    if not session_ids:
+        return jsonify({"error": "session_id is required"}), 400
+    return sse_response(session_ids)
+
+@api_bp.route('/api/progress/wait', methods=['GET'])
+def wait_progress_api():
+    """Long-poll fallback: returns once a session differs from `since`"""
+    session_ids = parse_session_ids(request.args.get('session_id') or request.headers.get('X-Session-ID'))
+    if not session_ids:
+        return jsonify({"error": "session_id is required"}), 400
+    return jsonify(wait_for_progress(session_ids, parse_versions(request.args.get('since'))))
+
+API_DOWNLOAD_OPTIONS = {
+    'format': 'best',
+    'quiet': True,
+    'cookiefile': 'app/cookies.txt',
+    'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'extractor_args': {
+        'youtube': {
+            'player_client': ['android', 'web'],
+            'player_skip': ['webpage'],
+        }
+    },
+    'format_sort': ['res', 'ext:mp4:m4a'],
+    'format_sort_force': True,
+}
+ydl_pool.register('api-download-video', API_DOWNLOAD_OPTIONS)
+ydl_pool.register('api-download-audio', dict(API_DOWNLOAD_OPTIONS, **{
+    # Audio is extracted by postprocess_pool, outside the download slot
+    'format': 'bestaudio/best',
+}))
+
 @api_bp.route('/api/download', methods=['POST'])
 def api_download():
     urls = request.form.get('url').strip().splitlines()
@@ -60,64 +106,79 @@ def api_download():
         'language': request.headers.get('X-Language', '')
     }
 
-    download_sessions[session_id] = {
-        "percent": "0%",
-        "status": "Downloading",
-        "filename": None,
-        "size": None
+    profile = 'api-download-audio' if format_type == 'audio' else 'api-download-video'
+    overrides = {
+        'noplaylist': not playlist,
+        'merge_output_format': format_type if format_type in ['mp4', 'mkv', 'webm', 'mp3'] else None,
     }
+    if format_type != 'audio':
+        overrides['format'] = quality
+    # Extracted info is cached per options profile and overrides, the web
+    # route's option set never shares entries with this one
+    info_profile = options_profile(profile, **overrides)
+
+    # Identical single-video requests share one download, and reuse its file later
+    flight_key = None
+    render_key = None
+    if len(urls) == 1 and not playlist:
+        identity = video_identity(urls[0])
+        if identity:
+            # overrides carry the quality and the playlist flag
+            flight_key = download_key('api', identity, profile=profile, format_type=format_type, **overrides,
+                                      **(audio_settings() if format_type == 'audio' else {}))
+            render_key = rendition_key(identity, profile, **overrides,
+                                       **(audio_settings() if format_type == 'audio' else {}))
+
+    published = rendition_cache.publish(render_key)
+    if published:
+        download_sessions.create(
+            session_id,
+            percent="100%",
+            status="Completed",
+            filename=os.path.basename(published),
+            size=None,
+            queue_position=None
+        )
+        try:
+            log_request(urls[0], peek_cached_info(urls[0], info_profile, noplaylist=not playlist), format_type, 'download', request_data=request_data)
+        except Exception as log_err:
+            print(f"Error in log_request: {log_err}")
+        return jsonify({"success": True, "session_id": session_id, "queue_position": None})
+
+    download_sessions.create(
+        session_id,
+        percent="0%",
+        status="Queued",
+        filename=None,
+        size=None,
+        queue_position=None
+    )
+
+    last_percent = [None]
 
     def progress_hook(d):
         if d['status'] == 'downloading':
-            download_sessions[session_id]['percent'] = d.get('_percent_str', '0.0%').strip()
-            download_sessions[session_id]['status'] = "Downloading"
+            percent = d.get('_percent_str', '0.0%').strip()
+            # Hooks fire many times per second, only write real changes
+            if percent != last_percent[0]:
+                last_percent[0] = percent
+                download_sessions.update(session_id, percent=percent, status="Downloading")
         elif d['status'] == 'finished':
-            download_sessions[session_id]['percent'] = "100%"
-            download_sessions[session_id]['status'] = "Processing..."
+            download_sessions.update(session_id, percent="100%", status="Processing...")
 
     def download():
+        job_dir = create_job_dir()
+        # Final paths of the downloaded files, after post-processing
+        downloaded = []
         try:
-            ydl_opts = {
-                'progress_hooks': [progress_hook],
-                'outtmpl': os.path.join(DOWNLOAD_FOLDER, '%(title)s.%(ext)s'),
-                'format': quality,
-                'noplaylist': not playlist,
-                'quiet': True,
-                'merge_output_format': format_type if format_type in ['mp4', 'mkv', 'webm', 'mp3'] else None,
-                'cookiefile': 'app/cookies.txt',
-                'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                'extractor_args': {
-                    'youtube': {
-                        'player_client': ['android', 'web'],
-                        'player_skip': ['webpage'],
-                    }
-                },
-                'format_sort': ['res', 'ext:mp4:m4a'],
-                'format_sort_force': True,
-            }
-
-            if format_type == 'audio':
-                ydl_opts.update({
-                    'format': 'bestaudio/best',
-                    'postprocessors': [{
-                        'key': 'FFmpegExtractAudio',
-                        'preferredcodec': 'mp3',
-                        'preferredquality': '192',
-                    }],
-                })
-
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                # Extract info first to log requests, then download
+            # Share of the bandwidth for this client while the transfers run
+            with bandwidth_shaper.lease(session_id, request_data['ip_address']), \
+                    ydl_pool.acquire(profile, progress_hooks=[progress_hook], post_hooks=[downloaded.append],
+                                     outtmpl=os.path.join(job_dir, '%(title)s.%(ext)s'), **overrides) as ydl:
+                # Extract each URL once, log it, then download from the same info
                 for url in urls:
                     try:
-                        info = ydl.extract_info(url, download=False)
-                        # Log the request with captured request data
-                        try:
-                            log_request(url, info, format_type, 'download', request_data=request_data)
-                        except Exception as log_err:
-                            print(f"Error in log_request: {log_err}")
-                            import traceback
-                            traceback.print_exc()
+                        info = cached_extract_info(ydl, url, info_profile)
                     except Exception as e:
                         print(f"Error extracting info for {url}: {e}")
                         # Try to log even if extraction fails
@@ -125,34 +186,70 @@ def api_download():
                             log_request(url, None, format_type, 'download', request_data=request_data)
                         except Exception as log_err:
                             print(f"Error logging failed request: {log_err}")
-                
-                # Download all URLs
-                ydl.download(urls)
+                        raise
 
-            # After download, find the latest file
-            files = [os.path.join(DOWNLOAD_FOLDER, f) for f in os.listdir(DOWNLOAD_FOLDER)]
-            if files:
-                latest_file = max(files, key=os.path.getctime)
-                filename = os.path.basename(latest_file)
+                    # Log the request with captured request data
+                    try:
+                        log_request(url, info, format_type, 'download', request_data=request_data)
+                    except Exception as log_err:
+                        print(f"Error in log_request: {log_err}")
+                        import traceback
+                        traceback.print_exc()
 
-                # Sanitize filename
-                sanitized_name = sanitize_filename(os.path.splitext(filename)[0])
-                ext = os.path.splitext(filename)[1]
-                sanitized_full_path = os.path.join(DOWNLOAD_FOLDER, sanitized_name + ext)
+                    ydl.params.update(engine_options(engine_for(url)))
+                    # An external downloader takes the job's share when it starts
+                    bandwidth_shaper.attach(ydl)
+                    download_with_info(ydl, url, info)
 
-                os.rename(latest_file, sanitized_full_path)
+            if format_type == 'audio':
+                # CPU-bound, runs on its own pool while this job's download slot is lent out
+                downloaded = [postprocess_pool.extract_audio(path) for path in downloaded if os.path.exists(path)]
 
-                download_sessions[session_id]['filename'] = os.path.basename(sanitized_full_path)
-                download_sessions[session_id]['status'] = "Completed"
+            if not downloaded:
+                download_sessions.update(session_id, status="Error: No file found after download")
+                return
+
+            published = None
+            for file_path in downloaded:
+                if not os.path.exists(file_path):
+                    continue
+                name, ext = os.path.splitext(os.path.basename(file_path))
+                if len(downloaded) == 1:
+                    rendition_cache.store(render_key, file_path, sanitize_filename(name) + ext)
+                published = publish(file_path, sanitize_filename(name) + ext)
+                file_catalog.add(published)
+
+            if published is None:
+                download_sessions.update(session_id, status="Error: No file found after download")
             else:
-                download_sessions[session_id]['status'] = "Error: No file found after download"
+                download_sessions.update(session_id, filename=os.path.basename(published), status="Completed")
 
         except Exception as e:
-            download_sessions[session_id]['status'] = f"Error: {str(e)}"
-            download_sessions[session_id]['filename'] = None
+            download_sessions.update(session_id, status=f"Error: {str(e)}", filename=None)
+        finally:
+            remove_job_dir(job_dir)
 
-    threading.Thread(target=download, daemon=True).start()
-    return jsonify({"success": True, "session_id": session_id})
+    # No pin needed: the job writes in its staging directory, and a file it
+    # publishes is new enough to be skipped by eviction (STORAGE_MIN_AGE)
+    job = download_flights.attach(flight_key, session_id, download)
+
+    priority = PRIORITY_LOW if playlist or len(urls) > 1 else PRIORITY_NORMAL
+    try:
+        if job is not None:
+            # A job cancelled before it starts must still release its flight
+            scheduler.submit(session_id, job, priority=priority, on_cancel=lambda: download_flights.finish(flight_key))
+    except QueueFullError as e:
+        download_flights.finish(flight_key)
+        download_sessions.pop(session_id, None)
+        response = jsonify({"success": False, "error": str(e), "retry_after": e.retry_after})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 503
+
+    return jsonify({
+        "success": True,
+        "session_id": session_id,
+        "queue_position": download_sessions.get(session_id, {}).get('queue_position')
+    })
 
 @api_bp.route('/api/cancel', methods=['POST'])
 def cancel_download():
@@ -162,9 +259,29 @@ def cancel_download():
     if not session_id or session_id not in download_sessions:
         return jsonify({"success": False, "error": "Invalid session ID"}), 400
 
-    download_sessions[session_id]['status'] = "Cancelled"
-    return jsonify({"success": True})
-
+    # Queued jobs are dropped at once; running ones stop at their next
+    # request or progress update, and their partial files are removed. A
+    # download other sessions still follow goes on for them.
+    stopped = download_sessions.cancel(session_id)
+    if stopped:
+        scheduler.cancel(stopped)
+    return jsonify({"success": True, "status": download_sessions.get(session_id, {}).get('status')})
+
+
+ydl_pool.register('all-formats', {
+    'quiet': True,
+    'skip_download': True,
+    'cookiefile': 'app/cookies.txt',
+    'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'extractor_args': {
+        'youtube': {
+            'player_client': ['android', 'web'],
+            'player_skip': ['webpage'],
+        }
+    },
+    'format_sort': ['res', 'ext:mp4:m4a'],
+    'format_sort_force': True,
+})
 
 # @api_bp.route('/api/direct-links-all-format', methods=['POST'])
 def get_direct_links_all_format():
@@ -174,24 +291,8 @@ def get_direct_links_all_format():
         return jsonify({"error": "URL is required"}), 400
 
     try:
-        ydl_opts = {
-            'quiet': True,
-            'skip_download': True,
-            'cookiefile': 'app/cookies.txt',
-            'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'extractor_args': {
-                'youtube': {
-                    'player_client': ['android', 'web'],
-                    'player_skip': ['webpage'],
-                }
-            },
-            'format_sort': ['res', 'ext:mp4:m4a'],
-            'format_sort_force': True,
-        }
-
         direct_links = []
 
-
         def extract_urls(info_dict):
             formats = info_dict.get('formats', [])
             for fmt in formats:
@@ -204,7 +305,7 @@ def get_direct_links_all_format():
                         'filesize': fmt.get('filesize') or fmt.get('filesize_approx'),
                     })
 
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        with ydl_pool.acquire('all-formats') as ydl:
             info = ydl.extract_info(url, download=False)
             if 'entries' in info:  # It's a playlist
                 for entry in info['entries']:
@@ -263,6 +364,47 @@ def direct_links_view():
     return render_template('direct_links.html')
 
 
+# Extraction configs for get_direct_links, in their default order
+DIRECT_LINK_CONFIGS = {
+    'multi-client': {
+        'quiet': True,
+        'skip_download': True,
+        'cookiefile': 'app/cookies.txt',
+        'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+        'extractor_args': {
+            'youtube': {
+                'player_client': ['android', 'web', 'ios'],
+                'player_skip': ['webpage'],
+            }
+        },
+        # Prefer formats with http/https protocol (direct downloads) over m3u8
+        'format_sort': ['+protocol:http', '+protocol:https', 'res', 'ext:mp4:m4a'],
+        'format_sort_force': True,
+        'no_warnings': False,
+    },
+    'android': {
+        'quiet': True,
+        'skip_download': True,
+        'cookiefile': 'app/cookies.txt',
+        'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+        'extractor_args': {
+            'youtube': {
+                'player_client': ['android'],
+            }
+        },
+    },
+    'default': {
+        'quiet': True,
+        'skip_download': True,
+        'cookiefile': 'app/cookies.txt',
+        'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    },
+}
+
+for _name, _options in DIRECT_LINK_CONFIGS.items():
+    ydl_pool.register(f'direct-links:{_name}', _options)
+
+
 @api_bp.route('/api/direct-links', methods=['GET', 'POST'])
 def get_direct_links():
     if request.method == 'POST':
@@ -279,76 +421,61 @@ def get_direct_links():
 
     # Try to extract info first for logging (even if it fails later)
     info = None
-    extraction_error = None
-    
+    # Each request is logged once, whichever path it takes
+    logged = False
+
     try:
-        # Try multiple configurations to handle YouTube's changing system
-        # Prefer formats that are more likely to be direct downloads (not m3u8)
-        configs = [
-            {
-                'quiet': True,
-                'skip_download': True,
-                'cookiefile': 'app/cookies.txt',
-                'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                'extractor_args': {
-                    'youtube': {
-                        'player_client': ['android', 'web', 'ios'],
-                        'player_skip': ['webpage'],
-                    }
-                },
-                # Prefer formats with http/https protocol (direct downloads) over m3u8
-                'format_sort': ['+protocol:http', '+protocol:https', 'res', 'ext:mp4:m4a'],
-                'format_sort_force': True,
-                'no_warnings': False,
-            },
-            {
-                'quiet': True,
-                'skip_download': True,
-                'cookiefile': 'app/cookies.txt',
-                'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                'extractor_args': {
-                    'youtube': {
-                        'player_client': ['android'],
-                    }
-                },
-            },
-            {
-                'quiet': True,
-                'skip_download': True,
-                'cookiefile': 'app/cookies.txt',
-                'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            }
-        ]
-        
-        for i, ydl_opts in enumerate(configs):
+        # Several configurations handle YouTube's changing system. The tracker
+        # tries the one that currently works best first and skips broken ones.
+        extractor = (video_identity(url) or ('default',))[0]
+        try:
+            info = peek_cached_info(url, 'direct-links')
+        except Exception:
+            # Remembered permanent failure (private, removed...)
+            log_request(url, None, format_type, 'direct-links')
+            logged = True
+            raise
+        if info is not None:
+            log_request(url, info, format_type, 'direct-links')
+            logged = True
+        attempts = [] if info is not None else strategy_tracker.order(extractor, list(DIRECT_LINK_CONFIGS))
+
+        def attempt(config_name, cancelled):
+            with ydl_pool.acquire(f'direct-links:{config_name}') as ydl:
+                cancellable(ydl, cancelled)
+                return cached_extract_info(ydl, url, 'direct-links', flight=config_name)
+
+        if attempts:
             try:
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    info = ydl.extract_info(url, download=False)
-                    # Log the request immediately after successful extraction
-                    log_request(url, info, format_type, 'direct-links')
-                    break  # If successful, break out of the loop
+                # In hedged mode a slow config gets company from the next one
+                info = strategy_tracker.run(extractor, attempts, attempt, hedge=EXTRACTION_HEDGING,
+                                            is_permanent=is_permanent_error)
+                # Log the request immediately after successful extraction
+                log_request(url, info, format_type, 'direct-links')
+                logged = True
             except Exception as e:
-                extraction_error = str(e)
-                if i == len(configs) - 1:  # If this is the last config
-                    # Try to log even if extraction failed
-                    try:
-                        # Try one more time with minimal config just to get basic info
-                        minimal_config = {
-                            'quiet': True,
-                            'skip_download': True,
-                        }
-                        with yt_dlp.YoutubeDL(minimal_config) as ydl:
-                            try:
-                                info = ydl.extract_info(url, download=False)
-                                log_request(url, info, format_type, 'direct-links')
-                            except:
-                                # If still fails, log with minimal info
-                                log_request(url, None, format_type, 'direct-links')
-                    except:
-                        # Log with no info if all extraction attempts fail
-                        log_request(url, None, format_type, 'direct-links')
+                if is_permanent_error(e):
+                    # Private/removed videos fail the same way with every config
+                    log_request(url, None, format_type, 'direct-links')
+                    logged = True
                     raise e
-                continue  # Try next config
+                # Try to log even if extraction failed
+                try:
+                    # Try one more time with minimal config just to get basic info.
+                    # Not cached: the reduced info must not be served in place
+                    # of the real configurations' result
+                    with ydl_pool.acquire('minimal') as ydl:
+                        try:
+                            info = ydl.extract_info(url, download=False)
+                            log_request(url, info, format_type, 'direct-links')
+                        except:
+                            # If still fails, log with minimal info
+                            log_request(url, None, format_type, 'direct-links')
+                except:
+                    # Log with no info if all extraction attempts fail
+                    log_request(url, None, format_type, 'direct-links')
+                logged = True
+                raise e
 
         if info is None:
             return jsonify({"success": False, "error": "Could not extract video information with any configuration"}), 500
@@ -499,7 +626,7 @@ def get_direct_links():
 
     except Exception as e:
         # Log the request even if there's an error (if not already logged)
-        if info is None:
+        if not logged:
             try:
                 log_request(url, None, format_type, 'direct-links')
             except:
@@ -0,0 +1,319 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from yt_dlp.utils import parse_bytes
+
+from cancellation import current_job
+from downloader_global import STATE_FOLDER
+
+
+def _rate(name):
+    value = os.environ.get(name, '').strip()
+    return (parse_bytes(value) or 0) if value else 0
+
+
+# Download rate of all jobs together, in bytes/s ("50M", "800K"; '' or 0 = unlimited)
+BANDWIDTH_LIMIT = _rate('BANDWIDTH_LIMIT')
+# Download rate of all jobs of one client IP together, at most
+BANDWIDTH_PER_CLIENT = _rate('BANDWIDTH_PER_CLIENT')
+# Transferring jobs of every worker, so the limits hold across processes
+BANDWIDTH_DB_FILE = os.environ.get('BANDWIDTH_DB_FILE', os.path.join(STATE_FOLDER, 'bandwidth.db'))
+# Seconds of its rate a job may transfer at once after a pause
+BANDWIDTH_BURST_SECONDS = float(os.environ.get('BANDWIDTH_BURST_SECONDS', '1'))
+# A job that transferred nothing for this long (extracting, post-processing)
+# leaves its share to the others until it transfers again
+BANDWIDTH_IDLE_SECONDS = float(os.environ.get('BANDWIDTH_IDLE_SECONDS', '3'))
+# Shares are divided again at least this often while jobs transfer
+REBALANCE_SECONDS = 1.0
+# Longest single sleep, so rate changes and cancellations apply quickly
+MAX_WAIT_SECONDS = 0.25
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bandwidth_jobs (
+    worker TEXT NOT NULL,
+    client TEXT NOT NULL,
+    jobs INTEGER NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (worker, client)
+);
+"""
+
+
+class TokenBucket:
+    """
+    Bytes allowed at `rate` per second, with up to `burst` seconds saved up.
+
+    A transfer takes its bytes first and then waits until the bucket is out
+    of debt, since yt-dlp only reports a block once it has been read.
+    """
+
+    def __init__(self, rate=0, burst=BANDWIDTH_BURST_SECONDS):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = rate * burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        # Caller must hold self._lock
+        if self.rate:
+            self.tokens = min(self.tokens + (now - self.updated) * self.rate, self.rate * self.burst)
+        self.updated = now
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = rate
+            self.tokens = min(self.tokens, rate * self.burst)
+
+    def take(self, amount):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= amount
+
+    def wait(self, stop=None):
+        """Sleep until the bucket is out of debt; returns early once stop() is true"""
+        while True:
+            with self._lock:
+                if not self.rate:
+                    self.tokens = 0
+                    return
+                self._refill(time.monotonic())
+                debt = -self.tokens
+                rate = self.rate
+            if debt <= 0 or (stop is not None and stop()):
+                return
+            time.sleep(min(debt / rate, MAX_WAIT_SECONDS))
+
+
+class Lease:
+    """Bandwidth share of one download job"""
+
+    def __init__(self, session_id, client):
+        self.session_id = session_id
+        self.client = client
+        self.token = current_job()
+        self.bucket = TokenBucket()
+        self.last_transfer = None
+        self.transferred = 0
+        # Bytes already counted per file, from the progress hook
+        self.seen = {}
+        self.seen_lock = threading.Lock()
+
+    @property
+    def rate(self):
+        return self.bucket.rate
+
+    def active(self, now):
+        return self.last_transfer is not None and now - self.last_transfer < BANDWIDTH_IDLE_SECONDS
+
+
+class BandwidthShaper:
+    """
+    Divides a global download rate fairly between clients and their jobs.
+
+    Every running job holds a Lease (see lease()). The limit is split evenly
+    between the client IPs with a transferring job, capped per client, and
+    each client's part evenly between its transferring jobs. Shares are
+    divided again whenever a job starts, finishes, goes idle or resumes.
+
+    The token buckets live in each process, but the division counts the
+    transferring jobs of all gunicorn workers: every rebalance publishes
+    this worker's jobs per client to a small SQLite table and reads the
+    others'. A worker with nothing to transfer takes no share, and a
+    client's jobs on several workers split one BANDWIDTH_PER_CLIENT.
+
+    yt-dlp's native downloaders call the progress hooks after every block
+    they read, fragment threads included; the hook attach() installs takes
+    the new bytes from the job's token bucket and waits there. External
+    downloaders only report when they are done, so they get the job's share
+    as their 'ratelimit' when they start.
+    """
+
+    def __init__(self, limit=BANDWIDTH_LIMIT, per_client=BANDWIDTH_PER_CLIENT, path=BANDWIDTH_DB_FILE, worker=None):
+        self.limit = limit
+        self.per_client = per_client
+        self.path = path
+        self.worker = worker or str(os.getpid())
+        self._local = threading.local()
+        self._leases = {}  # job (CancelToken) -> Lease
+        self._lock = threading.Lock()
+        self._balanced = 0
+        self._shared = {"workers": 0, "clients": 0}
+        self.rebalances = 0
+        self.waited = 0.0
+        self.finished_bytes = 0
+
+    @property
+    def enabled(self):
+        return bool(self.limit or self.per_client)
+
+    @contextmanager
+    def lease(self, session_id, client):
+        """
+        Hold a bandwidth share for the calling job while the block runs.
+        Leases belong to the job, not to session_id: a browser session can
+        run several jobs, and each gets its own share.
+        """
+        if not self.enabled:
+            yield None
+            return
+        lease = Lease(session_id, client or 'unknown')
+        key = lease.token or lease
+        with self._lock:
+            self._leases[key] = lease
+        self._rebalance()
+        try:
+            yield lease
+        finally:
+            with self._lock:
+                if self._leases.get(key) is lease:
+                    del self._leases[key]
+                self.finished_bytes += lease.transferred
+            self._rebalance()
+
+    def attach(self, ydl, job=None):
+        """
+        Shape the downloads of ydl with the share of job (default: the
+        calling thread's job), if it holds one. Call again after switching
+        ydl to an external downloader.
+        """
+        lease = self._leases.get(job or current_job())
+        if lease is None:
+            return
+        if getattr(ydl, '_bandwidth_lease', None) is not lease:
+            ydl._bandwidth_lease = lease
+            ydl.add_progress_hook(lambda d: self._progress(lease, d))
+        # Read once by external downloaders (aria2c --max-overall-download-limit);
+        # native ones are paced by the hook, on top of which it would only lag
+        ydl.params['ratelimit'] = (lease.rate or None) if ydl.params.get('external_downloader') else None
+
+    def _progress(self, lease, d):
+        if d.get('status') != 'downloading':
+            return
+        name = d.get('tmpfilename') or d.get('filename')
+        downloaded = d.get('downloaded_bytes') or 0
+        with lease.seen_lock:
+            new = downloaded - lease.seen.get(name, 0)
+            if new > 0:
+                lease.seen[name] = downloaded
+        if new > 0:
+            self.consume(lease, new)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _exchange(self, local):
+        """
+        Publish this worker's transferring jobs per client and return the
+        jobs per client of all workers that transferred recently.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Rows of a worker that stopped transferring (or died) expire
+                conn.execute("DELETE FROM bandwidth_jobs WHERE worker = ? OR updated < ?",
+                             (self.worker, now - BANDWIDTH_IDLE_SECONDS))
+                conn.executemany(
+                    "INSERT INTO bandwidth_jobs (worker, client, jobs, updated) VALUES (?, ?, ?, ?)",
+                    [(self.worker, client, jobs, now) for client, jobs in local.items()]
+                )
+                jobs = dict(conn.execute("SELECT client, SUM(jobs) FROM bandwidth_jobs GROUP BY client"))
+                workers = conn.execute("SELECT COUNT(DISTINCT worker) FROM bandwidth_jobs").fetchone()[0]
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            # Shape with this worker's own view until the database answers again
+            print(f"[Bandwidth] Could not share job counts: {e}")
+            return dict(local)
+        self._shared = {"workers": workers, "clients": len(jobs)}
+        return jobs
+
+    def _rebalance(self):
+        """Divide the limits again, counting the transferring jobs of every worker"""
+        now = time.monotonic()
+        with self._lock:
+            self._balanced = now
+            self.rebalances += 1
+            leases = list(self._leases.values())
+        clients = {}
+        for lease in leases:
+            if lease.active(now):
+                clients.setdefault(lease.client, []).append(lease)
+        jobs = self._exchange({client: len(client_leases) for client, client_leases in clients.items()})
+        # A job about to start transferring gets what it would get as one more client
+        client_rate = self._client_rate(len(jobs) + 1)
+        for lease in leases:
+            if not lease.active(now):
+                lease.bucket.set_rate(client_rate)
+        client_rate = self._client_rate(len(jobs))
+        for client, client_leases in clients.items():
+            for lease in client_leases:
+                lease.bucket.set_rate(client_rate / jobs[client] if client_rate else 0)
+
+    def _client_rate(self, clients):
+        rates = [rate for rate in (self.limit / max(clients, 1) if self.limit else 0, self.per_client) if rate]
+        return min(rates) if rates else 0
+
+    def consume(self, lease, amount):
+        """Account amount bytes read for lease and wait until its share allows more"""
+        now = time.monotonic()
+        with self._lock:
+            resumed = not lease.active(now)
+            lease.last_transfer = now
+            lease.transferred += amount
+            due = resumed or now - self._balanced >= REBALANCE_SECONDS
+            if due:
+                # Only one thread rebalances, the others keep transferring
+                self._balanced = now
+        if due:
+            self._rebalance()
+        lease.bucket.take(amount)
+        started = time.monotonic()
+        token = lease.token
+        lease.bucket.wait(token.is_cancelled if token is not None else None)
+        waited = time.monotonic() - started
+        if waited:
+            with self._lock:
+                self.waited += waited
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            leases = list(self._leases.values())
+            clients = {}
+            for lease in leases:
+                client = clients.setdefault(lease.client, {"jobs": 0, "transferring": 0, "rate": 0})
+                client["jobs"] += 1
+                if lease.active(now):
+                    client["transferring"] += 1
+                    client["rate"] += lease.rate
+            return {
+                "enabled": self.enabled,
+                "limit": self.limit,
+                "per_client": self.per_client,
+                "jobs": len(leases),
+                "clients": clients,
+                "bytes": self.finished_bytes + sum(lease.transferred for lease in leases),
+                "throttled_seconds": round(self.waited, 1),
+                "rebalances": self.rebalances,
+                # Transferring workers and clients of all workers, at the last rebalance
+                "shared": dict(self._shared),
+            }
+
+
+bandwidth_shaper = BandwidthShaper()
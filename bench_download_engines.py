@@ -0,0 +1,149 @@
+"""
+Compare the download engines of download_engines.py against a local media server.
+
+The server throttles every connection and adds a delay to every request,
+so parallel fragments and ranged chunks show the difference they make on
+a real upstream. It serves one progressive file and one HLS stream of the
+same size.
+
+    python bench_download_engines.py [--size-mb 24] [--rate-kb 4096] [--latency-ms 40]
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import yt_dlp
+
+from download_engines import DOWNLOAD_ENGINES, engine_options, stats
+
+SEGMENT_SIZE = 512 * 1024
+
+
+def make_handler(media, rate, latency):
+    class MediaHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, data, content_type):
+            time.sleep(latency)
+            start, end = 0, len(data) - 1
+            range_header = self.headers.get('Range')
+            if range_header and range_header.startswith('bytes='):
+                first, _, last = range_header[6:].partition('-')
+                start = int(first or 0)
+                end = min(int(last), end) if last else end
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+            else:
+                self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(end - start + 1))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.end_headers()
+            if self.command == 'HEAD':
+                return
+            # Throttle each connection to `rate` bytes per second
+            block = max(1, rate // 20)
+            position = start
+            while position <= end:
+                chunk = data[position:min(position + block, end + 1)]
+                try:
+                    self.wfile.write(chunk)
+                except ConnectionError:
+                    # The client stopped reading, e.g. at the end of a chunk
+                    return
+                position += len(chunk)
+                time.sleep(len(chunk) / rate)
+
+        def do_GET(self):
+            path = self.path.split('?')[0]
+            if path not in media:
+                self.send_error(404)
+                return
+            self._send(*media[path])
+
+        do_HEAD = do_GET
+
+    return MediaHandler
+
+
+def build_media(size):
+    payload = os.urandom(size)
+    segments = [payload[i:i + SEGMENT_SIZE] for i in range(0, size, SEGMENT_SIZE)]
+    playlist = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:2', '#EXT-X-MEDIA-SEQUENCE:0']
+    media = {'/progressive.mp4': (payload, 'video/mp4')}
+    for index, segment in enumerate(segments):
+        playlist += ['#EXTINF:2.0,', f'seg{index}.ts']
+        media[f'/hls/seg{index}.ts'] = (segment, 'video/mp2t')
+    playlist.append('#EXT-X-ENDLIST')
+    media['/hls/index.m3u8'] = ('\n'.join(playlist).encode(), 'application/vnd.apple.mpegurl')
+    return media
+
+
+def run_engine(name, url, out_dir):
+    options = dict(engine_options(name), **{
+        'quiet': True,
+        'no_warnings': True,
+        'noprogress': True,
+        'fixup': 'never',
+        'cachedir': False,
+        'outtmpl': os.path.join(out_dir, f'{name}-%(id)s.%(ext)s'),
+    })
+    started = time.monotonic()
+    try:
+        with yt_dlp.YoutubeDL(options) as ydl:
+            ydl.download([url])
+        return time.monotonic() - started
+    finally:
+        # Otherwise the next run finds the file already downloaded
+        for entry in os.scandir(out_dir):
+            os.remove(entry.path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=24, help='size of each test file')
+    parser.add_argument('--rate-kb', type=int, default=4096, help='throughput of one connection, KiB/s')
+    parser.add_argument('--latency-ms', type=int, default=40, help='delay before every response')
+    parser.add_argument('--engines', default=','.join(DOWNLOAD_ENGINES), help='comma separated engine names')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per engine and file, the best one counts')
+    args = parser.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+    available = stats()['available']
+    engines = [name for name in args.engines.split(',') if name in available]
+    skipped = [name for name in args.engines.split(',') if name not in available]
+
+    media = build_media(size)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(media, args.rate_kb * 1024, args.latency_ms / 1000))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_address[1]}'
+    sources = {'progressive': f'{base}/progressive.mp4', 'hls': f'{base}/hls/index.m3u8'}
+
+    print(f"{args.size_mb} MiB per file, {args.rate_kb} KiB/s per connection, {args.latency_ms} ms per request")
+    print(f"{'engine':<12}{'source':<14}{'seconds':>10}{'MiB/s':>10}")
+    out_dir = tempfile.mkdtemp(prefix='bench-engines-')
+    try:
+        for name in engines:
+            for source, url in sources.items():
+                try:
+                    seconds = min(run_engine(name, url, out_dir) for _ in range(args.repeat))
+                except Exception as e:
+                    print(f"{name:<12}{source:<14}{'failed':>10}  {e}")
+                    continue
+                print(f"{name:<12}{source:<14}{seconds:>10.2f}{args.size_mb / seconds:>10.2f}")
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+        server.shutdown()
+    if skipped:
+        print(f"Skipped (not available here): {', '.join(skipped)}")
+
+
+if __name__ == '__main__':
+    main()
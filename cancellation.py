@@ -0,0 +1,99 @@
+import threading
+import weakref
+from contextlib import contextmanager
+
+from yt_dlp.utils import DownloadCancelled, Popen
+
+
+class JobCancelled(DownloadCancelled):
+    msg = 'Download cancelled'
+
+
+_local = threading.local()
+
+
+class CancelToken:
+    """
+    Cancellation state of one download job.
+
+    Threads working for the job bind the token (see bound()). YoutubeDL
+    instances taken from ydl_pool in such a thread stop at their next HTTP
+    request, progress update or post-processing step. Processes the job
+    starts through run_process() (ffmpeg in postprocess.py) are killed
+    when it is cancelled; an external downloader yt-dlp runs itself
+    finishes its file first.
+    """
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self._event = threading.Event()
+        self._processes = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def is_cancelled(self):
+        return self._event.is_set()
+
+    def check(self):
+        if self._event.is_set():
+            raise JobCancelled()
+
+    def cancel(self):
+        with self._lock:
+            self._event.set()
+            processes = list(self._processes)
+        for process in processes:
+            try:
+                process.kill()
+            except OSError:
+                pass
+
+    def track(self, process):
+        with self._lock:
+            self._processes.add(process)
+            cancelled = self._event.is_set()
+        if cancelled:
+            process.kill()
+
+    @contextmanager
+    def bound(self):
+        """Make this the current thread's job for the duration of the block"""
+        previous = getattr(_local, 'token', None)
+        _local.token = self
+        try:
+            yield self
+        finally:
+            _local.token = previous
+
+    def guard(self, ydl):
+        """Make ydl raise JobCancelled at its next request, progress update or post-processing step"""
+        urlopen = ydl.urlopen
+
+        def guarded_urlopen(req):
+            self.check()
+            return urlopen(req)
+
+        ydl.urlopen = guarded_urlopen
+        ydl.add_progress_hook(lambda d: self.check())
+        # Post-processors yt-dlp creates for this download (merger, fixups)
+        # report to these hooks before their ffmpeg starts
+        ydl.add_postprocessor_hook(lambda d: self.check())
+        return ydl
+
+
+def current_job():
+    """CancelToken of the job the calling thread works for, or None"""
+    return getattr(_local, 'token', None)
+
+
+def run_process(args, **kwargs):
+    """
+    yt-dlp's Popen.run() for a process of the current job: it is killed
+    when the job is cancelled. Returns (stdout, stderr, returncode).
+    """
+    token = current_job()
+    with Popen(args, **kwargs) as process:
+        if token is not None:
+            token.track(process)
+        stdout, stderr = process.communicate_or_kill()
+    default = '' if kwargs.get('text') else b''
+    return stdout or default, stderr or default, process.returncode
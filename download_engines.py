@@ -0,0 +1,95 @@
+import os
+import shutil
+import threading
+
+from metadata_cache import video_identity
+
+# yt-dlp transfer settings every engine sets, so switching engines on a
+# pooled instance never leaves a previous engine's value behind
+ENGINE_DEFAULTS = {
+    'concurrent_fragment_downloads': 1,
+    'http_chunk_size': None,
+    'buffersize': 1024,
+    'noresizebuffer': False,
+    'retries': 10,
+    'fragment_retries': 10,
+    'external_downloader': {},
+    'external_downloader_args': {},
+}
+
+DOWNLOAD_ENGINES = {
+    # yt-dlp's own defaults: one fragment at a time over one connection
+    'default': {},
+    # DASH/HLS fragments in parallel, large files fetched in ranged chunks
+    # so a throttled connection is re-opened instead of crawling
+    'fragmented': {
+        'concurrent_fragment_downloads': 4,
+        'http_chunk_size': 10 * 1024 * 1024,
+        'buffersize': 64 * 1024,
+    },
+    # For fast upstreams and hosts with bandwidth to spare
+    'aggressive': {
+        'concurrent_fragment_downloads': 8,
+        'http_chunk_size': 10 * 1024 * 1024,
+        'buffersize': 1024 * 1024,
+        'noresizebuffer': True,
+        'retries': 20,
+        'fragment_retries': 20,
+    },
+    # Multi-connection transfers through aria2c, when it is installed
+    'aria2c': {
+        'concurrent_fragment_downloads': 4,
+        'external_downloader': {'default': 'aria2c'},
+        'external_downloader_args': {'aria2c': ['-x', '8', '-s', '8', '-k', '1M', '--summary-interval=0']},
+    },
+}
+
+# Engines are chosen by configuration only; 'default' keeps yt-dlp's transfer
+# settings, the others are opt-in
+DOWNLOAD_ENGINE = os.environ.get('DOWNLOAD_ENGINE', 'default')
+# Per extractor override, e.g. "Youtube=fragmented,Generic=default"
+DOWNLOAD_ENGINE_BY_EXTRACTOR = dict(
+    item.split('=', 1) for item in os.environ.get('DOWNLOAD_ENGINE_BY_EXTRACTOR', '').split(',') if '=' in item
+)
+
+_usage = {}
+_usage_lock = threading.Lock()
+
+
+def _available(name):
+    external = DOWNLOAD_ENGINES[name].get('external_downloader', {}).get('default')
+    return external is None or shutil.which(external) is not None
+
+
+def engine_for(url):
+    """
+    Name of the engine for url: the one configured for its extractor, else
+    DOWNLOAD_ENGINE. Engines that need a missing external downloader fall
+    back to 'default'.
+    """
+    identity = video_identity(url)
+    name = DOWNLOAD_ENGINE_BY_EXTRACTOR.get(identity[0]) if identity else None
+    if name not in DOWNLOAD_ENGINES:
+        name = DOWNLOAD_ENGINE if DOWNLOAD_ENGINE in DOWNLOAD_ENGINES else 'default'
+    if not _available(name):
+        print(f"[Download Engines] {name} is not available here, using default")
+        name = 'default'
+    return name
+
+
+def engine_options(name):
+    """YoutubeDL params of engine name, to pass to ydl_pool.acquire() or params.update()"""
+    with _usage_lock:
+        _usage[name] = _usage.get(name, 0) + 1
+    return dict(ENGINE_DEFAULTS, **DOWNLOAD_ENGINES[name])
+
+
+def stats():
+    with _usage_lock:
+        used = dict(_usage)
+    return {
+        "default": DOWNLOAD_ENGINE,
+        "by_extractor": DOWNLOAD_ENGINE_BY_EXTRACTOR,
+        "available": [name for name in DOWNLOAD_ENGINES if _available(name)],
+        "used": used,
+    }
@@ -1,6 +1,13 @@
 import os
+from session_store import SessionStore
 
 DOWNLOAD_FOLDER = 'static/downloads'
 os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
 
-download_sessions = {}
\ No newline at end of file
+# Shared state (caches, locks) used by every gunicorn worker on this host
+STATE_FOLDER = os.environ.get('STATE_FOLDER', 'state')
+os.makedirs(STATE_FOLDER, exist_ok=True)
+
+# Download progress, shared by all workers so any of them can answer a poll
+SESSION_DB_FILE = os.environ.get('SESSION_DB_FILE', os.path.join(STATE_FOLDER, 'sessions.db'))
+download_sessions = SessionStore(SESSION_DB_FILE)
@@ -0,0 +1,241 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+# Consecutive failures after which a config is skipped for a while
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', '3'))
+CIRCUIT_COOLDOWN_SECONDS = int(os.environ.get('CIRCUIT_COOLDOWN_SECONDS', '300'))
+# Latency samples kept per (extractor, config)
+LATENCY_WINDOW = 50
+
+# Hedged mode: when a config has not answered within its p90 latency, the
+# next config starts in parallel and the first success wins
+EXTRACTION_HEDGING = os.environ.get('EXTRACTION_HEDGING', 'false').lower() in ('1', 'true', 'yes')
+HEDGE_PERCENTILE = float(os.environ.get('HEDGE_PERCENTILE', '90'))
+# Budget used until a config has latency samples
+HEDGE_DEFAULT_DELAY = float(os.environ.get('HEDGE_DEFAULT_DELAY', '8'))
+# Hedge extractions allowed at once in this worker, bounds the extra upstream load
+HEDGE_MAX_IN_FLIGHT = int(os.environ.get('HEDGE_MAX_IN_FLIGHT', '2'))
+
+
+class ExtractionCancelled(Exception):
+    pass
+
+
+def cancellable(ydl, cancelled):
+    """Make ydl abort at its next HTTP request once the cancelled event is set"""
+    urlopen = ydl.urlopen
+
+    def guarded_urlopen(req):
+        if cancelled.is_set():
+            raise ExtractionCancelled('Extraction cancelled, another config answered first')
+        return urlopen(req)
+
+    ydl.urlopen = guarded_urlopen
+    return ydl
+
+
+class _ConfigStats:
+    __slots__ = ('successes', 'failures', 'consecutive_failures', 'open_until', 'latencies', 'last_error')
+
+    def __init__(self):
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.open_until = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.last_error = None
+
+    def success_rate(self):
+        # Laplace smoothing, so one early failure does not bury a config
+        return (self.successes + 1) / (self.successes + self.failures + 2)
+
+    def mean_latency(self):
+        return sum(self.latencies) / len(self.latencies) if self.latencies else None
+
+
+class StrategyTracker:
+    """
+    Success rate and latency of each extraction config, per extractor.
+
+    order() puts the config most likely to answer quickly first and skips
+    configs whose circuit is open: after CIRCUIT_FAILURE_THRESHOLD failures
+    in a row a config is not tried for CIRCUIT_COOLDOWN_SECONDS, then gets a
+    single trial run. State is kept per worker.
+    """
+
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, cooldown=CIRCUIT_COOLDOWN_SECONDS,
+                 hedge_slots=HEDGE_MAX_IN_FLIGHT):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._stats = {}
+        self._lock = threading.Lock()
+        self.hedge_slots = hedge_slots
+        self._hedge_slots = threading.BoundedSemaphore(hedge_slots)
+        self.hedges_started = 0
+        self.hedges_won = 0
+        self.hedges_skipped = 0
+
+    def _get(self, extractor, config):
+        stats = self._stats.get((extractor, config))
+        if stats is None:
+            stats = self._stats[(extractor, config)] = _ConfigStats()
+        return stats
+
+    def order(self, extractor, configs, now=None):
+        """
+        Config names in the order to try them. Open circuits are left out,
+        unless every circuit is open; then the one that opened first is tried.
+        """
+        now = now or time.time()
+        with self._lock:
+            stats = {config: self._get(extractor, config) for config in configs}
+            closed = [config for config in configs if stats[config].open_until <= now]
+            if not closed:
+                return [min(configs, key=lambda config: stats[config].open_until)]
+
+            def score(config):
+                latency = stats[config].mean_latency()
+                # Untried configs keep their default position
+                return (-round(stats[config].success_rate(), 2), latency if latency is not None else 0)
+
+            return sorted(closed, key=score)
+
+    def record(self, extractor, config, ok, seconds=None, error=None, now=None):
+        now = now or time.time()
+        with self._lock:
+            stats = self._get(extractor, config)
+            if ok:
+                stats.successes += 1
+                stats.consecutive_failures = 0
+                stats.open_until = 0
+                if seconds is not None:
+                    stats.latencies.append(seconds)
+                return
+            stats.failures += 1
+            stats.consecutive_failures += 1
+            stats.last_error = str(error)[:300] if error else None
+            if stats.consecutive_failures >= self.failure_threshold:
+                if stats.open_until <= now:
+                    print(f"[Extraction Strategy] Circuit open for {extractor}/{config} "
+                          f"after {stats.consecutive_failures} failures")
+                stats.open_until = now + self.cooldown
+
+    def latency_percentile(self, extractor, config, percentile):
+        """Latency below which `percentile` % of successful runs finished, or None"""
+        with self._lock:
+            samples = sorted(self._get(extractor, config).latencies)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * percentile / 100))
+        return samples[index]
+
+    def hedge_delay(self, extractor, config):
+        latency = self.latency_percentile(extractor, config, HEDGE_PERCENTILE)
+        return latency if latency is not None else HEDGE_DEFAULT_DELAY
+
+    def run(self, extractor, configs, attempt, hedge=False, is_permanent=lambda error: False):
+        """
+        Call attempt(config, cancelled) for configs until one succeeds and
+        return its result, recording the outcome of every attempt.
+
+        Without hedge a config only starts once the previous one failed. With
+        hedge the next config also starts when the running one is slower than
+        its latency budget, as long as a hedge slot is free; the first success
+        wins and the others see their cancelled event set. A permanent error
+        is raised right away, otherwise the last error once all have failed.
+        """
+        results = queue.Queue()
+        cancels = []
+        pending = list(configs)
+        running = 0
+        last_error = None
+
+        def start(config, is_hedge):
+            cancelled = threading.Event()
+            cancels.append(cancelled)
+
+            def run_one():
+                started = time.monotonic()
+                try:
+                    result, error = attempt(config, cancelled), None
+                except Exception as e:
+                    result, error = None, e
+                finally:
+                    if is_hedge:
+                        self._hedge_slots.release()
+                results.put((config, result, error, time.monotonic() - started, is_hedge, cancelled))
+
+            threading.Thread(target=run_one, daemon=True, name=f'extract-{config}').start()
+            return time.monotonic() + self.hedge_delay(extractor, config)
+
+        hedge_at = start(pending.pop(0), False)
+        running = 1
+        try:
+            while running:
+                timeout = max(0, hedge_at - time.monotonic()) if hedge and pending else None
+                try:
+                    config, result, error, seconds, is_hedge, cancelled = results.get(timeout=timeout)
+                except queue.Empty:
+                    if self._hedge_slots.acquire(blocking=False):
+                        self.hedges_started += 1
+                        hedge_at = start(pending.pop(0), True)
+                        running += 1
+                    else:
+                        # Too many hedges in flight, look again shortly
+                        self.hedges_skipped += 1
+                        hedge_at = time.monotonic() + 0.5
+                    continue
+
+                running -= 1
+                if error is None:
+                    self.record(extractor, config, True, seconds)
+                    if is_hedge:
+                        self.hedges_won += 1
+                    return result
+                if isinstance(error, ExtractionCancelled) or cancelled.is_set():
+                    continue
+                if is_permanent(error):
+                    raise error
+                self.record(extractor, config, False, error=error)
+                last_error = error
+                if running == 0 and pending:
+                    hedge_at = start(pending.pop(0), False)
+                    running = 1
+            raise last_error
+        finally:
+            # Losers stop at their next request
+            for cancelled in cancels:
+                cancelled.set()
+
+    def hedge_stats(self):
+        return {
+            "enabled": EXTRACTION_HEDGING,
+            "percentile": HEDGE_PERCENTILE,
+            "max_in_flight": self.hedge_slots,
+            "started": self.hedges_started,
+            "won": self.hedges_won,
+            "skipped_at_cap": self.hedges_skipped,
+        }
+
+    def stats(self, now=None):
+        now = now or time.time()
+        with self._lock:
+            result = {}
+            for (extractor, config), stats in sorted(self._stats.items()):
+                latency = stats.mean_latency()
+                result.setdefault(extractor, {})[config] = {
+                    "successes": stats.successes,
+                    "failures": stats.failures,
+                    "success_rate": round(stats.success_rate(), 3),
+                    "mean_latency": round(latency, 3) if latency is not None else None,
+                    "circuit": "open" if stats.open_until > now else "closed",
+                    "open_for": max(0, round(stats.open_until - now)),
+                    "last_error": stats.last_error,
+                }
+            return result
+
+
+strategy_tracker = StrategyTracker()
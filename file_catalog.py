@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+
+from downloader_global import DOWNLOAD_FOLDER
+
+# Full os.scandir pass that picks up files added or removed by other workers
+CATALOG_RECONCILE_SECONDS = int(os.environ.get('CATALOG_RECONCILE_SECONDS', '300'))
+
+SORT_KEYS = {
+    'date': lambda item: item[1][1],
+    'size': lambda item: item[1][0],
+    'name': lambda item: item[0].lower(),
+}
+
+
+class FileCatalog:
+    """
+    In-memory listing of DOWNLOAD_FOLDER for the admin panel.
+
+    Jobs report the files they create and remove, so the catalog and its
+    running totals stay current without touching the disk. Files changed by
+    other gunicorn workers are picked up by a periodic scandir pass.
+    """
+
+    def __init__(self, folder=DOWNLOAD_FOLDER):
+        self.folder = folder
+        self._files = {}  # name -> (size, mtime)
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._sorted = {}  # (sort, reverse) -> list, dropped on every change
+        self._reconciled_at = 0
+        self._started = False
+
+    def _set(self, name, entry):
+        old = self._files.get(name)
+        if old is not None:
+            self._total_bytes -= old[0]
+        self._files[name] = entry
+        self._total_bytes += entry[0]
+        self._sorted.clear()
+
+    def add(self, path):
+        """Record a file a job has finished writing"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        with self._lock:
+            self._set(os.path.basename(path), (stat.st_size, stat.st_mtime))
+
+    def remove(self, name):
+        with self._lock:
+            old = self._files.pop(os.path.basename(name), None)
+            if old is not None:
+                self._total_bytes -= old[0]
+                self._sorted.clear()
+
+    def reconcile(self):
+        """Rebuild the catalog from one scandir pass over the folder"""
+        files = {}
+        total = 0
+        if os.path.exists(self.folder):
+            for entry in os.scandir(self.folder):
+                try:
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    stat = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                files[entry.name] = (stat.st_size, stat.st_mtime)
+                total += stat.st_size
+        with self._lock:
+            self._files = files
+            self._total_bytes = total
+            self._sorted.clear()
+            self._reconciled_at = time.time()
+
+    def start(self):
+        """Fill the catalog once and keep reconciling it in the background"""
+        if self._started:
+            return
+        self._started = True
+        self.reconcile()
+
+        def loop():
+            while True:
+                time.sleep(CATALOG_RECONCILE_SECONDS)
+                try:
+                    self.reconcile()
+                except Exception as e:
+                    print(f"[File Catalog] Error reconciling: {e}")
+
+        threading.Thread(target=loop, daemon=True, name='file-catalog').start()
+
+    def totals(self):
+        with self._lock:
+            return len(self._files), self._total_bytes
+
+    def page(self, sort='date', reverse=True, page=1, per_page=50):
+        """
+        One page of (name, size, mtime) tuples and the number of pages.
+
+        Raises ValueError for an unknown sort key.
+        """
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Unknown sort key: {sort}")
+        self.start()
+        with self._lock:
+            ordered = self._sorted.get((sort, reverse))
+            if ordered is None:
+                ordered = sorted(self._files.items(), key=SORT_KEYS[sort], reverse=reverse)
+                self._sorted[(sort, reverse)] = ordered
+        pages = max(1, -(-len(ordered) // per_page))
+        start = (page - 1) * per_page
+        return [(name, size, mtime) for name, (size, mtime) in ordered[start:start + per_page]], pages
+
+
+file_catalog = FileCatalog()
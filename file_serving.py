@@ -0,0 +1,132 @@
+import mimetypes
+import os
+from urllib.parse import quote
+
+from flask import Response, request
+from werkzeug.exceptions import NotFound
+from werkzeug.http import http_date, parse_date
+from werkzeug.security import safe_join
+from werkzeug.wsgi import wrap_file
+
+# How the bytes of /downloads/ are sent:
+#   'sendfile'  - gunicorn sends the file with sendfile(2) (default)
+#   'x-accel'   - nginx serves it through an internal location (X-Accel-Redirect)
+#   'x-sendfile'- Apache/lighttpd serve it (X-Sendfile)
+SERVE_MODE = os.environ.get('DOWNLOAD_SERVE_MODE', 'sendfile')
+# Internal nginx location mapped onto DOWNLOAD_FOLDER, e.g.
+#   location /protected-downloads/ { internal; alias /app/static/downloads/; }
+X_ACCEL_PREFIX = os.environ.get('X_ACCEL_PREFIX', '/protected-downloads/')
+CHUNK_SIZE = 256 * 1024
+
+
+def file_etag(stat):
+    """Strong ETag, changes whenever the file is replaced or rewritten"""
+    return f'"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def content_disposition(filename):
+    try:
+        filename.encode('latin-1')
+        if '"' not in filename:
+            return f'attachment; filename="{filename}"'
+    except UnicodeEncodeError:
+        pass
+    return f"attachment; filename*=UTF-8''{quote(filename)}"
+
+
+def _not_modified(etag, stat):
+    if request.if_none_match:
+        return request.if_none_match.contains(etag.strip('"'))
+    since = request.if_modified_since
+    return since is not None and int(stat.st_mtime) <= since.timestamp()
+
+
+def _if_range_matches(etag, stat):
+    """A Range is only honoured if the client's copy is still current"""
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    date = parse_date(if_range)
+    return date is not None and int(stat.st_mtime) <= date.timestamp()
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def serve_download(folder, filename):
+    """
+    Send folder/filename as an attachment.
+
+    Handles If-None-Match/If-Modified-Since (304) and single byte ranges (206)
+    so interrupted downloads can resume and download managers can fetch
+    segments in parallel. In the offload modes Python only checks the request
+    and the front proxy sends the bytes.
+    """
+    path = safe_join(folder, filename)
+    if path is None:
+        raise NotFound()
+    try:
+        stat = os.stat(path)
+    except OSError:
+        raise NotFound()
+    if not os.path.isfile(path):
+        raise NotFound()
+
+    etag = file_etag(stat)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Accept-Ranges': 'bytes',
+        'Content-Disposition': content_disposition(filename),
+        'Cache-Control': 'private, max-age=0, must-revalidate',
+    }
+
+    if _not_modified(etag, stat):
+        return Response(status=304, headers=headers)
+
+    if SERVE_MODE == 'x-accel':
+        # nginx handles Range and sends the file itself
+        headers['X-Accel-Redirect'] = X_ACCEL_PREFIX + quote(filename)
+        return Response(status=200, headers=headers, mimetype='application/octet-stream')
+    if SERVE_MODE == 'x-sendfile':
+        headers['X-Sendfile'] = os.path.abspath(path)
+        return Response(status=200, headers=headers, mimetype='application/octet-stream')
+
+    size = stat.st_size
+    start, stop, status = 0, size, 200
+    if request.range and _if_range_matches(etag, stat):
+        # Multiple ranges are not supported, those clients get the whole file
+        byte_range = request.range.range_for_length(size)
+        if byte_range is None and len(request.range.ranges) == 1:
+            headers['Content-Range'] = f'bytes */{size}'
+            return Response(status=416, headers=headers)
+        if byte_range is not None:
+            start, stop = byte_range
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+
+    length = stop - start
+    headers['Content-Length'] = str(length)
+    if request.method == 'HEAD':
+        body = []
+    elif request.environ.get('SERVER_SOFTWARE', '').startswith('gunicorn'):
+        # gunicorn sendfile()s a file wrapper from the current offset up to
+        # Content-Length, so the bytes never pass through Python
+        f = open(path, 'rb')
+        f.seek(start)
+        body = wrap_file(request.environ, f, CHUNK_SIZE)
+    else:
+        body = _read_range(path, start, length)
+
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    return Response(body, status=status, headers=headers, mimetype=mimetype, direct_passthrough=True)
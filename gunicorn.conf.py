@@ -0,0 +1,17 @@
+# Loaded automatically by gunicorn from the working directory.
+# Command line flags (bind, timeout) are still set in Dockerfile/docker-compose.yml.
+import os
+
+# Progress streams (/progress/stream, /api/progress/stream) stay open for the
+# whole download, so serve requests from threads instead of sync workers.
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '64'))
+
+
+def worker_exit(server, worker):
+    """Write out queued request logs before the worker process goes away"""
+    try:
+        from request_logger import log_writer
+        log_writer.close()
+    except Exception as e:
+        server.log.warning(f"Could not flush request logs: {e}")
@@ -0,0 +1,358 @@
+import heapq
+import itertools
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from cancellation import CancelToken, current_job
+from downloader_global import download_sessions
+
+# Number of downloads allowed to run at the same time in this process
+DOWNLOAD_WORKERS = int(os.environ.get('DOWNLOAD_WORKERS', '4'))
+# Jobs waiting for a worker beyond this count are rejected (backpressure)
+DOWNLOAD_QUEUE_SIZE = int(os.environ.get('DOWNLOAD_QUEUE_SIZE', '50'))
+# URLs of one multi-URL batch downloaded at the same time, at most
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', '3'))
+# Rough duration of one job, used to compute the Retry-After hint
+AVERAGE_JOB_SECONDS = int(os.environ.get('AVERAGE_JOB_SECONDS', '30'))
+# How often running jobs look for a cancellation made through another worker
+CANCEL_POLL_SECONDS = float(os.environ.get('CANCEL_POLL_SECONDS', '1'))
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 10
+PRIORITY_LOW = 20
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the download queue is full"""
+
+    def __init__(self, retry_after):
+        super().__init__("Download queue is full, please retry later")
+        self.retry_after = retry_after
+
+
+class JobScheduler:
+    """
+    Bounded worker pool with a priority queue for download jobs.
+
+    Jobs with the same priority run in FIFO order. While a job waits, its
+    position in the queue is written to the shared session store so the
+    existing /progress and /api/progress endpoints can report it; all
+    positions go in one transaction, outside the scheduler lock.
+
+    At most `workers` transfers run at once. A running job can borrow idle
+    slots for extra parallel work (see run_batch); queued jobs then wait
+    until the borrowed slots are given back. A job waiting on CPU-bound
+    work elsewhere lends its slot back meanwhile (see slot_released).
+
+    cancel() drops a queued job right away and stops a running one through
+    its CancelToken. Jobs also stop when their session is cancelled by
+    another worker, within about CANCEL_POLL_SECONDS.
+    """
+
+    def __init__(self, workers=DOWNLOAD_WORKERS, max_queue=DOWNLOAD_QUEUE_SIZE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._queue = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._active = 0
+        self._borrowed = 0
+        self._threads = []
+        # Worker threads whose job released its slot; each one is replaced
+        # by an extra thread until the job is over
+        self._parked = 0
+        self._holder = threading.local()
+        # Tokens of the running jobs; one browser session can have several
+        self._running = set()
+        # Queue positions are written to the session store in batches
+        self._positions_lock = threading.Lock()
+        self._positions_version = 0
+        self._positions_written = 0
+        self._started = False
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self.released = 0
+
+    def _add_worker(self):
+        # Caller must hold self._lock
+        thread = threading.Thread(target=self._worker, name=f"download-worker-{len(self._threads)}", daemon=True)
+        self._threads.append(thread)
+        thread.start()
+
+    def _surplus(self):
+        # Caller must hold self._lock; the calling worker thread exits if True
+        if len(self._threads) <= self.workers + self._parked:
+            return False
+        self._threads.remove(threading.current_thread())
+        return True
+
+    def _start(self):
+        if self._started:
+            return
+        self._started = True
+        for _ in range(self.workers):
+            self._add_worker()
+        threading.Thread(target=self._watch_cancellations, name="download-cancel-watcher", daemon=True).start()
+        print(f"[Scheduler] Started {self.workers} download worker(s), queue size {self.max_queue}.")
+
+    def _retry_after(self):
+        # Caller must hold self._lock
+        waiting = len(self._queue)
+        return max(1, int((waiting / max(self.workers, 1) + 1) * AVERAGE_JOB_SECONDS))
+
+    def submit(self, session_id, func, priority=PRIORITY_NORMAL, on_cancel=None):
+        """
+        Queue func to run on the worker pool.
+
+        on_cancel is called instead of func when the job is cancelled before
+        it starts. Raises QueueFullError when the queue is already holding
+        max_queue jobs.
+        """
+        with self._lock:
+            self._start()
+            if len(self._queue) >= self.max_queue:
+                self.rejected += 1
+                raise QueueFullError(self._retry_after())
+            heapq.heappush(self._queue, (priority, next(self._counter), session_id, func, on_cancel))
+            positions = self._positions()
+            self._not_empty.notify_all()
+        self._write_positions(positions)
+
+    def _positions(self):
+        # Caller must hold self._lock; pass the result to _write_positions() after releasing it
+        self._positions_version += 1
+        order = {entry[2]: position for position, entry in enumerate(sorted(self._queue), start=1)}
+        return self._positions_version, order
+
+    def _write_positions(self, positions):
+        # Outside self._lock, so submissions never wait for the session database.
+        # Snapshots can arrive out of order; an older one must not undo a newer one.
+        version, order = positions
+        with self._positions_lock:
+            if version <= self._positions_written:
+                return
+            self._positions_written = version
+            download_sessions.set_queue_positions(order)
+
+    def cancel(self, session_id):
+        """
+        Remove session_id's jobs from the queue and stop the ones running
+        in this process. Returns whether a job was found.
+        """
+        positions = None
+        with self._lock:
+            queued = [entry for entry in self._queue if entry[2] == session_id]
+            if queued:
+                self._queue = [entry for entry in self._queue if entry[2] != session_id]
+                heapq.heapify(self._queue)
+                self.cancelled += len(queued)
+                positions = self._positions()
+            tokens = [token for token in self._running if token.session_id == session_id]
+        if positions is not None:
+            self._write_positions(positions)
+        for entry in queued:
+            self._discard(entry)
+        for token in tokens:
+            token.cancel()
+        return bool(queued or tokens)
+
+    @staticmethod
+    def _discard(entry):
+        on_cancel = entry[4]
+        if on_cancel is not None:
+            try:
+                on_cancel()
+            except Exception as e:
+                print(f"[Scheduler] Cleanup of cancelled job {entry[2]} failed: {e}")
+
+    def _watch_cancellations(self):
+        while True:
+            time.sleep(CANCEL_POLL_SECONDS)
+            with self._lock:
+                running = list(self._running)
+            for token in running:
+                try:
+                    if not token.is_cancelled() and download_sessions.is_cancelled(token.session_id):
+                        print(f"[Scheduler] Job {token.session_id} was cancelled, stopping it")
+                        token.cancel()
+                except Exception as e:
+                    print(f"[Scheduler] Error checking cancellation of {token.session_id}: {e}")
+
+    def _worker(self):
+        while True:
+            with self._not_empty:
+                while not self._queue or self._active >= self.workers:
+                    if self._surplus():
+                        return
+                    self._not_empty.wait()
+                entry = heapq.heappop(self._queue)
+                _, _, session_id, func, _ = entry
+                self._active += 1
+                positions = self._positions()
+                token = CancelToken(session_id)
+                self._running.add(token)
+            self._holder.held, self._holder.borrowed = True, False
+            self._write_positions(positions)
+
+            if download_sessions.is_cancelled(session_id):
+                # Cancelled through another worker while it was queued here
+                token.cancel()
+                self._discard(entry)
+            else:
+                download_sessions.start(session_id)
+
+            try:
+                if not token.is_cancelled():
+                    with token.bound():
+                        func()
+                if token.is_cancelled():
+                    self.cancelled += 1
+                else:
+                    self.completed += 1
+            except Exception as e:
+                if token.is_cancelled():
+                    self.cancelled += 1
+                else:
+                    self.failed += 1
+                    print(f"[Scheduler] Job {session_id} failed: {e}")
+                    download_sessions.update(session_id, status=f"Error: {str(e)}")
+            finally:
+                with self._lock:
+                    self._running.discard(token)
+                    self._active -= 1
+                    self._holder.held = False
+                    self._not_empty.notify_all()
+                    if self._surplus():
+                        return
+
+    def try_borrow(self):
+        """Take an idle worker slot for extra work, without waiting"""
+        with self._lock:
+            if self._active >= self.workers:
+                return False
+            self._active += 1
+            self._borrowed += 1
+            return True
+
+    def give_back(self):
+        with self._lock:
+            self._active -= 1
+            self._borrowed -= 1
+            self._not_empty.notify_all()
+
+    @contextmanager
+    def slot_released(self):
+        """
+        Let queued jobs use the calling job's slot while the block runs.
+
+        For steps that wait on another pool (see postprocess.py), so downloads
+        keep going while a job waits for CPU. The slot is taken back, waiting
+        if needed, when the block ends. Outside a job this does nothing.
+        """
+        holder = self._holder
+        if not getattr(holder, 'held', False):
+            yield
+            return
+        borrowed = holder.borrowed
+        with self._lock:
+            self._active -= 1
+            if borrowed:
+                self._borrowed -= 1
+            else:
+                # This worker thread stays busy with the job, another one takes the queue
+                self._parked += 1
+                if len(self._threads) < self.workers + self._parked:
+                    self._add_worker()
+            holder.held = False
+            self.released += 1
+            self._not_empty.notify_all()
+        try:
+            yield
+        finally:
+            with self._not_empty:
+                while self._active >= self.workers:
+                    self._not_empty.wait()
+                self._active += 1
+                if borrowed:
+                    self._borrowed += 1
+                else:
+                    self._parked -= 1
+                holder.held = True
+
+    def run_batch(self, items, func, limit=BATCH_CONCURRENCY):
+        """
+        Call func(index, item) for every item and return a list of
+        (succeeded, result_or_exception) in item order.
+
+        Called from inside a job: the job's own thread works through the
+        items, helped by up to limit - 1 threads on borrowed idle slots. One
+        failing item does not stop the others; cancelling the job does.
+        """
+        pending = queue.SimpleQueue()
+        for index, item in enumerate(items):
+            pending.put((index, item))
+        results = [None] * len(items)
+        token = current_job()
+
+        def drain():
+            while True:
+                try:
+                    index, item = pending.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    if token is not None:
+                        token.check()
+                    results[index] = (True, func(index, item))
+                except Exception as e:
+                    results[index] = (False, e)
+
+        def borrowed():
+            self._holder.held, self._holder.borrowed = True, True
+            try:
+                if token is not None:
+                    # Helpers work for the same job, so they stop with it
+                    with token.bound():
+                        drain()
+                else:
+                    drain()
+            finally:
+                self.give_back()
+
+        helpers = []
+        for _ in range(min(limit, len(items)) - 1):
+            if not self.try_borrow():
+                break
+            helper = threading.Thread(target=borrowed, daemon=True)
+            helper.start()
+            helpers.append(helper)
+
+        drain()
+        for helper in helpers:
+            helper.join()
+        return results
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "active": self._active,
+                "borrowed": self._borrowed,
+                "queued": len(self._queue),
+                "max_queue": self.max_queue,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "cancelled": self.cancelled,
+                "slots_released": self.released,
+                "threads": len(self._threads),
+            }
+
+
+scheduler = JobScheduler()
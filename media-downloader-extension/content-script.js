@@ -134,6 +134,8 @@
   // For production: 'https://pyd.snpsujon.me'
   // For local development: 'http://127.0.0.1:5000' (or 'http://127.0.0.1:5020' if using Docker)
   const BASE_URL = 'http://127.0.0.1:5000';
+  // Consecutive stream errors before giving up on Server-Sent Events
+  const MAX_STREAM_ERRORS = 3;
 
   function updateButtonState(state, progress = 0) {
     const states = {
@@ -233,51 +235,88 @@
       const sessionId = data.session_id;
       updateButtonState('downloading', 0);
 
-      const poll = setInterval(async () => {
-        try {
-          const progressRes = await fetch(`${BASE_URL}/api/progress`, {
-            method: 'GET',
-            headers: {
-              'X-Session-ID': sessionId
-            }
-          });
-          const progress = await progressRes.json();
+      // Returns true once the download has finished (successfully or not)
+      const handleProgress = (progress) => {
+        const percent = parseFloat(progress.percent) || 0;
 
-          const percent = parseFloat(progress.percent) || 0;
+        if (progress.status === 'Completed' && progress.filename) {
+          updateButtonState('ready', 100);
 
-          if (progress.status === 'Completed' && progress.filename) {
-            clearInterval(poll);
-            updateButtonState('ready', 100);
+          const downloadUrl = `${BASE_URL}/downloads/${progress.filename}`;
+          const a = document.createElement('a');
+          a.href = downloadUrl;
+          a.download = progress.filename;
+          document.body.appendChild(a);
+          a.click();
+          a.remove();
 
-            const downloadUrl = `${BASE_URL}/downloads/${progress.filename}`;
-            const a = document.createElement('a');
-            a.href = downloadUrl;
-            a.download = progress.filename;
-            document.body.appendChild(a);
-            a.click();
-            a.remove();
+          updateButtonState('complete', 100);
+          setTimeout(() => {
+            updateButtonState('idle', 0);
+          }, 3000);
+          return true;
+        } else if (progress.status.startsWith('Error')) {
+          updateButtonState('error', 0);
+          setTimeout(() => {
+            updateButtonState('idle', 0);
+          }, 3000);
+          return true;
+        }
+        updateButtonState('downloading', percent);
+        return false;
+      };
 
-            updateButtonState('complete', 100);
-            setTimeout(() => {
-              updateButtonState('idle', 0);
-            }, 3000);
-          } else if (progress.status.startsWith('Error')) {
+      // Fallback when Server-Sent Events are not available
+      const pollProgress = () => {
+        const poll = setInterval(async () => {
+          try {
+            const progressRes = await fetch(`${BASE_URL}/api/progress`, {
+              method: 'GET',
+              headers: {
+                'X-Session-ID': sessionId
+              }
+            });
+            if (handleProgress(await progressRes.json())) {
+              clearInterval(poll);
+            }
+          } catch (e) {
             clearInterval(poll);
             updateButtonState('error', 0);
             setTimeout(() => {
               updateButtonState('idle', 0);
             }, 3000);
-          } else {
-            updateButtonState('downloading', percent);
           }
-        } catch (e) {
-          clearInterval(poll);
-          updateButtonState('error', 0);
-          setTimeout(() => {
-            updateButtonState('idle', 0);
-          }, 3000);
-        }
-      }, 2000);
+        }, 2000);
+      };
+
+      if (window.EventSource) {
+        let finished = false;
+        let errors = 0;
+        const source = new EventSource(`${BASE_URL}/api/progress/stream?session_id=${encodeURIComponent(sessionId)}`);
+        source.onopen = () => {
+          errors = 0;
+        };
+        source.addEventListener('progress', (event) => {
+          errors = 0;
+          if (handleProgress(JSON.parse(event.data))) {
+            finished = true;
+            source.close();
+          }
+        });
+        source.onerror = () => {
+          // EventSource reconnects by itself; poll only once that keeps failing
+          errors += 1;
+          if (source.readyState !== EventSource.CLOSED && errors < MAX_STREAM_ERRORS) {
+            return;
+          }
+          source.close();
+          if (!finished) {
+            pollProgress();
+          }
+        };
+      } else {
+        pollProgress();
+      }
     } catch (error) {
       console.error('Download error:', error);
       updateButtonState('error', 0);
@@ -7,6 +7,8 @@ const urlInput = document.getElementById('url');
 const emptyState = document.getElementById('empty-state');
 
 const activeDownloads = new Map();
+// Consecutive stream errors before giving up on Server-Sent Events
+const MAX_STREAM_ERRORS = 3;
 
 // Auto-fill URL from current tab
 document.addEventListener('DOMContentLoaded', () => {
@@ -63,7 +65,11 @@ function createDownloadCard(downloadId) {
 
   document.getElementById(`cancel-${downloadId}`).addEventListener('click', () => {
     if (activeDownloads.has(downloadId)) {
-      clearInterval(activeDownloads.get(downloadId).intervalId);
+      const watcher = activeDownloads.get(downloadId);
+      clearInterval(watcher.intervalId);
+      if (watcher.source) {
+        watcher.source.close();
+      }
       activeDownloads.delete(downloadId);
     }
     card.remove();
@@ -135,61 +141,104 @@ submitBtn.addEventListener('click', async () => {
       const linkEl = document.getElementById(`link-${downloadId}`);
       const cardEl = document.getElementById(`download-${downloadId}`);
 
-      const intervalId = setInterval(async () => {
-        try {
-          const progressRes = await fetch(`${BASE_URL}/api/progress`, {
-            method: 'GET',
-            headers: {
-              'X-Session-ID': downloadId
-            }
-          });
-          const progress = await progressRes.json();
-
-          const status = progress.status || 'Unknown';
-          const percent = progress.percent || '0%';
-          const percentNum = parseFloat(percent) || 0;
-
-          // Update status and icon
-          statusEl.textContent = `${status} ${percent !== '0%' ? `(${percent})` : ''}`;
-          iconEl.textContent = getStatusIcon(status);
-          
-          // Update progress bar
-          progressFillEl.style.width = `${percentNum}%`;
-          progressTextEl.textContent = percent;
-
-          if (status === 'Completed' && progress.filename) {
-            clearInterval(intervalId);
-            activeDownloads.delete(downloadId);
-            
-            linkEl.href = `${BASE_URL}/downloads/${progress.filename}`;
-            linkEl.classList.remove('hidden');
-            statusEl.textContent = '✅ Download completed';
-            iconEl.textContent = '✅';
-            cardEl.classList.add('success-state');
-            progressFillEl.style.width = '100%';
-            progressTextEl.textContent = '100%';
+      const stopWatching = () => {
+        const watcher = activeDownloads.get(downloadId);
+        if (watcher) {
+          clearInterval(watcher.intervalId);
+          if (watcher.source) {
+            watcher.source.close();
           }
+        }
+        activeDownloads.delete(downloadId);
+      };
 
-          if (status.startsWith('Error')) {
-            clearInterval(intervalId);
-            activeDownloads.delete(downloadId);
-            statusEl.textContent = `❌ ${status}`;
-            iconEl.textContent = '❌';
-            cardEl.classList.add('error-state');
-            progressFillEl.style.width = '100%';
-            progressTextEl.textContent = 'Error';
-          }
-        } catch (e) {
-          clearInterval(intervalId);
-          activeDownloads.delete(downloadId);
-          statusEl.textContent = '❌ Error fetching progress';
+      // Updates the card, returns true once the download has finished
+      const handleProgress = (progress) => {
+        const status = progress.status || 'Unknown';
+        const percent = progress.percent || '0%';
+        const percentNum = parseFloat(percent) || 0;
+
+        // Update status and icon
+        statusEl.textContent = `${status} ${percent !== '0%' ? `(${percent})` : ''}`;
+        iconEl.textContent = getStatusIcon(status);
+        
+        // Update progress bar
+        progressFillEl.style.width = `${percentNum}%`;
+        progressTextEl.textContent = percent;
+
+        if (status === 'Completed' && progress.filename) {
+          linkEl.href = `${BASE_URL}/downloads/${progress.filename}`;
+          linkEl.classList.remove('hidden');
+          statusEl.textContent = '✅ Download completed';
+          iconEl.textContent = '✅';
+          cardEl.classList.add('success-state');
+          progressFillEl.style.width = '100%';
+          progressTextEl.textContent = '100%';
+          return true;
+        }
+
+        if (status.startsWith('Error')) {
+          statusEl.textContent = `❌ ${status}`;
           iconEl.textContent = '❌';
           cardEl.classList.add('error-state');
-          progressFillEl.style.background = 'linear-gradient(90deg, #ff6b6b 0%, #ee5a6f 100%)';
+          progressFillEl.style.width = '100%';
+          progressTextEl.textContent = 'Error';
+          return true;
         }
-      }, 2000);
+        return false;
+      };
 
-      activeDownloads.set(downloadId, { intervalId });
+      // Fallback when Server-Sent Events are not available
+      const pollProgress = () => {
+        const intervalId = setInterval(async () => {
+          try {
+            const progressRes = await fetch(`${BASE_URL}/api/progress`, {
+              method: 'GET',
+              headers: {
+                'X-Session-ID': downloadId
+              }
+            });
+            if (handleProgress(await progressRes.json())) {
+              stopWatching();
+            }
+          } catch (e) {
+            stopWatching();
+            statusEl.textContent = '❌ Error fetching progress';
+            iconEl.textContent = '❌';
+            cardEl.classList.add('error-state');
+            progressFillEl.style.background = 'linear-gradient(90deg, #ff6b6b 0%, #ee5a6f 100%)';
+          }
+        }, 2000);
+        activeDownloads.set(downloadId, { intervalId });
+      };
+
+      if (window.EventSource) {
+        let errors = 0;
+        const source = new EventSource(`${BASE_URL}/api/progress/stream?session_id=${encodeURIComponent(downloadId)}`);
+        source.onopen = () => {
+          errors = 0;
+        };
+        source.addEventListener('progress', (event) => {
+          errors = 0;
+          if (handleProgress(JSON.parse(event.data))) {
+            stopWatching();
+          }
+        });
+        source.onerror = () => {
+          // EventSource reconnects by itself; poll only once that keeps failing
+          errors += 1;
+          if (source.readyState !== EventSource.CLOSED && errors < MAX_STREAM_ERRORS) {
+            return;
+          }
+          source.close();
+          if (activeDownloads.has(downloadId)) {
+            pollProgress();
+          }
+        };
+        activeDownloads.set(downloadId, { source });
+      } else {
+        pollProgress();
+      }
 
     } else {
       alert('❌ Failed to start download. Please check the URL and try again.');
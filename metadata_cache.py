@@ -0,0 +1,321 @@
+import copy
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from yt_dlp.extractor import gen_extractor_classes
+from yt_dlp.utils import DownloadError, ReExtractInfo
+
+from downloader_global import STATE_FOLDER
+from single_flight import extraction_flight
+
+CACHE_FOLDER = os.path.join(STATE_FOLDER, 'metadata_cache')
+os.makedirs(CACHE_FOLDER, exist_ok=True)
+
+# Number of info dicts kept in memory by each worker
+MEMORY_CACHE_SIZE = int(os.environ.get('METADATA_CACHE_SIZE', '256'))
+DEFAULT_TTL = int(os.environ.get('METADATA_CACHE_TTL', '1800'))
+# How long permanent failures (private, removed...) are remembered
+NEGATIVE_TTL = int(os.environ.get('METADATA_NEGATIVE_TTL', '300'))
+
+# Per-extractor TTLs in seconds. Signed media URLs expire, so keep these
+# well below the lifetime of the links the extractor hands out.
+EXTRACTOR_TTLS = {
+    'Youtube': 1800,
+    'Instagram': 600,
+    'Facebook': 600,
+    'TikTok': 600,
+    'Twitter': 900,
+}
+for _item in os.environ.get('METADATA_CACHE_TTLS', '').split(','):
+    if '=' in _item:
+        _key, _ttl = _item.split('=', 1)
+        EXTRACTOR_TTLS[_key.strip()] = int(_ttl)
+
+# Error messages that will not change if we retry in a few seconds
+PERMANENT_ERRORS = (
+    'private video',
+    'video unavailable',
+    'has been removed',
+    'account associated with this video has been terminated',
+    'does not exist',
+    'unsupported url',
+    'not available in your country',
+)
+
+# Temp files older than this belong to a writer that died before renaming them
+STALE_TMP_SECONDS = 3600
+_EXPIRES_RE = re.compile(r'\{"expires": ([0-9.eE+-]+)[,}]')
+
+_EXTRACTORS = [ie for ie in gen_extractor_classes() if ie.ie_key() != 'Generic']
+
+
+# Extractors that take a video URL carrying a playlist (watch?v=A&list=L)
+_PLAYLIST_EXTRACTORS = ('YoutubeTab', 'YoutubeYtBe')
+_PLAYLIST_PARAMS = ('list', 'index', 'start_radio', 'pp')
+
+
+def _match(url):
+    for ie in _EXTRACTORS:
+        if ie.suitable(url):
+            video_id = ie.get_temp_id(url)
+            return (ie.ie_key(), str(video_id)) if video_id else (ie.ie_key(), None)
+    return None, None
+
+
+@lru_cache(maxsize=4096)
+def video_identity(url):
+    """
+    Work out (extractor key, video id) for a URL without any network access.
+
+    Different URLs of the same video (youtu.be, watch?v=..&t=30, shorts/...)
+    map to the same identity. A video opened from a playlist is identified
+    by the video, not the playlist; whether the playlist is extracted too
+    depends on noplaylist, which callers key on separately. Returns None if
+    no specific extractor matches.
+    """
+    url = url.strip()
+    ie_key, video_id = _match(url)
+    if ie_key in _PLAYLIST_EXTRACTORS:
+        parts = urlsplit(url)
+        query = [(name, value) for name, value in parse_qsl(parts.query) if name not in _PLAYLIST_PARAMS]
+        video_ie_key, video_video_id = _match(urlunsplit(parts._replace(query=urlencode(query))))
+        if video_ie_key == 'Youtube' and video_video_id:
+            return video_ie_key, video_video_id
+    if video_id:
+        return ie_key, video_id
+    return None
+
+
+class MetadataCache:
+    """
+    Two-tier cache for extract_info results.
+
+    A small LRU in each worker sits in front of a directory of JSON files in
+    STATE_FOLDER that every gunicorn worker on the host can read. Entries are
+    keyed by (profile, noplaylist, extractor, video id) rather than the raw URL.
+    Expired files are removed by sweep(), from the storage manager's pass.
+    """
+
+    def __init__(self, folder=CACHE_FOLDER, max_entries=MEMORY_CACHE_SIZE):
+        self.folder = folder
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def key(self, profile, identity, noplaylist=False):
+        # A video URL inside a playlist gives the video or the whole playlist
+        return f"{profile}:{'video' if noplaylist else 'playlist'}:{identity[0]}:{identity[1]}"
+
+    def _path(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.folder, digest[:2], digest + '.json')
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, profile, identity, noplaylist=False):
+        """Return the cached entry dict ({'expires', 'info', 'error'}) or None"""
+        key = self.key(profile, identity, noplaylist)
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry['expires'] > now:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return entry
+                del self._memory[key]
+
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if entry.get('expires', 0) <= now:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+        self._count('disk_hits')
+        self._remember(key, entry)
+        return entry
+
+    def put(self, profile, identity, info=None, error=None, ttl=None, noplaylist=False):
+        key = self.key(profile, identity, noplaylist)
+        if ttl is None:
+            ttl = NEGATIVE_TTL if error else EXTRACTOR_TTLS.get(identity[0], DEFAULT_TTL)
+        entry = {'expires': time.time() + ttl, 'info': info, 'error': error}
+        self._remember(key, entry)
+
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temp file and rename so readers never see half a file
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"[Metadata Cache] Could not write {key}: {e}")
+
+    @staticmethod
+    def _expires(path):
+        # put() writes 'expires' first, so the head of the file is enough
+        with open(path, 'r', encoding='utf-8') as f:
+            head = f.read(64)
+        match = _EXPIRES_RE.match(head)
+        if match:
+            return float(match.group(1))
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('expires', 0)
+
+    def sweep(self, now=None):
+        """Remove expired entries (and temp files of dead writers) from the shared folder"""
+        now = now or time.time()
+        # Nothing written more recently than the shortest TTL can have expired
+        min_ttl = min([DEFAULT_TTL, NEGATIVE_TTL] + list(EXTRACTOR_TTLS.values()))
+        removed = 0
+        for shard in os.scandir(self.folder):
+            if not shard.is_dir(follow_symlinks=False):
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    age = now - entry.stat(follow_symlinks=False).st_mtime
+                    if entry.name.endswith('.tmp'):
+                        expired = age > STALE_TMP_SECONDS
+                    else:
+                        expired = age >= min_ttl and self._expires(entry.path) <= now
+                    if expired:
+                        os.remove(entry.path)
+                        removed += 1
+                except (OSError, ValueError):
+                    continue
+        return removed
+
+    def stats(self):
+        with self._lock:
+            return {
+                "memory_entries": len(self._memory),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+            }
+
+
+metadata_cache = MetadataCache()
+
+
+def is_permanent_error(error):
+    message = str(error).lower()
+    return any(pattern in message for pattern in PERMANENT_ERRORS)
+
+
+def options_profile(profile, **options):
+    """
+    Cache profile for a ydl_pool profile used with per-request overrides
+    (format, merge_output_format...), which change the extracted formats.
+    """
+    if not options:
+        return profile
+    return f"{profile}{json.dumps(options, sort_keys=True, separators=(',', ':'))}"
+
+
+def peek_cached_info(url, profile='default', noplaylist=False):
+    """
+    Info dict for url from the cache without extracting anything, or None.
+    Permanent failures are re-raised as DownloadError like cached_extract_info.
+    """
+    identity = video_identity(url)
+    if identity is None:
+        return None
+    entry = metadata_cache.get(profile, identity, noplaylist)
+    if entry is None:
+        return None
+    if entry.get('error'):
+        metadata_cache._count('negative_hits')
+        raise DownloadError(entry['error'])
+    return copy.deepcopy(entry['info'])
+
+
+def cached_extract_info(ydl, url, profile='default', flight=None):
+    """
+    Drop-in replacement for ydl.extract_info(url, download=False).
+
+    The profile names the options the YoutubeDL was built with, since
+    different options give different format lists for the same video.
+    Permanent failures are re-raised from the negative cache as DownloadError.
+    Concurrent misses for a URL share one extraction; callers that must run
+    their own (hedged configs) pass a distinct flight name.
+    """
+    identity = video_identity(url)
+    if identity is None:
+        return ydl.extract_info(url, download=False)
+
+    noplaylist = bool(ydl.params.get('noplaylist'))
+    entry = metadata_cache.get(profile, identity, noplaylist)
+    if entry is None:
+        def extract():
+            # Another worker may have filled the cache while we waited for the lock
+            shared = metadata_cache.get(profile, identity, noplaylist)
+            if shared is not None:
+                return shared
+            metadata_cache._count('misses')
+            try:
+                info = ydl.extract_info(url, download=False)
+            except DownloadError as e:
+                if is_permanent_error(e):
+                    metadata_cache.put(profile, identity, error=str(e), noplaylist=noplaylist)
+                raise
+            info = ydl.sanitize_info(info)
+            metadata_cache.put(profile, identity, info=info, noplaylist=noplaylist)
+            return {'info': info, 'error': None}
+
+        flight_key = metadata_cache.key(profile, identity, noplaylist) + (f"#{flight}" if flight else '')
+        entry = extraction_flight.do(flight_key, extract)
+
+    if entry.get('error'):
+        metadata_cache._count('negative_hits')
+        raise DownloadError(entry['error'])
+    return copy.deepcopy(entry['info'])
+
+
+def download_with_info(ydl, url, info):
+    """
+    Download from an info dict returned by cached_extract_info instead of
+    extracting the URL a second time (what yt-dlp does for --load-info-json).
+
+    Returns the processed info dict, whose requested_downloads list the files
+    that were written. If the media URLs in info no longer work (signed links
+    expire), the URL is extracted and downloaded again once.
+    """
+    try:
+        return ydl.process_ie_result(info, download=True)
+    except (DownloadError, ReExtractInfo) as e:
+        print(f"[Metadata Cache] Download from extracted info failed, extracting {url} again: {e}")
+        return ydl.extract_info(info.get('webpage_url') or url, download=True)
@@ -0,0 +1,163 @@
+import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from cancellation import JobCancelled, current_job, run_process
+from job_scheduler import scheduler
+
+# ffmpeg runs at most this many at once, separately from the download
+# workers; transcoding is CPU bound, so one per core
+POSTPROCESS_WORKERS = int(os.environ.get('POSTPROCESS_WORKERS', str(os.cpu_count() or 2)))
+FFMPEG_PATH = os.environ.get('FFMPEG_PATH', 'ffmpeg')
+FFPROBE_PATH = os.environ.get('FFPROBE_PATH', 'ffprobe')
+
+# Audio is delivered as mp3. Codecs listed here (e.g. 'aac,opus') are
+# delivered as they are instead, remuxed into their own container if needed
+AUDIO_PASSTHROUGH_CODECS = [codec.strip() for codec in
+                            os.environ.get('AUDIO_PASSTHROUGH_CODECS', '').split(',')
+                            if codec.strip()]
+AUDIO_BITRATE = os.environ.get('AUDIO_BITRATE', '192k')
+
+# Audio-only container for each codec ffprobe may report
+AUDIO_CONTAINERS = {
+    'mp3': 'mp3',
+    'aac': 'm4a',
+    'alac': 'm4a',
+    'opus': 'opus',
+    'vorbis': 'ogg',
+    'flac': 'flac',
+}
+
+
+class PostProcessError(Exception):
+    pass
+
+
+def audio_settings():
+    """Settings that decide what extract_audio() produces, for cache keys"""
+    return {'audio_passthrough': AUDIO_PASSTHROUGH_CODECS, 'audio_bitrate': AUDIO_BITRATE}
+
+
+def _run(args):
+    # A cancelled job kills the process (see cancellation.py)
+    stdout, stderr, returncode = run_process(args, text=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                             stdin=subprocess.DEVNULL)
+    token = current_job()
+    if token is not None:
+        token.check()
+    if returncode != 0:
+        message = (stderr or '').strip().splitlines()
+        raise PostProcessError(f"{os.path.basename(args[0])} failed: {message[-1] if message else returncode}")
+    return stdout
+
+
+def probe_audio_codec(path):
+    """Codec name of the first audio stream of path, or None"""
+    codec = _run([FFPROBE_PATH, '-v', 'error', '-select_streams', 'a:0',
+                  '-show_entries', 'stream=codec_name', '-of', 'default=noprint_wrappers=1:nokey=1', path])
+    return codec.strip() or None
+
+
+class PostProcessPool:
+    """
+    CPU-sized pool for ffmpeg work, fed by the download jobs.
+
+    A job hands its downloaded file over and waits for the result, lending
+    its download slot to queued jobs meanwhile (scheduler.slot_released()),
+    so network-bound and CPU-bound work are scheduled independently.
+    """
+
+    def __init__(self, workers=POSTPROCESS_WORKERS):
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='postprocess')
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self.counts = {'passthrough': 0, 'remuxed': 0, 'transcoded': 0, 'failed': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def run(self, func, *args):
+        """Run func(*args) on the pool for the calling job and return its result"""
+        token = current_job()
+
+        def task():
+            if token is None:
+                return func(*args)
+            token.check()
+            with token.bound():
+                return func(*args)
+
+        with self._lock:
+            self._waiting += 1
+        try:
+            with scheduler.slot_released():
+                future = self._executor.submit(task)
+                while True:
+                    try:
+                        return future.result(timeout=0.5)
+                    except TimeoutError:
+                        if token is not None and token.is_cancelled():
+                            future.cancel()
+                            raise JobCancelled()
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+    def _extract_audio(self, path):
+        codec = probe_audio_codec(path)
+        base, ext = os.path.splitext(path)
+        if codec is None:
+            raise PostProcessError("No audio stream found")
+
+        container = AUDIO_CONTAINERS.get(codec)
+        # mp3 is what a transcode would produce anyway
+        if container and (codec in AUDIO_PASSTHROUGH_CODECS or codec == 'mp3'):
+            if ext.lstrip('.').lower() == container:
+                self._count('passthrough')
+                return path
+            # Already an accepted codec, only the container changes
+            args = ['-vn', '-c:a', 'copy']
+            out_path = f"{base}.{container}"
+            kind = 'remuxed'
+        else:
+            args = ['-vn', '-c:a', 'libmp3lame', '-b:a', AUDIO_BITRATE]
+            out_path = f"{base}.mp3"
+            kind = 'transcoded'
+
+        if out_path == path:
+            out_path = f"{base}.audio.{container if kind == 'remuxed' else 'mp3'}"
+        try:
+            _run([FFMPEG_PATH, '-y', '-loglevel', 'error', '-i', path] + args + [out_path])
+        except Exception:
+            self._count('failed')
+            try:
+                os.remove(out_path)
+            except OSError:
+                pass
+            raise
+        os.remove(path)
+        self._count(kind)
+        return out_path
+
+    def extract_audio(self, path):
+        """
+        Audio file for a downloaded file: path itself if it is already an
+        accepted codec in its own container, a stream copy if only the
+        container is wrong, otherwise an mp3 transcode. The source is removed.
+        """
+        return self.run(self._extract_audio, path)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "waiting": self._waiting,
+                "passthrough_codecs": AUDIO_PASSTHROUGH_CODECS,
+                **self.counts,
+            }
+
+
+postprocess_pool = PostProcessPool()
@@ -0,0 +1,289 @@
+import json
+import os
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+from flask import Response
+
+from downloader_global import download_sessions
+
+# Minimum seconds between two events for the same session on one stream.
+# Updates in between are coalesced and only the latest one is sent.
+STREAM_MIN_INTERVAL = float(os.environ.get('PROGRESS_STREAM_MIN_INTERVAL', '0.5'))
+# How often the stream looks for changes
+STREAM_CHECK_INTERVAL = float(os.environ.get('PROGRESS_STREAM_CHECK_INTERVAL', '0.2'))
+# Streams are closed after this long; EventSource reconnects by itself
+STREAM_MAX_SECONDS = int(os.environ.get('PROGRESS_STREAM_MAX_SECONDS', '600'))
+HEARTBEAT_SECONDS = 15
+LONG_POLL_SECONDS = int(os.environ.get('PROGRESS_LONG_POLL_SECONDS', '25'))
+# Streams and long-polls held open at once by this worker process. Each one
+# occupies a gunicorn thread (gunicorn.conf.py), so past this many clients are
+# answered right away and come back later instead of starving the worker.
+PROGRESS_MAX_WAITERS = int(os.environ.get(
+    'PROGRESS_MAX_WAITERS', str(max(1, int(os.environ.get('GUNICORN_THREADS', '64')) // 2))))
+# Reconnect delay sent to event streams that were turned away
+BUSY_RETRY_MS = 5000
+
+IDLE_PROGRESS = {
+    "percent": "0%",
+    "status": "Idle",
+    "filename": None,
+    "size": None
+}
+
+
+def get_session_progress(session_id):
+    """Copy of the progress dict for session_id, or the Idle default"""
+    return dict(download_sessions.get(session_id) or IDLE_PROGRESS)
+
+
+def is_finished(progress):
+    """True once nothing will change any more (Idle means no such job)"""
+    status = progress.get('status') or ''
+    return status in ("Completed", "Cancelled", "Idle") or status.startswith("Error")
+
+
+def progress_version(progress):
+    """Short tag that changes whenever the progress dict changes"""
+    return format(zlib.crc32(json.dumps(progress, sort_keys=True, default=str).encode('utf-8')), '08x')
+
+
+def parse_session_ids(value):
+    """Split a comma separated list of session IDs"""
+    return [session_id.strip() for session_id in (value or '').split(',') if session_id.strip()]
+
+
+def parse_versions(value):
+    """Parse 'session_id:version,...' as sent back by long-poll clients"""
+    versions = {}
+    for item in parse_session_ids(value):
+        session_id, _, version = item.partition(':')
+        versions[session_id] = version
+    return versions
+
+
+class ProgressWatcher:
+    """
+    Reads the progress of every watched session for this worker process.
+
+    One thread polls the session store every STREAM_CHECK_INTERVAL for all
+    open streams and long-polls together, and wakes them through a
+    Condition when something changed. At most max_waiters can watch at once.
+    """
+
+    def __init__(self, interval=STREAM_CHECK_INTERVAL, max_waiters=PROGRESS_MAX_WAITERS):
+        self.interval = interval
+        self.max_waiters = max_waiters
+        self._changed = threading.Condition()
+        self._watched = {}  # session_id -> number of waiters
+        self._progress = {}  # session_id -> latest progress dict
+        self._generation = 0
+        self._waiters = 0
+        self._started = False
+        self.turned_away = 0
+
+    def _start(self):
+        # Caller must hold self._changed
+        if not self._started:
+            self._started = True
+            threading.Thread(target=self._run, name='progress-watcher', daemon=True).start()
+
+    @contextmanager
+    def watch(self, session_ids):
+        """
+        Watch session_ids while the block runs. Yields False, without
+        watching, when max_waiters are already waiting.
+        """
+        with self._changed:
+            if self._waiters >= self.max_waiters:
+                self.turned_away += 1
+                busy = True
+            else:
+                busy = False
+                self._waiters += 1
+                new = [session_id for session_id in session_ids if session_id not in self._watched]
+                for session_id in session_ids:
+                    self._watched[session_id] = self._watched.get(session_id, 0) + 1
+                self._start()
+                self._changed.notify_all()
+        if busy:
+            yield False
+            return
+        try:
+            if new:
+                # Current state for the first event, without waiting for the thread
+                current = download_sessions.get_many(new)
+                with self._changed:
+                    for session_id in new:
+                        self._progress.setdefault(session_id, current.get(session_id) or dict(IDLE_PROGRESS))
+            yield True
+        finally:
+            with self._changed:
+                self._waiters -= 1
+                for session_id in session_ids:
+                    self._watched[session_id] -= 1
+                    if not self._watched[session_id]:
+                        del self._watched[session_id]
+                        self._progress.pop(session_id, None)
+
+    def snapshot(self, session_ids):
+        """(generation, {session_id: progress}) for watched session_ids"""
+        with self._changed:
+            return self._generation, {
+                session_id: dict(self._progress.get(session_id) or IDLE_PROGRESS) for session_id in session_ids
+            }
+
+    def wait(self, generation, timeout):
+        """Block until a session changed after generation, or timeout"""
+        with self._changed:
+            self._changed.wait_for(lambda: self._generation != generation, timeout)
+
+    def _run(self):
+        while True:
+            with self._changed:
+                while not self._watched:
+                    self._changed.wait()
+                session_ids = list(self._watched)
+            try:
+                current = download_sessions.get_many(session_ids)
+            except Exception as e:
+                print(f"[Progress] Could not read sessions: {e}")
+                current = None
+            if current is not None:
+                with self._changed:
+                    changed = False
+                    for session_id in session_ids:
+                        if session_id not in self._watched:
+                            continue
+                        progress = current.get(session_id) or dict(IDLE_PROGRESS)
+                        if self._progress.get(session_id) != progress:
+                            self._progress[session_id] = progress
+                            changed = True
+                    if changed:
+                        self._generation += 1
+                        self._changed.notify_all()
+            time.sleep(self.interval)
+
+    def stats(self):
+        with self._changed:
+            return {
+                "waiters": self._waiters,
+                "max_waiters": self.max_waiters,
+                "sessions": len(self._watched),
+                "turned_away": self.turned_away,
+            }
+
+
+progress_watcher = ProgressWatcher()
+
+
+def sse_response(session_ids):
+    """Flask response streaming progress events for session_ids"""
+    return Response(
+        stream_progress(session_ids),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            # Stop nginx from buffering the stream
+            'X-Accel-Buffering': 'no',
+        }
+    )
+
+
+def _sse_event(session_id, progress):
+    payload = dict(progress, session_id=session_id, version=progress_version(progress))
+    return f"event: progress\ndata: {json.dumps(payload, default=str)}\n\n"
+
+
+def _current(session_ids):
+    current = download_sessions.get_many(session_ids)
+    return {session_id: current.get(session_id) or dict(IDLE_PROGRESS) for session_id in session_ids}
+
+
+def stream_progress(session_ids):
+    """
+    Server-Sent Events generator for one or more sessions.
+
+    An event is sent when a session's progress changes, at most once per
+    STREAM_MIN_INTERVAL per session. The stream ends once every session has
+    finished (or after STREAM_MAX_SECONDS). When the worker already holds
+    PROGRESS_MAX_WAITERS open, the current state is sent once and the client
+    reconnects after BUSY_RETRY_MS.
+    """
+    with progress_watcher.watch(session_ids) as watching:
+        if not watching:
+            yield f"retry: {BUSY_RETRY_MS}\n\n"
+            for session_id, progress in _current(session_ids).items():
+                yield _sse_event(session_id, progress)
+            return
+
+        last_sent = {}
+        last_sent_at = {}
+        started = time.monotonic()
+        last_write = started
+
+        yield "retry: 2000\n\n"
+        while True:
+            now = time.monotonic()
+            generation, sessions = progress_watcher.snapshot(session_ids)
+            finished = 0
+            # When the next coalesced update may be sent
+            next_send = None
+            for session_id in session_ids:
+                progress = sessions[session_id]
+                done = is_finished(progress)
+                finished += done
+                if progress == last_sent.get(session_id):
+                    continue
+                # Always send the final state right away
+                allowed_at = last_sent_at.get(session_id, 0) + STREAM_MIN_INTERVAL
+                if not done and now < allowed_at:
+                    next_send = min(next_send or allowed_at, allowed_at)
+                    continue
+                last_sent[session_id] = progress
+                last_sent_at[session_id] = now
+                last_write = now
+                yield _sse_event(session_id, progress)
+
+            if finished == len(session_ids) and all(session_id in last_sent for session_id in session_ids):
+                return
+            if now - started > STREAM_MAX_SECONDS:
+                return
+            if now - last_write > HEARTBEAT_SECONDS:
+                last_write = now
+                yield ": keep-alive\n\n"
+            timeout = HEARTBEAT_SECONDS - (now - last_write)
+            if next_send is not None:
+                # A change is already pending, only its interval is left
+                time.sleep(max(0.0, min(timeout, next_send - now)))
+            else:
+                progress_watcher.wait(generation, max(0.0, timeout))
+
+
+def _versioned(sessions):
+    for progress in sessions.values():
+        progress['version'] = progress_version(progress)
+    return sessions
+
+
+def wait_for_progress(session_ids, since=None, timeout=LONG_POLL_SECONDS):
+    """
+    Long-poll fallback: block until any session differs from the versions in
+    since ({session_id: version}) or timeout, then return the current states.
+    Returns right away when the worker already holds PROGRESS_MAX_WAITERS open.
+    """
+    since = since or {}
+    deadline = time.monotonic() + timeout
+    with progress_watcher.watch(session_ids) as watching:
+        if not watching:
+            return _versioned(_current(session_ids))
+        while True:
+            generation, sessions = progress_watcher.snapshot(session_ids)
+            _versioned(sessions)
+            changed = any(since.get(session_id) != sessions[session_id]['version'] for session_id in session_ids)
+            remaining = deadline - time.monotonic()
+            if changed or remaining <= 0:
+                return sessions
+            progress_watcher.wait(generation, remaining)
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from downloader_global import DOWNLOAD_FOLDER, STATE_FOLDER
+from file_catalog import file_catalog
+from staging import link_or_copy, publish
+
+# Finished files keyed by what produced them, so the same rendition is
+# published again as a hard link instead of being downloaded and converted
+# again. Must be on the same filesystem as DOWNLOAD_FOLDER.
+RENDITION_FOLDER = os.environ.get('RENDITION_FOLDER', os.path.join(DOWNLOAD_FOLDER, '.renditions'))
+os.makedirs(RENDITION_FOLDER, exist_ok=True)
+RENDITION_DB_FILE = os.environ.get('RENDITION_DB_FILE', os.path.join(STATE_FOLDER, 'renditions.db'))
+RENDITION_CACHE = os.environ.get('RENDITION_CACHE', 'true').lower() in ('1', 'true', 'yes')
+# Renditions no published file links to any more are kept this long after their last use
+RENDITION_MAX_IDLE = int(os.environ.get('RENDITION_MAX_IDLE', str(7 * 24 * 3600)))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS renditions (
+    key TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS rendition_counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+def rendition_key(identity, profile, **settings):
+    """
+    Key of the file produced for (extractor, video id) by an options profile
+    with the given format selector and post-processing settings.
+    """
+    raw = json.dumps([identity[0], identity[1], profile, settings], sort_keys=True)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+class RenditionCache:
+    """
+    Content-addressed store of finished downloads, shared by all workers.
+
+    A stored rendition is one hard link in RENDITION_FOLDER; every published
+    copy in DOWNLOAD_FOLDER is another link to the same data, so the link
+    count is the reference count. The storage manager removes renditions
+    once nothing links to them and they are idle or space is needed.
+    """
+
+    def __init__(self, folder=RENDITION_FOLDER, path=RENDITION_DB_FILE, enabled=RENDITION_CACHE):
+        self.folder = folder
+        self.path = path
+        self.enabled = enabled
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _count(self, conn, name):
+        conn.execute(
+            "INSERT INTO rendition_counters (name, value) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,)
+        )
+
+    def publish(self, key, name=None):
+        """
+        Publish the rendition stored under key into DOWNLOAD_FOLDER, as name
+        (with the stored file's extension) or as the name it was stored with.
+        Returns the published path, or None on a miss.
+        """
+        if not self.enabled or key is None:
+            return None
+        conn = self._connect()
+        row = conn.execute("SELECT path, name FROM renditions WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            path, stored_name = row
+            ext = os.path.splitext(path)[1]
+            try:
+                published = publish(path, name + ext if name else stored_name, keep=True)
+            except FileNotFoundError:
+                # Removed by the storage manager since
+                conn.execute("DELETE FROM renditions WHERE key = ?", (key,))
+            else:
+                # A new link shares the stored file's mtime, which the storage
+                # manager would take for its age; it was published just now
+                os.utime(published)
+                conn.execute("UPDATE renditions SET last_used = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+                self._count(conn, 'hits')
+                file_catalog.add(published)
+                return published
+        self._count(conn, 'misses')
+        return None
+
+    def store(self, key, path, name):
+        """Keep a finished file (before it is published) under key"""
+        if not self.enabled or key is None:
+            return
+        ext = os.path.splitext(path)[1]
+        shard = os.path.join(self.folder, key[:2])
+        os.makedirs(shard, exist_ok=True)
+        dest = os.path.join(shard, key + ext)
+        try:
+            link_or_copy(path, dest)
+        except FileExistsError:
+            # Another job stored the same rendition first
+            return
+        except OSError as e:
+            print(f"[Rendition Cache] Could not store {name}: {e}")
+            return
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO renditions (key, path, name, size, created, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+            (key, dest, name, os.path.getsize(dest), now, now)
+        )
+        self._count(conn, 'stores')
+
+    def last_used(self):
+        """path -> last time the rendition was stored or published"""
+        return dict(self._connect().execute("SELECT path, last_used FROM renditions"))
+
+    def forget(self, paths):
+        """Drop the entries of renditions the storage manager removed"""
+        self._connect().executemany("DELETE FROM renditions WHERE path = ?", [(path,) for path in paths])
+
+    def stats(self):
+        """Counters shared by all workers"""
+        conn = self._connect()
+        counters = dict(conn.execute("SELECT name, value FROM rendition_counters"))
+        entries, total_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM renditions").fetchone()
+        hits = counters.get('hits', 0)
+        misses = counters.get('misses', 0)
+        return {
+            "enabled": self.enabled,
+            "entries": entries,
+            "bytes": total_bytes,
+            "hits": hits,
+            "misses": misses,
+            "stores": counters.get('stores', 0),
+            "hit_ratio": round(hits / (hits + misses), 3) if hits + misses else None,
+        }
+
+
+rendition_cache = RenditionCache()
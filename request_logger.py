@@ -1,11 +1,404 @@
+import atexit
+import fcntl
 import json
 import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
 from flask import request
 import pytz
 
-# Use absolute path for log file to ensure it's saved in the correct location
-LOG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'request_logs.json')
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Legacy log formats, imported into the database once
+LOG_FILE = os.path.join(BASE_DIR, 'request_logs.json')
+LOG_FOLDER = os.path.join(BASE_DIR, 'request_logs')
+
+# SQLite database (WAL mode) shared by every gunicorn worker
+LOG_DB_FILE = os.environ.get('LOG_DB_FILE', os.path.join(BASE_DIR, 'request_logs.db'))
+LOG_LOCK_FILE = LOG_DB_FILE + '.lock'
+# Entries older than this many days are pruned (0 keeps everything)
+LOG_RETENTION_DAYS = int(os.environ.get('LOG_RETENTION_DAYS', '0'))
+# Background writer: queue bound, group commit size and flush interval
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', '10000'))
+LOG_BATCH_SIZE = int(os.environ.get('LOG_BATCH_SIZE', '200'))
+LOG_FLUSH_MS = int(os.environ.get('LOG_FLUSH_MS', '500'))
+
+BD_TIMEZONE = pytz.timezone('Asia/Dhaka')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS request_logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    ip_address TEXT,
+    platform TEXT,
+    video_id TEXT,
+    request_type TEXT,
+    format_type TEXT,
+    is_extension INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_request_logs_created_at ON request_logs (created_at);
+CREATE INDEX IF NOT EXISTS idx_request_logs_ip ON request_logs (ip_address, id);
+CREATE INDEX IF NOT EXISTS idx_request_logs_platform ON request_logs (platform, id);
+CREATE INDEX IF NOT EXISTS idx_request_logs_video_id ON request_logs (video_id, id);
+CREATE INDEX IF NOT EXISTS idx_request_logs_type ON request_logs (request_type, is_extension, id);
+"""
+
+_local = threading.local()
+_schema_ready = False
+
+
+@contextmanager
+def _log_lock():
+    """Exclusive lock shared by every thread and gunicorn worker"""
+    with open(LOG_LOCK_FILE, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _connect():
+    """Per-thread connection to the log database"""
+    global _schema_ready
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(LOG_DB_FILE, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        _local.conn = conn
+    if not _schema_ready:
+        with _log_lock():
+            conn.executescript(SCHEMA)
+            _import_legacy_logs(conn)
+        _schema_ready = True
+    return conn
+
+
+def _created_at(log_entry):
+    """Unix time of an entry from its Bangladesh-time timestamp"""
+    try:
+        naive = datetime.strptime(log_entry.get('timestamp', ''), '%Y-%m-%d %H:%M:%S')
+        return BD_TIMEZONE.localize(naive).timestamp()
+    except ValueError:
+        return time.time()
+
+
+def _row_values(log_entry):
+    video_info = log_entry.get('video_info') or {}
+    return (
+        log_entry.get('id'),
+        _created_at(log_entry),
+        log_entry.get('ip_address'),
+        video_info.get('platform'),
+        video_info.get('video_id'),
+        log_entry.get('request_type'),
+        log_entry.get('format_type'),
+        1 if log_entry.get('is_extension') else 0,
+        json.dumps(log_entry, ensure_ascii=False),
+    )
+
+
+def _insert(conn, log_entries):
+    cursor = conn.cursor()
+    for log_entry in log_entries:
+        cursor.execute(
+            "INSERT INTO request_logs (id, created_at, ip_address, platform, video_id, request_type,"
+            " format_type, is_extension, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            _row_values(log_entry)
+        )
+        log_entry['id'] = cursor.lastrowid
+
+
+def _import_legacy_logs(conn):
+    """Move request_logs.json and JSON Lines segments into the database once"""
+    legacy_files = []
+    if os.path.exists(LOG_FILE):
+        legacy_files.append(LOG_FILE)
+    if os.path.isdir(LOG_FOLDER):
+        legacy_files.extend(
+            os.path.join(LOG_FOLDER, name) for name in sorted(os.listdir(LOG_FOLDER)) if name.endswith('.jsonl')
+        )
+
+    for path in legacy_files:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                if path.endswith('.jsonl'):
+                    entries = [json.loads(line) for line in f if line.strip()]
+                else:
+                    entries = json.load(f)
+            with conn:
+                # Keep the old IDs unless they collide with existing rows
+                existing = {row[0] for row in conn.execute("SELECT id FROM request_logs")} if entries else set()
+                for entry in entries:
+                    if entry.get('id') in existing:
+                        entry['id'] = None
+                _insert(conn, entries)
+            os.rename(path, path + '.migrated')
+            print(f"[Request Log] Imported {len(entries)} entries from {path}")
+        except (OSError, ValueError, sqlite3.Error) as e:
+            print(f"[Request Log] Could not import {path}: {e}")
+
+
+def append_log_entries(log_entries):
+    """
+    Insert log_entries in one transaction and set their IDs.
+
+    IDs come from an AUTOINCREMENT key, so they only ever go up, even after
+    deletes or a reset.
+    """
+    conn = _connect()
+    with conn:
+        for log_entry in log_entries:
+            log_entry['id'] = None
+        _insert(conn, log_entries)
+
+
+def prune_logs(now=None):
+    """Delete entries older than LOG_RETENTION_DAYS"""
+    if LOG_RETENTION_DAYS <= 0:
+        return 0
+    cutoff = (now or time.time()) - LOG_RETENTION_DAYS * 86400
+    conn = _connect()
+    with conn:
+        return conn.execute("DELETE FROM request_logs WHERE created_at < ?", (cutoff,)).rowcount
+
+
+class LogWriter:
+    """
+    Background writer that takes log entries off the request path.
+
+    log_request only enqueues. A daemon thread group-commits the queue every
+    LOG_BATCH_SIZE entries or LOG_FLUSH_MS milliseconds, whichever comes
+    first. When the queue is full, new entries are dropped and counted
+    instead of blocking the caller.
+    """
+
+    def __init__(self, max_queue=LOG_QUEUE_SIZE, batch_size=LOG_BATCH_SIZE, flush_ms=LOG_FLUSH_MS):
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000.0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._closed = False
+        self._last_prune = 0
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='request-log-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, log_entry):
+        """Queue log_entry for writing. Returns False if it was dropped."""
+        if self._closed:
+            self.dropped += 1
+            return False
+        self._start()
+        try:
+            self._queue.put_nowait(log_entry)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 100 == 1:
+                print(f"[Request Log] Queue full, dropped {self.dropped} entries so far")
+            return False
+        self.enqueued += 1
+        return True
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            taken = len(batch)
+            stop = None in batch
+            batch = [entry for entry in batch if entry is not None]
+            if batch:
+                self._commit(batch)
+            if time.monotonic() - self._last_prune > 3600:
+                self._last_prune = time.monotonic()
+                try:
+                    prune_logs()
+                except sqlite3.Error as e:
+                    print(f"[Request Log] Error pruning old entries: {e}")
+            for _ in range(taken):
+                self._queue.task_done()
+            if stop:
+                return
+
+    def _commit(self, batch):
+        try:
+            append_log_entries(batch)
+            self.written += len(batch)
+            self.batches += 1
+        except Exception as e:
+            self.failed += len(batch)
+            print(f"[Request Log] Error writing {len(batch)} entries: {e}")
+
+    def flush(self, timeout=5.0):
+        """Wait until everything queued so far has been written"""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def close(self, timeout=5.0):
+        """Write out the queue and stop the thread (worker shutdown)"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches,
+        }
+
+
+log_writer = LogWriter()
+atexit.register(log_writer.close)
+
+
+def _filter_clause(filters):
+    clauses = []
+    params = []
+    if filters.get('cursor'):
+        clauses.append("id < ?")
+        params.append(int(filters['cursor']))
+    if filters.get('date_from'):
+        clauses.append("created_at >= ?")
+        params.append(_date_to_timestamp(filters['date_from']))
+    if filters.get('date_to'):
+        # Inclusive: everything before the start of the next day
+        clauses.append("created_at < ?")
+        params.append(_date_to_timestamp(filters['date_to']) + 86400)
+    for column in ('platform', 'ip_address', 'video_id', 'request_type'):
+        if filters.get(column):
+            clauses.append(f"{column} = ?")
+            params.append(filters[column])
+    if filters.get('is_extension') not in (None, ''):
+        clauses.append("is_extension = ?")
+        params.append(1 if str(filters['is_extension']).lower() in ('1', 'true', 'yes', 'on') else 0)
+    where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+    return where, params
+
+
+def _date_to_timestamp(value):
+    """'YYYY-MM-DD' (Bangladesh time) to the unix time of its midnight"""
+    return BD_TIMEZONE.localize(datetime.strptime(value, '%Y-%m-%d')).timestamp()
+
+
+def query_logs(limit=50, **filters):
+    """
+    Return (entries, next_cursor) newest first.
+
+    Pass next_cursor back as cursor= to get the following page. Filters:
+    date_from/date_to ('YYYY-MM-DD'), platform, ip_address, video_id,
+    request_type and is_extension. Reads see what is committed; entries
+    still queued in log_writer (up to LOG_FLUSH_MS old) show up next time.
+    """
+    limit = max(1, min(int(limit), 500))
+    where, params = _filter_clause(filters)
+    rows = _connect().execute(
+        f"SELECT id, data FROM request_logs{where} ORDER BY id DESC LIMIT ?", params + [limit + 1]
+    ).fetchall()
+
+    entries = []
+    for row in rows[:limit]:
+        entry = json.loads(row['data'])
+        entry['id'] = row['id']
+        entries.append(entry)
+    next_cursor = rows[limit - 1]['id'] if len(rows) > limit else None
+    return entries, next_cursor
+
+
+def count_logs(**filters):
+    filters.pop('cursor', None)
+    where, params = _filter_clause(filters)
+    return _connect().execute(f"SELECT COUNT(*) FROM request_logs{where}", params).fetchone()[0]
+
+
+def read_logs(newest_first=True):
+    """Return every stored log entry"""
+    order = 'DESC' if newest_first else 'ASC'
+    logs = []
+    for row in _connect().execute(f"SELECT id, data FROM request_logs ORDER BY id {order}"):
+        entry = json.loads(row['data'])
+        entry['id'] = row['id']
+        logs.append(entry)
+    return logs
+
+
+def iter_logs_json():
+    """Yield all log entries as chunks of one JSON array (for export)"""
+    # Own connection: the generator is consumed while the response streams
+    conn = sqlite3.connect(LOG_DB_FILE, timeout=30)
+    try:
+        yield '['
+        first = True
+        for row_id, data in conn.execute("SELECT id, data FROM request_logs ORDER BY id"):
+            entry = json.loads(data)
+            entry['id'] = row_id
+            yield ('\n' if first else ',\n') + json.dumps(entry, ensure_ascii=False)
+            first = False
+        yield '\n]\n'
+    finally:
+        conn.close()
+
+
+def clear_logs():
+    """Delete all entries. IDs keep counting up so they are never reused."""
+    # Entries logged before the reset must not be written after it
+    log_writer.flush()
+    conn = _connect()
+    with conn:
+        conn.execute("DELETE FROM request_logs")
+
+
+def delete_logs(request_ids):
+    """Delete entries by ID"""
+    log_writer.flush()
+    request_ids = [int(rid) for rid in request_ids]
+    deleted_count = 0
+    conn = _connect()
+    with conn:
+        for start in range(0, len(request_ids), 500):
+            chunk = request_ids[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            deleted_count += conn.execute(
+                f"DELETE FROM request_logs WHERE id IN ({placeholders})", chunk
+            ).rowcount
+    return deleted_count
+
 
 def get_client_ip():
     """Get the client's IP address from the request"""
@@ -18,7 +411,8 @@ def get_client_ip():
 
 def log_request(video_url, video_info=None, format_type=None, request_type='download', metadata=None, request_data=None):
     """
-    Log a video request to JSON file
+    Log a video request to the request_logs SQLite database (LOG_DB_FILE).
+    The entry is queued and written by the background log_writer in batches.
     
     Args:
         video_url: The video URL that was requested
@@ -30,15 +424,6 @@ def log_request(video_url, video_info=None, format_type=None, request_type='down
                      If not provided, will try to get from Flask request context
     """
     try:
-        # Load existing logs
-        logs = []
-        if os.path.exists(LOG_FILE):
-            try:
-                with open(LOG_FILE, 'r', encoding='utf-8') as f:
-                    logs = json.load(f)
-            except (json.JSONDecodeError, IOError):
-                logs = []
-        
         # Get request data - either from passed request_data or from Flask request context
         if request_data:
             ip_address = request_data.get('ip_address', 'Unknown')
@@ -79,7 +464,7 @@ def log_request(video_url, video_info=None, format_type=None, request_type='down
         
         # Prepare log entry
         log_entry = {
-            'id': len(logs) + 1,
+            'id': None,
             'timestamp': bd_time.strftime('%Y-%m-%d %H:%M:%S'),
             'timezone': 'Asia/Dhaka (UTC+6)',
             'ip_address': ip_address,
@@ -109,24 +494,8 @@ def log_request(video_url, video_info=None, format_type=None, request_type='down
         if metadata:
             log_entry['metadata'] = metadata
         
-        # Add to logs
-        logs.append(log_entry)
-        
-        # Keep only last 1000 entries to prevent file from growing too large
-        if len(logs) > 1000:
-            logs = logs[-1000:]
-        
-        # Save to file
-        try:
-            with open(LOG_FILE, 'w', encoding='utf-8') as f:
-                json.dump(logs, f, indent=2, ensure_ascii=False)
-            print(f"Successfully logged request: {video_url} (ID: {log_entry['id']})")
-            return True
-        except Exception as save_error:
-            print(f"Error saving log file: {save_error}")
-            import traceback
-            print(f"Traceback: {traceback.format_exc()}")
-            return False
+        # Hand over to the background writer
+        return log_writer.submit(log_entry)
     except Exception as e:
         import traceback
         print(f"Error logging request: {e}")
@@ -0,0 +1,392 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# Progress fields every session has; anything else goes into the extra JSON column
+SESSION_FIELDS = ('percent', 'status', 'filename', 'size', 'queue_position')
+# Sessions in these states are pinned and never expire by TTL
+ACTIVE_STATUSES = ('Queued', 'Downloading', 'Processing...')
+
+# Finished (completed, failed, cancelled) sessions are removed after this many seconds
+SESSION_TTL = int(os.environ.get('SESSION_TTL', '3600'))
+# Active sessions without any update for this long belong to a dead worker
+SESSION_STALE_TTL = int(os.environ.get('SESSION_STALE_TTL', str(6 * 3600)))
+# Upper bound on stored sessions; the oldest finished ones go first
+SESSION_MAX_ENTRIES = int(os.environ.get('SESSION_MAX_ENTRIES', '20000'))
+# Run an eviction pass every this many created sessions
+EVICT_EVERY = 100
+
+# Row a session's job writes its progress to: a follower's leader, the row a
+# cancelled leader handed its shared download over to, or its own
+WRITE_TARGET = "(SELECT COALESCE(follows, moved_to, session_id) FROM sessions WHERE session_id = ?)"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    follows TEXT,
+    moved_to TEXT,
+    percent TEXT,
+    status TEXT,
+    filename TEXT,
+    size TEXT,
+    queue_position INTEGER,
+    extra TEXT NOT NULL DEFAULT '{}',
+    version INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON sessions (updated_at);
+CREATE INDEX IF NOT EXISTS idx_sessions_follows ON sessions (follows);
+CREATE TABLE IF NOT EXISTS session_counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+class SessionRecord:
+    """Fixed-field progress record, much smaller than a dict per session"""
+
+    __slots__ = SESSION_FIELDS + ('extra',)
+
+    def __init__(self, percent=None, status=None, filename=None, size=None, queue_position=None, extra=None):
+        self.percent = percent
+        self.status = status
+        self.filename = filename
+        self.size = size
+        self.queue_position = queue_position
+        self.extra = extra
+
+    def as_dict(self):
+        progress = {field: getattr(self, field) for field in SESSION_FIELDS}
+        if self.extra:
+            progress.update(self.extra)
+        return progress
+
+    def __eq__(self, other):
+        if not isinstance(other, SessionRecord):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+
+class SessionStore:
+    """
+    Download progress shared by every gunicorn worker on the host.
+
+    Sessions live in a small SQLite database so a progress poll can be
+    answered by any worker, not only the one running the download. Progress
+    hooks update single fields in place, so concurrent writers never
+    overwrite each other's fields.
+
+    A session can follow another one (see link()); reads then return the
+    followed session's progress. A leader cancelled while others follow it
+    hands the download over to them (see cancel()). Finished sessions are evicted after a TTL
+    (see evict()), active ones are kept.
+    """
+
+    def __init__(self, path, ttl=SESSION_TTL, stale_ttl=SESSION_STALE_TTL, max_entries=SESSION_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+        self._created = 0
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # Progress is transient, losing the last writes on a crash is fine
+            conn.execute('PRAGMA synchronous=OFF')
+            self._local.conn = conn
+        if not self._schema_ready:
+            with self._schema_lock:
+                conn.executescript(SCHEMA)
+                self._schema_ready = True
+        return conn
+
+    @staticmethod
+    def _split(fields):
+        columns = {key: value for key, value in fields.items() if key in SESSION_FIELDS}
+        extra = {key: value for key, value in fields.items() if key not in SESSION_FIELDS}
+        return columns, extra
+
+    def create(self, session_id, **fields):
+        """Create or reset session_id with the given progress fields"""
+        columns, extra = self._split(fields)
+        names = ['session_id', 'follows', 'extra', 'updated_at'] + list(columns)
+        values = [session_id, None, json.dumps(extra), time.time()] + list(columns.values())
+        self._connect().execute(
+            f"INSERT OR REPLACE INTO sessions ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})",
+            values
+        )
+        self._created += 1
+        if self._created % EVICT_EVERY == 0:
+            self.evict()
+
+    def update(self, session_id, **fields):
+        """
+        Atomically set some fields of session_id (or of the session it follows).
+
+        A cancelled session is left as it is, so a job that has not stopped
+        yet cannot overwrite the status. Returns whether it was updated.
+        """
+        columns, extra = self._split(fields)
+        assignments = [f"{name} = ?" for name in columns]
+        values = list(columns.values())
+        for key, value in extra.items():
+            assignments.append("extra = json_set(extra, ?, json(?))")
+            values.extend([f'$.{key}', json.dumps(value)])
+        assignments.append("version = version + 1")
+        assignments.append("updated_at = ?")
+        values.append(time.time())
+        return self._connect().execute(
+            f"UPDATE sessions SET {', '.join(assignments)} "
+            f"WHERE session_id = {WRITE_TARGET} AND COALESCE(status, '') != 'Cancelled'",
+            values + [session_id]
+        ).rowcount > 0
+
+    def start(self, session_id):
+        """Mark session_id's queued job as downloading; returns whether it was queued"""
+        return self._connect().execute(
+            "UPDATE sessions SET status = 'Downloading', queue_position = 0, version = version + 1, updated_at = ? "
+            f"WHERE session_id = {WRITE_TARGET} AND status = 'Queued'",
+            (time.time(), session_id)
+        ).rowcount > 0
+
+    def cancel(self, session_id):
+        """
+        Mark session_id as cancelled. Returns the session ID whose job must
+        stop, or None when the download goes on for other sessions.
+
+        A session following another one is only unlinked. A leader with live
+        followers hands the shared download over to a new row they follow,
+        and its job keeps writing there. Once the last follower of a
+        handed-over download is gone, that download is stopped too. Finished
+        sessions are not changed.
+        """
+        conn = self._connect()
+        now = time.time()
+        placeholders = ', '.join('?' * len(ACTIVE_STATUSES))
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT follows FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            followed = row[0]
+            if followed is not None:
+                conn.execute(
+                    "UPDATE sessions SET follows = NULL, status = 'Cancelled', extra = '{}', "
+                    "version = version + 1, updated_at = ? WHERE session_id = ?",
+                    (now, session_id)
+                )
+                stop = self._orphaned(conn, followed, now)
+                conn.execute("COMMIT")
+                return stop
+
+            active = conn.execute(
+                f"SELECT 1 FROM sessions WHERE session_id = ? AND moved_to IS NULL AND status IN ({placeholders})",
+                (session_id,) + ACTIVE_STATUSES
+            ).fetchone()
+            if active is None:
+                conn.execute("COMMIT")
+                return None
+            if conn.execute("SELECT 1 FROM sessions WHERE follows = ? LIMIT 1", (session_id,)).fetchone():
+                shared = f"{session_id}@{uuid.uuid4().hex[:8]}"
+                conn.execute(
+                    "INSERT INTO sessions (session_id, percent, status, filename, size, queue_position, extra, "
+                    "version, updated_at) SELECT ?, percent, status, filename, size, queue_position, extra, "
+                    "version, ? FROM sessions WHERE session_id = ?",
+                    (shared, now, session_id)
+                )
+                conn.execute("UPDATE sessions SET follows = ? WHERE follows = ?", (shared, session_id))
+                conn.execute(
+                    "UPDATE sessions SET moved_to = ?, status = 'Cancelled', queue_position = NULL, extra = '{}', "
+                    "version = version + 1, updated_at = ? WHERE session_id = ?",
+                    (shared, now, session_id)
+                )
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE sessions SET status = 'Cancelled', queue_position = NULL, version = version + 1, "
+                "updated_at = ? WHERE session_id = ?",
+                (now, session_id)
+            )
+            conn.execute("COMMIT")
+            return session_id
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _orphaned(self, conn, shared, now):
+        # A handed-over download nobody follows any more is cancelled; returns
+        # the session ID its job runs under
+        owner = conn.execute("SELECT session_id FROM sessions WHERE moved_to = ?", (shared,)).fetchone()
+        if owner is None or conn.execute("SELECT 1 FROM sessions WHERE follows = ? LIMIT 1", (shared,)).fetchone():
+            return None
+        placeholders = ', '.join('?' * len(ACTIVE_STATUSES))
+        stopped = conn.execute(
+            f"UPDATE sessions SET status = 'Cancelled', queue_position = NULL, version = version + 1, updated_at = ? "
+            f"WHERE session_id = ? AND status IN ({placeholders})",
+            (now, shared) + ACTIVE_STATUSES
+        ).rowcount
+        return owner[0] if stopped else None
+
+    def set_queue_positions(self, positions):
+        """
+        Write the queue positions of many queued sessions in one transaction.
+
+        positions maps session_id to its position. Sessions that are no
+        longer Queued (started, cancelled) are left as they are.
+        """
+        if not positions:
+            return
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "UPDATE sessions SET queue_position = ?, version = version + 1, updated_at = ? "
+                f"WHERE session_id = {WRITE_TARGET} AND status = 'Queued' AND COALESCE(queue_position, -1) != ?",
+                [(position, now, session_id, position) for session_id, position in positions.items()]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def is_cancelled(self, session_id):
+        """Whether session_id's job must stop (a handed-over download goes on)"""
+        row = self._connect().execute(
+            f"SELECT status FROM sessions WHERE session_id = {WRITE_TARGET}", (session_id,)
+        ).fetchone()
+        return row is not None and row[0] == 'Cancelled'
+
+    def link(self, session_id, leader_session_id):
+        """Make session_id share the progress of leader_session_id"""
+        self._connect().execute(
+            "INSERT OR REPLACE INTO sessions (session_id, follows, updated_at) VALUES "
+            "(?, COALESCE((SELECT moved_to FROM sessions WHERE session_id = ?), ?), ?)",
+            (session_id, leader_session_id, leader_session_id, time.time())
+        )
+
+    def get_record(self, session_id):
+        """SessionRecord for session_id (or the session it follows), or None"""
+        if not session_id:
+            return None
+        row = self._connect().execute(
+            f"SELECT {', '.join(SESSION_FIELDS)}, extra FROM sessions "
+            "WHERE session_id = (SELECT COALESCE(follows, session_id) FROM sessions WHERE session_id = ?)",
+            (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        extra = json.loads(row[-1])
+        return SessionRecord(*row[:-1], extra=extra or None)
+
+    def get_many(self, session_ids):
+        """{session_id: progress dict} for those of session_ids that exist, in one query"""
+        session_ids = list(session_ids)
+        if not session_ids:
+            return {}
+        rows = self._connect().execute(
+            f"SELECT s.session_id, {', '.join('t.' + field for field in SESSION_FIELDS)}, t.extra "
+            "FROM sessions s JOIN sessions t ON t.session_id = COALESCE(s.follows, s.session_id) "
+            f"WHERE s.session_id IN ({', '.join('?' * len(session_ids))})",
+            session_ids
+        ).fetchall()
+        return {
+            row[0]: SessionRecord(*row[1:-1], extra=json.loads(row[-1]) or None).as_dict()
+            for row in rows
+        }
+
+    def get(self, session_id, default=None):
+        """Progress dict for session_id, or default if there is no such session"""
+        record = self.get_record(session_id)
+        if record is None:
+            return default
+        return record.as_dict()
+
+    def pop(self, session_id, default=None):
+        progress = self.get(session_id, default)
+        self._connect().execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        return progress
+
+    def __contains__(self, session_id):
+        return self._connect().execute(
+            "SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone() is not None
+
+    def evict(self, now=None):
+        """
+        Remove expired sessions and return how many were removed.
+
+        Finished sessions expire after ttl seconds. Active ones are kept
+        unless they have not been updated for stale_ttl (their worker died).
+        If the table is still over max_entries, the oldest finished sessions
+        go first. Followers of a removed session are removed with it.
+        """
+        now = now or time.time()
+        placeholders = ', '.join('?' * len(ACTIVE_STATUSES))
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # A cancelled leader stays while the download it handed over is
+            # alive, its job still writes through it
+            evicted = conn.execute(
+                f"DELETE FROM sessions WHERE follows IS NULL AND ("
+                f"(COALESCE(status, '') NOT IN ({placeholders}) AND updated_at < ? "
+                f"AND (moved_to IS NULL OR moved_to NOT IN (SELECT session_id FROM sessions))) OR updated_at < ?)",
+                ACTIVE_STATUSES + (now - self.ttl, now - self.stale_ttl)
+            ).rowcount
+
+            overflow = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                evicted += conn.execute(
+                    f"DELETE FROM sessions WHERE session_id IN (SELECT session_id FROM sessions "
+                    f"WHERE follows IS NULL AND COALESCE(status, '') NOT IN ({placeholders}) "
+                    f"ORDER BY updated_at LIMIT ?)",
+                    ACTIVE_STATUSES + (overflow,)
+                ).rowcount
+
+            evicted += conn.execute(
+                "DELETE FROM sessions WHERE follows IS NOT NULL "
+                "AND follows NOT IN (SELECT session_id FROM sessions WHERE follows IS NULL)"
+            ).rowcount
+
+            if evicted:
+                conn.execute(
+                    "INSERT INTO session_counters (name, value) VALUES ('evicted', ?) "
+                    "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                    (evicted,)
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return evicted
+
+    def stats(self):
+        """Counts of live, active and evicted sessions for monitoring"""
+        conn = self._connect()
+        placeholders = ', '.join('?' * len(ACTIVE_STATUSES))
+        live, followers, active = conn.execute(
+            f"SELECT COUNT(*), COUNT(follows), "
+            f"SUM(CASE WHEN follows IS NULL AND status IN ({placeholders}) THEN 1 ELSE 0 END) FROM sessions",
+            ACTIVE_STATUSES
+        ).fetchone()
+        evicted = conn.execute("SELECT value FROM session_counters WHERE name = 'evicted'").fetchone()
+        return {
+            "live": live,
+            "active": active or 0,
+            "followers": followers,
+            "evicted": evicted[0] if evicted else 0,
+            "ttl": self.ttl,
+            "max_entries": self.max_entries,
+        }
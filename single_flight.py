@@ -0,0 +1,241 @@
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from downloader_global import STATE_FOLDER, download_sessions
+
+FLIGHT_FOLDER = os.path.join(STATE_FOLDER, 'flights')
+os.makedirs(FLIGHT_FOLDER, exist_ok=True)
+# Lock files nobody holds are removed once they are this old
+FLIGHT_LOCK_MAX_AGE = int(os.environ.get('FLIGHT_LOCK_MAX_AGE', '3600'))
+
+
+def _flight_path(key, suffix):
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return os.path.join(FLIGHT_FOLDER, digest + suffix)
+
+
+def _open_lock(path, blocking=True):
+    """
+    Open path and lock it. Returns the open file, or None if blocking is
+    false and another holder has it.
+
+    remove_stale_locks() unlinks lock files nobody holds, so a lock taken on
+    a file that was unlinked meanwhile is dropped and taken on the new one.
+    """
+    while True:
+        f = open(path, 'a')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            if os.fstat(f.fileno()).st_ino == os.stat(path).st_ino:
+                return f
+        except BlockingIOError:
+            f.close()
+            return None
+        except FileNotFoundError:
+            pass
+        except BaseException:
+            f.close()
+            raise
+        f.close()
+
+
+@contextmanager
+def file_lock(path):
+    """Exclusive lock on path shared by every process on the host"""
+    f = _open_lock(path)
+    try:
+        yield
+    finally:
+        fcntl.flock(f, fcntl.LOCK_UN)
+        f.close()
+
+
+def remove_stale_locks(max_age=FLIGHT_LOCK_MAX_AGE, now=None):
+    """Remove lock files (and leader markers) that no process holds"""
+    now = now or time.time()
+    removed = 0
+    for entry in os.scandir(FLIGHT_FOLDER):
+        if not entry.name.endswith('.lock'):
+            continue
+        try:
+            if now - entry.stat(follow_symlinks=False).st_mtime < max_age:
+                continue
+        except OSError:
+            continue
+        f = _open_lock(entry.path, blocking=False)
+        if f is None:
+            # A flight is running
+            continue
+        try:
+            # Under the lock, so a process waiting for it notices the file is gone
+            os.remove(entry.path)
+            try:
+                # Marker of a leader whose worker died
+                os.remove(entry.path[:-len('.lock')] + '.json')
+            except OSError:
+                pass
+            removed += 1
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
+    return removed
+
+
+def download_key(scope, identity, **options):
+    """
+    Flight key of a download: the video and every option that changes the
+    files it produces (format, quality, audio mode, playlist flag...).
+    """
+    return f"{scope}:{identity[0]}:{identity[1]}:{json.dumps(options, sort_keys=True)}"
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls for the same key into one execution.
+
+    Threads of this process wait on the first caller. Other processes are
+    serialized with a lock file, so func should first check any shared cache
+    that the previous holder of the lock may have filled.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            with file_lock(_flight_path(key, '.lock')):
+                call.result = func()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class DownloadCoalescer:
+    """
+    Attach identical download requests to the job that is already running.
+
+    The follower's session is linked to the leader's session in the shared
+    session store, so it sees the same progress and final file whichever
+    gunicorn worker runs the download. The leader holds a lock file for the
+    length of the job and records its session ID next to it.
+    """
+
+    def __init__(self):
+        self._leaders = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def _read_leader(self, key):
+        # The leader writes its marker right after taking the lock
+        for _ in range(20):
+            try:
+                with open(_flight_path(key, '.json'), 'r', encoding='utf-8') as f:
+                    return json.load(f)['session_id']
+            except (OSError, ValueError, KeyError):
+                time.sleep(0.05)
+        return None
+
+    def join(self, key, session_id):
+        """
+        Return the session ID of the download already running for key, or
+        None when the caller becomes the leader and must run it.
+        """
+        with self._lock:
+            leader = self._leaders.get(key)
+            if leader is not None:
+                self.coalesced += 1
+                return leader[0]
+
+            lock_file = _open_lock(_flight_path(key, '.lock'), blocking=False)
+            if lock_file is None:
+                leader_session_id = self._read_leader(key)
+                if leader_session_id:
+                    self.coalesced += 1
+                return leader_session_id
+
+            with open(_flight_path(key, '.json'), 'w', encoding='utf-8') as f:
+                json.dump({'session_id': session_id, 'pid': os.getpid()}, f)
+            self._leaders[key] = (session_id, lock_file)
+            return None
+
+    def finish(self, key):
+        """Release key once the leader's job is over"""
+        with self._lock:
+            leader = self._leaders.pop(key, None)
+        if leader is None:
+            return
+        _, lock_file = leader
+        try:
+            os.remove(_flight_path(key, '.json'))
+        except OSError:
+            pass
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+    def attach(self, key, session_id, job):
+        """
+        Coalesce job for key into an in-flight download when there is one.
+
+        Returns the job to submit to the scheduler, or None if session_id
+        was linked to a running download instead.
+        """
+        if key is None:
+            return job
+
+        leader_session_id = self.join(key, session_id)
+        if leader_session_id is not None and leader_session_id != session_id:
+            download_sessions.link(session_id, leader_session_id)
+            return None
+        if leader_session_id == session_id:
+            # Same client asked again, its first job is still running
+            return None
+        if key not in self._leaders:
+            # Another worker holds the key but its marker is unreadable
+            return job
+
+        def leader_job():
+            try:
+                job()
+            finally:
+                self.finish(key)
+
+        return leader_job
+
+
+extraction_flight = SingleFlight()
+download_flights = DownloadCoalescer()
@@ -0,0 +1,99 @@
+import errno
+import os
+import shutil
+import time
+import uuid
+
+from downloader_global import DOWNLOAD_FOLDER
+
+# Jobs download into their own directory here and only publish finished
+# files to DOWNLOAD_FOLDER. Keep it on the same filesystem as DOWNLOAD_FOLDER
+# so publishing is a rename; a different volume works but costs a copy.
+STAGING_FOLDER = os.environ.get('STAGING_FOLDER', os.path.join(DOWNLOAD_FOLDER, '.staging'))
+os.makedirs(STAGING_FOLDER, exist_ok=True)
+
+
+def create_job_dir():
+    """New empty staging directory for one job, sharded by the first byte of its ID"""
+    job_id = uuid.uuid4().hex
+    path = os.path.join(STAGING_FOLDER, job_id[:2], job_id)
+    while True:
+        try:
+            os.makedirs(path)
+            return path
+        except FileNotFoundError:
+            # remove_stale_job_dirs() removed the empty shard in between
+            continue
+
+
+def remove_job_dir(path):
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def link_or_copy(src, dest):
+    """Create dest from src, failing with FileExistsError if dest exists"""
+    try:
+        os.link(src, dest)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    # Different filesystem: copy next to dest first so dest appears complete
+    tmp_path = os.path.join(os.path.dirname(dest), f".{uuid.uuid4().hex}.tmp")
+    try:
+        shutil.copyfile(src, tmp_path)
+        os.link(tmp_path, dest)
+    finally:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def publish(path, name, folder=DOWNLOAD_FOLDER, keep=False):
+    """
+    Move a finished file from a staging directory into folder as name.
+
+    If name is taken, ' (2)', ' (3)'... is added before the extension, so a
+    job never overwrites another job's file. With keep the source stays, as
+    a second link to the same data. Returns the published path.
+    """
+    base, ext = os.path.splitext(name)
+    for attempt in range(1, 1000):
+        candidate = name if attempt == 1 else f"{base} ({attempt}){ext}"
+        dest = os.path.join(folder, candidate)
+        try:
+            # link() never replaces an existing file, unlike rename()
+            link_or_copy(path, dest)
+        except FileExistsError:
+            continue
+        if not keep:
+            os.remove(path)
+        return dest
+    raise FileExistsError(f"No free file name for {name}")
+
+
+def remove_stale_job_dirs(max_age, now=None):
+    """Remove staging directories left behind by jobs of dead workers"""
+    now = now or time.time()
+    removed = 0
+    for shard in os.scandir(STAGING_FOLDER):
+        if not shard.is_dir(follow_symlinks=False):
+            continue
+        for entry in os.scandir(shard.path):
+            try:
+                # A running job keeps writing to some file in its directory
+                newest = max([entry.stat(follow_symlinks=False).st_mtime] +
+                             [f.stat(follow_symlinks=False).st_mtime for f in os.scandir(entry.path)])
+            except OSError:
+                continue
+            if now - newest < max_age:
+                continue
+            remove_job_dir(entry.path)
+            removed += 1
+        try:
+            # Fails while a job directory is left; create_job_dir() makes it again
+            os.rmdir(shard.path)
+        except OSError:
+            pass
+    return removed
@@ -0,0 +1,384 @@
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from downloader_global import DOWNLOAD_FOLDER, STATE_FOLDER
+from file_catalog import file_catalog
+from metadata_cache import metadata_cache
+from rendition_cache import RENDITION_FOLDER, RENDITION_MAX_IDLE, rendition_cache
+from single_flight import remove_stale_locks
+from staging import remove_stale_job_dirs
+from zip_stream import BATCH_FOLDER
+
+STORAGE_DB_FILE = os.environ.get('STORAGE_DB_FILE', os.path.join(STATE_FOLDER, 'storage.db'))
+PIN_FOLDER = os.path.join(STATE_FOLDER, 'pins')
+os.makedirs(PIN_FOLDER, exist_ok=True)
+
+# Byte quota for DOWNLOAD_FOLDER. Once usage passes the high watermark the
+# least recently accessed files are removed until it is under the low one.
+STORAGE_QUOTA_BYTES = int(float(os.environ.get('STORAGE_QUOTA_GB', '20')) * 1024 ** 3)
+STORAGE_HIGH_WATERMARK = float(os.environ.get('STORAGE_HIGH_WATERMARK', '0.9'))
+STORAGE_LOW_WATERMARK = float(os.environ.get('STORAGE_LOW_WATERMARK', '0.75'))
+# Files nobody has fetched for this long are removed regardless of the quota (0 = never)
+STORAGE_MAX_IDLE = int(os.environ.get('STORAGE_MAX_IDLE', str(24 * 3600)))
+# Never remove files younger than this, the user may not have fetched them yet
+STORAGE_MIN_AGE = int(os.environ.get('STORAGE_MIN_AGE', '600'))
+STORAGE_PASS_INTERVAL = int(os.environ.get('STORAGE_PASS_INTERVAL', '300'))
+# Staging directories untouched for this long belong to a job whose worker died
+STAGING_MAX_AGE = int(os.environ.get('STAGING_MAX_AGE', str(6 * 3600)))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS file_access (
+    name TEXT PRIMARY KEY,
+    last_access REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS storage_counters (
+    name TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+"""
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class StorageManager:
+    """
+    Keeps DOWNLOAD_FOLDER (and the rendition cache in it) under a byte quota.
+
+    Access times and counters live in a small SQLite database shared by all
+    gunicorn workers. Jobs pin the files they are writing (see pin()), and
+    pinned files are never evicted. The periodic pass is serialized with a
+    lock file so only one worker sweeps the folder at a time.
+    """
+
+    def __init__(self, folder=DOWNLOAD_FOLDER, path=STORAGE_DB_FILE, quota=STORAGE_QUOTA_BYTES,
+                 high_watermark=STORAGE_HIGH_WATERMARK, low_watermark=STORAGE_LOW_WATERMARK):
+        self.folder = folder
+        self.path = path
+        self.quota = quota
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self._local = threading.local()
+        self._started = False
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _count(self, conn, name, amount=1):
+        conn.execute(
+            "INSERT INTO storage_counters (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, amount)
+        )
+
+    def _set(self, conn, name, value):
+        conn.execute("INSERT OR REPLACE INTO storage_counters (name, value) VALUES (?, ?)", (name, value))
+
+    def record_hit(self, filename):
+        """A file from DOWNLOAD_FOLDER was served"""
+        conn = self._connect()
+        conn.execute(
+            "INSERT INTO file_access (name, last_access, hits) VALUES (?, ?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET last_access = excluded.last_access, hits = hits + 1",
+            (filename, time.time())
+        )
+        self._count(conn, 'hits')
+
+    def record_miss(self):
+        self._count(self._connect(), 'misses')
+
+    @contextmanager
+    def pin(self, prefix=''):
+        """
+        Protect the files a job creates while it runs.
+
+        Files whose name starts with prefix and that were modified after the
+        job started are skipped by eviction. An empty prefix pins every file
+        written during the job, for jobs that do not know their file names.
+        """
+        pin_path = os.path.join(PIN_FOLDER, f"{os.getpid()}-{uuid.uuid4().hex}.json")
+        with open(pin_path, 'w', encoding='utf-8') as f:
+            json.dump({'prefix': prefix, 'since': time.time() - 1, 'pid': os.getpid()}, f)
+        try:
+            yield
+        finally:
+            try:
+                os.remove(pin_path)
+            except OSError:
+                pass
+
+    def _load_pins(self):
+        pins = []
+        for entry in os.scandir(PIN_FOLDER):
+            try:
+                with open(entry.path, 'r', encoding='utf-8') as f:
+                    pin = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if not _pid_alive(pin.get('pid', 0)):
+                # The worker died in the middle of a job
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+                continue
+            pins.append(pin)
+        return pins
+
+    def _remove_finished_manifests(self):
+        for entry in os.scandir(BATCH_FOLDER):
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                with open(entry.path, 'r', encoding='utf-8') as f:
+                    items = json.load(f)['items']
+            except (OSError, ValueError, KeyError):
+                continue
+            if any(item['status'] == 'pending' for item in items):
+                continue
+            if not any(item['path'] and os.path.exists(item['path']) for item in items):
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+    def run_pass(self, force=False, now=None):
+        """
+        Evict files if needed and return the names that were removed.
+
+        Skipped (returns None) when another worker is running a pass or one
+        ran less than STORAGE_PASS_INTERVAL ago, unless force is set.
+        """
+        now = now or time.time()
+        conn = self._connect()
+        with open(self.path + '.lock', 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+            try:
+                row = conn.execute("SELECT value FROM storage_counters WHERE name = 'last_pass'").fetchone()
+                if not force and row and now - row[0] < STORAGE_PASS_INTERVAL:
+                    return None
+                return self._evict(conn, now)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _scan_renditions(self):
+        """(last_used, path, size, inode, links) of every stored rendition"""
+        last_used = rendition_cache.last_used()
+        renditions = []
+        for shard in os.scandir(RENDITION_FOLDER):
+            if not shard.is_dir(follow_symlinks=False):
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                used = last_used.get(entry.path, stat.st_mtime)
+                renditions.append((used, entry.path, stat.st_size, stat.st_ino, stat.st_nlink))
+        return renditions
+
+    def _evict(self, conn, now):
+        pins = self._load_pins()
+        accessed = dict(conn.execute("SELECT name, last_access FROM file_access"))
+
+        files = []
+        usage = 0
+        total_files = 0
+        # Published files can be hard links to a stored rendition: count the
+        # data once, and only count it freed when its last link goes
+        counted = set()
+        links = {}
+        for entry in os.scandir(self.folder):
+            try:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            if stat.st_ino not in counted:
+                counted.add(stat.st_ino)
+                usage += stat.st_size
+                links[stat.st_ino] = stat.st_nlink
+            total_files += 1
+            if now - stat.st_mtime < STORAGE_MIN_AGE:
+                continue
+            if any(entry.name.startswith(pin['prefix']) and stat.st_mtime >= pin['since'] for pin in pins):
+                continue
+            last_access = max(accessed.get(entry.name, 0), stat.st_mtime)
+            files.append((last_access, entry.name, stat.st_size, stat.st_ino))
+
+        renditions = self._scan_renditions()
+        rendition_of = {}
+        for rendition in renditions:
+            _, _, size, inode, nlink = rendition
+            rendition_of[inode] = rendition
+            if inode not in counted:
+                counted.add(inode)
+                usage += size
+                links[inode] = nlink
+
+        victims = []  # (name, path, bytes freed); name is None for a rendition
+        remaining = usage
+
+        def take_file(item):
+            nonlocal remaining
+            _, name, size, inode = item
+            links[inode] -= 1
+            freed = size if links[inode] == 0 else 0
+            victims.append((name, os.path.join(self.folder, name), freed))
+            remaining -= freed
+
+        def take_rendition(rendition):
+            nonlocal remaining
+            _, path, size, inode, _ = rendition
+            links[inode] -= 1
+            freed = size if links[inode] == 0 else 0
+            victims.append((None, path, freed))
+            remaining -= freed
+
+        def unreferenced(rendition):
+            # Only the rendition's own link is left
+            return links[rendition[3]] == 1 and rendition[1] not in taken_renditions
+
+        # Least recently accessed first
+        files.sort()
+        renditions.sort()
+        if STORAGE_MAX_IDLE:
+            for item in files:
+                if now - item[0] > STORAGE_MAX_IDLE:
+                    take_file(item)
+        taken_files = {victim[0] for victim in victims}
+        taken_renditions = set()
+        for rendition in renditions:
+            if unreferenced(rendition) and now - rendition[0] > RENDITION_MAX_IDLE:
+                take_rendition(rendition)
+                taken_renditions.add(rendition[1])
+
+        if remaining > self.quota * self.high_watermark:
+            # Cached renditions nobody links to go before users' files
+            for rendition in renditions:
+                if remaining <= self.quota * self.low_watermark:
+                    break
+                if unreferenced(rendition):
+                    take_rendition(rendition)
+                    taken_renditions.add(rendition[1])
+            for item in files:
+                if remaining <= self.quota * self.low_watermark:
+                    break
+                if item[1] in taken_files:
+                    continue
+                take_file(item)
+                rendition = rendition_of.get(item[3])
+                if rendition is not None and unreferenced(rendition):
+                    # Its last published link is gone, so is the reason to keep it
+                    take_rendition(rendition)
+                    taken_renditions.add(rendition[1])
+
+        removed = []
+        removed_renditions = []
+        freed = 0
+        for name, path, size in victims:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"[Storage] Could not delete {name or path}: {e}")
+                continue
+            freed += size
+            if name is None:
+                removed_renditions.append(path)
+                continue
+            file_catalog.remove(name)
+            removed.append(name)
+            print(f"[Storage] Evicted: {name} ({round(size / (1024 * 1024), 2)} MB)")
+        if removed_renditions:
+            rendition_cache.forget(removed_renditions)
+            print(f"[Storage] Evicted {len(removed_renditions)} cached rendition(s)")
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("DELETE FROM file_access WHERE name = ?", [(name,) for name in removed])
+            self._count(conn, 'evictions', len(removed))
+            self._count(conn, 'rendition_evictions', len(removed_renditions))
+            self._count(conn, 'evicted_bytes', freed)
+            self._count(conn, 'passes')
+            self._set(conn, 'usage_bytes', usage - freed)
+            self._set(conn, 'files', total_files - len(removed))
+            self._set(conn, 'last_pass', now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        self._remove_finished_manifests()
+        remove_stale_job_dirs(STAGING_MAX_AGE, now)
+        metadata_cache.sweep(now)
+        remove_stale_locks(now=now)
+        if removed:
+            print(f"[Storage] Pass finished: {len(removed)} file(s), {round(freed / (1024 * 1024), 2)} MB freed")
+        return removed
+
+    def start(self):
+        """Run passes in a background thread of this worker"""
+        if self._started:
+            return
+        self._started = True
+
+        def loop():
+            while True:
+                try:
+                    self.run_pass()
+                except Exception as e:
+                    print(f"[Storage] Error in storage pass: {e}")
+                time.sleep(STORAGE_PASS_INTERVAL)
+
+        threading.Thread(target=loop, daemon=True, name='storage-manager').start()
+
+    def stats(self):
+        """Usage and counters shared by all workers"""
+        counters = dict(self._connect().execute("SELECT name, value FROM storage_counters"))
+        hits = int(counters.get('hits', 0))
+        misses = int(counters.get('misses', 0))
+        return {
+            "quota_bytes": self.quota,
+            "high_watermark": self.high_watermark,
+            "low_watermark": self.low_watermark,
+            "usage_bytes": int(counters.get('usage_bytes', 0)),
+            "files": int(counters.get('files', 0)),
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / (hits + misses), 3) if hits + misses else None,
+            "evictions": int(counters.get('evictions', 0)),
+            "evicted_bytes": int(counters.get('evicted_bytes', 0)),
+            "rendition_evictions": int(counters.get('rendition_evictions', 0)),
+            "passes": int(counters.get('passes', 0)),
+            "last_pass": counters.get('last_pass'),
+        }
+
+
+storage = StorageManager()
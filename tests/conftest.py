@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+# The modules create their folders (static/downloads, state/...) relative to
+# the working directory when they are imported, so run in a scratch directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix='media-downloader-tests-')
+os.chdir(WORKDIR)
+os.environ['STATE_FOLDER'] = os.path.join(WORKDIR, 'state')
+os.environ['YTDLP_WARMUP_URLS'] = ''
+sys.path.insert(0, ROOT)
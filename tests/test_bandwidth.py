@@ -0,0 +1,92 @@
+import time
+
+import pytest
+from yt_dlp import YoutubeDL
+
+from bandwidth import BandwidthShaper
+from cancellation import CancelToken
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def shapers(tmp_path):
+    """Shapers of separate workers sharing one database"""
+    path = str(tmp_path / 'bandwidth.db')
+
+    def shaper(worker, limit=0, per_client=0):
+        return BandwidthShaper(limit=limit, per_client=per_client, path=path, worker=worker)
+    return shaper
+
+
+def transferring(shaper, lease):
+    shaper.consume(lease, 1)
+    shaper._rebalance()
+
+
+def test_limit_is_shared_between_transferring_clients(shapers):
+    shaper = shapers('w1', limit=4 * MB)
+    with shaper.lease('a1', 'client-a') as a1, shaper.lease('a2', 'client-a') as a2, \
+            shaper.lease('b1', 'client-b') as b1:
+        for lease in (a1, a2, b1):
+            transferring(shaper, lease)
+        assert b1.rate == 2 * MB
+        assert a1.rate == a2.rate == MB
+    assert shaper.stats()['jobs'] == 0
+
+
+def test_jobs_of_one_session_get_their_own_lease(shapers):
+    shaper = shapers('w1', limit=4 * MB)
+    first, second = CancelToken('session'), CancelToken('session')
+    with first.bound(), shaper.lease('session', 'client'):
+        with second.bound(), shaper.lease('session', 'client'):
+            assert shaper.stats()['jobs'] == 2
+        assert shaper.stats()['jobs'] == 1
+        assert shaper._leases.get(first) is not None
+
+
+def test_limit_holds_across_workers(shapers):
+    w1, w2 = shapers('w1', limit=4 * MB), shapers('w2', limit=4 * MB)
+    with w1.lease('a', 'client-a') as a:
+        transferring(w1, a)
+        # The other worker has nothing to transfer, so it takes no share
+        assert a.rate == 4 * MB
+        with w2.lease('b', 'client-b') as b:
+            transferring(w2, b)
+            transferring(w1, a)
+            assert a.rate == b.rate == 2 * MB
+        transferring(w1, a)
+        assert a.rate == 4 * MB
+
+
+def test_client_limit_is_split_between_its_jobs_on_all_workers(shapers):
+    w1, w2 = shapers('w1', per_client=100 * 1024), shapers('w2', per_client=100 * 1024)
+    with w1.lease('a1', 'client-a') as a1, w2.lease('a2', 'client-a') as a2:
+        transferring(w1, a1)
+        transferring(w2, a2)
+        transferring(w1, a1)
+        assert a1.rate == a2.rate == 50 * 1024
+    assert w1.stats()['shared']['workers'] == 0
+
+
+def test_progress_hook_delays_a_job_over_its_rate(shapers):
+    shaper = shapers('w1', limit=100 * 1024)
+    with CancelToken('session').bound(), shaper.lease('session', 'client') as lease, \
+            YoutubeDL({'quiet': True}) as ydl:
+        shaper.attach(ydl)
+        shaper.attach(ydl)
+        assert len(ydl._progress_hooks) == 1
+        assert ydl.params['ratelimit'] is None
+
+        hook = ydl._progress_hooks[0]
+        started = time.monotonic()
+        # 150KiB in three blocks at 100KiB/s
+        for downloaded in (50 * 1024, 100 * 1024, 150 * 1024):
+            hook({'status': 'downloading', 'tmpfilename': 'video.part', 'downloaded_bytes': downloaded})
+        assert time.monotonic() - started >= 1.2
+        assert lease.transferred == 150 * 1024
+        assert shaper.stats()['throttled_seconds'] > 0
+
+        ydl.params['external_downloader'] = {'default': 'aria2c'}
+        shaper.attach(ydl)
+        assert ydl.params['ratelimit'] == lease.rate
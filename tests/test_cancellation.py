@@ -0,0 +1,118 @@
+import threading
+import time
+import uuid
+
+import pytest
+
+from cancellation import CancelToken, current_job, run_process
+from job_scheduler import JobScheduler
+from session_store import SessionStore
+
+
+@pytest.fixture
+def sessions(tmp_path):
+    return SessionStore(str(tmp_path / 'sessions.db'))
+
+
+def leader_with_follower(sessions):
+    leader, follower = uuid.uuid4().hex, uuid.uuid4().hex
+    sessions.create(leader, percent='10%', status='Downloading')
+    sessions.link(follower, leader)
+    return leader, follower
+
+
+def test_cancelled_leader_hands_the_download_to_its_followers(sessions):
+    leader, follower = leader_with_follower(sessions)
+
+    assert sessions.cancel(leader) is None
+    assert sessions.get(leader)['status'] == 'Cancelled'
+    assert not sessions.is_cancelled(leader)
+
+    # The job still writes under the leader's ID, the follower sees it
+    assert sessions.update(leader, percent='100%', status='Completed', filename='video.mp4')
+    assert sessions.get(follower)['filename'] == 'video.mp4'
+    assert sessions.get(leader)['status'] == 'Cancelled'
+
+
+def test_last_follower_leaving_stops_a_handed_over_download(sessions):
+    leader, follower = leader_with_follower(sessions)
+    late = uuid.uuid4().hex
+    sessions.cancel(leader)
+    # Joins the running download through the leader's ID
+    sessions.link(late, leader)
+
+    assert sessions.cancel(follower) is None
+    assert not sessions.is_cancelled(leader)
+    assert sessions.cancel(late) == leader
+    assert sessions.is_cancelled(leader)
+
+
+def test_leader_without_followers_is_stopped(sessions):
+    leader, follower = leader_with_follower(sessions)
+    assert sessions.cancel(follower) is None
+    assert sessions.get(follower)['status'] == 'Cancelled'
+    assert sessions.cancel(leader) == leader
+    assert sessions.is_cancelled(leader)
+
+
+def test_running_job_goes_on_for_followers(sessions, monkeypatch):
+    import job_scheduler
+    monkeypatch.setattr(job_scheduler, 'download_sessions', sessions)
+    scheduler = JobScheduler(workers=1)
+    leader, follower = leader_with_follower(sessions)
+    release = threading.Event()
+
+    def job():
+        release.wait(5)
+        sessions.update(leader, percent='100%', status='Completed')
+
+    scheduler.submit(leader, job)
+    time.sleep(0.2)
+    stopped = sessions.cancel(leader)
+    if stopped:
+        scheduler.cancel(stopped)
+    time.sleep(job_scheduler.CANCEL_POLL_SECONDS + 0.5)
+    release.set()
+    time.sleep(0.3)
+
+    assert sessions.get(follower)['status'] == 'Completed'
+    assert scheduler.stats()['completed'] == 1
+
+
+def test_jobs_of_one_session_are_cancelled_together(sessions, monkeypatch):
+    import job_scheduler
+    monkeypatch.setattr(job_scheduler, 'download_sessions', sessions)
+    scheduler = JobScheduler(workers=2)
+    session_id = uuid.uuid4().hex
+    sessions.create(session_id, percent='0%', status='Queued')
+    first_done = threading.Event()
+    stopped = []
+
+    def first():
+        time.sleep(0.2)
+        first_done.set()
+
+    def second():
+        first_done.wait(5)
+        # Still cancellable after the first job of the session is gone
+        while not current_job().is_cancelled():
+            time.sleep(0.05)
+        stopped.append(True)
+
+    scheduler.submit(session_id, first)
+    scheduler.submit(session_id, second)
+    first_done.wait(5)
+    time.sleep(0.2)
+    assert scheduler.cancel(session_id)
+    time.sleep(0.3)
+    assert stopped == [True]
+
+
+def test_cancel_kills_the_job_processes():
+    token = CancelToken('job')
+    threading.Timer(0.2, token.cancel).start()
+    started = time.monotonic()
+    with token.bound():
+        _, _, returncode = run_process(['sleep', '10'])
+    assert returncode != 0
+    assert time.monotonic() - started < 5
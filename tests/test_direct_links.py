@@ -0,0 +1,61 @@
+from contextlib import contextmanager
+
+import pytest
+
+import api_routes
+from app import app
+
+URL = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+
+
+class FailingYDL:
+    def extract_info(self, url, download=True):
+        raise RuntimeError("minimal failed")
+
+
+class FakePool:
+    def __init__(self):
+        self.profiles = []
+
+    @contextmanager
+    def acquire(self, profile, **kwargs):
+        self.profiles.append(profile)
+        yield FailingYDL()
+
+
+@pytest.fixture
+def logged(monkeypatch):
+    calls = []
+    monkeypatch.setattr(api_routes, 'log_request', lambda url, info, *args, **kwargs: calls.append(info))
+    return calls
+
+
+def test_failed_extraction_is_logged_once(monkeypatch, logged):
+    pool = FakePool()
+    monkeypatch.setattr(api_routes, 'ydl_pool', pool)
+    monkeypatch.setattr(api_routes, 'peek_cached_info', lambda *args, **kwargs: None)
+
+    def run(*args, **kwargs):
+        raise RuntimeError("every config failed")
+    monkeypatch.setattr(api_routes.strategy_tracker, 'run', run)
+    cached = []
+    monkeypatch.setattr(api_routes, 'cached_extract_info', lambda *args, **kwargs: cached.append(args))
+
+    response = app.test_client().get('/api/direct-links', query_string={'url': URL, 'format': 'video'})
+
+    assert response.status_code == 500
+    assert logged == [None]
+    # The minimal fallback never goes through the shared cache
+    assert pool.profiles == ['minimal']
+    assert cached == []
+
+
+def test_remembered_failure_is_logged_once(monkeypatch, logged):
+    def peek(*args, **kwargs):
+        raise RuntimeError("Private video")
+    monkeypatch.setattr(api_routes, 'peek_cached_info', peek)
+
+    response = app.test_client().get('/api/direct-links', query_string={'url': URL, 'format': 'audio'})
+
+    assert response.status_code == 500
+    assert logged == [None]
@@ -0,0 +1,14 @@
+import download_engines
+from download_engines import ENGINE_DEFAULTS, engine_for, engine_options
+
+
+def test_default_engine_keeps_the_transfer_settings():
+    assert engine_for('https://www.youtube.com/watch?v=dQw4w9WgXcQ') == 'default'
+    assert engine_options('default') == ENGINE_DEFAULTS
+
+
+def test_engines_are_chosen_by_configuration(monkeypatch):
+    monkeypatch.setattr(download_engines, 'DOWNLOAD_ENGINE_BY_EXTRACTOR', {'Youtube': 'fragmented'})
+    assert engine_for('https://www.youtube.com/watch?v=dQw4w9WgXcQ') == 'fragmented'
+    monkeypatch.setattr(download_engines, 'DOWNLOAD_ENGINE', 'aggressive')
+    assert engine_for('https://example.com/video.mp4') == 'aggressive'
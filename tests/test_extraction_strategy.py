@@ -0,0 +1,109 @@
+import threading
+
+import pytest
+
+from extraction_strategy import StrategyTracker
+
+
+class Unavailable(Exception):
+    pass
+
+
+def test_circuit_opens_after_failures_in_a_row_and_recovers():
+    tracker = StrategyTracker(failure_threshold=2, cooldown=60)
+    configs = ['default', 'android']
+    tracker.record('youtube', 'default', False, error=Unavailable('429'), now=1000)
+    assert tracker.order('youtube', configs, now=1000) == ['android', 'default']
+    tracker.record('youtube', 'default', False, error=Unavailable('429'), now=1000)
+    assert tracker.order('youtube', configs, now=1001) == ['android']
+    assert tracker.stats(now=1001)['youtube']['default']['circuit'] == 'open'
+
+    # A trial run after the cooldown, failing again keeps it open
+    assert 'default' in tracker.order('youtube', configs, now=1061)
+    tracker.record('youtube', 'default', False, error=Unavailable('429'), now=1061)
+    assert tracker.order('youtube', configs, now=1062) == ['android']
+
+    tracker.record('youtube', 'default', True, seconds=1, now=1130)
+    assert tracker.order('youtube', configs, now=1130) == ['android', 'default']
+    assert tracker.stats(now=1130)['youtube']['default']['circuit'] == 'closed'
+
+
+def test_only_circuit_left_is_the_one_that_opened_first():
+    tracker = StrategyTracker(failure_threshold=1, cooldown=60)
+    tracker.record('youtube', 'default', False, now=1000)
+    tracker.record('youtube', 'android', False, now=1010)
+    assert tracker.order('youtube', ['default', 'android'], now=1020) == ['default']
+
+
+def test_configs_are_tried_until_one_succeeds():
+    tracker = StrategyTracker(failure_threshold=1, cooldown=60)
+    tried = []
+
+    def attempt(config, cancelled):
+        tried.append(config)
+        if config != 'web':
+            raise Unavailable(config)
+        return {'id': 'video'}
+
+    assert tracker.run('youtube', ['default', 'android', 'web'], attempt) == {'id': 'video'}
+    assert tried == ['default', 'android', 'web']
+    stats = tracker.stats()['youtube']
+    assert stats['default']['circuit'] == stats['android']['circuit'] == 'open'
+    assert stats['web']['successes'] == 1
+
+    with pytest.raises(Unavailable):
+        tracker.run('youtube', ['default'], lambda config, cancelled: attempt('default', cancelled))
+
+
+def test_permanent_error_stops_the_loop():
+    tracker = StrategyTracker()
+    tried = []
+
+    def attempt(config, cancelled):
+        tried.append(config)
+        raise Unavailable('Video unavailable')
+
+    with pytest.raises(Unavailable):
+        tracker.run('youtube', ['default', 'android'], attempt, is_permanent=lambda error: True)
+    assert tried == ['default']
+    # Not the config's fault, its circuit is left alone
+    assert tracker.stats()['youtube']['default']['failures'] == 0
+
+
+def test_hedge_starts_the_next_config_after_the_delay():
+    tracker = StrategyTracker(hedge_slots=1)
+    # p90 latency of 'default' is 50ms, that is its hedge delay
+    tracker.record('youtube', 'default', True, seconds=0.05)
+    slow_cancelled = threading.Event()
+
+    def attempt(config, cancelled):
+        if config == 'default':
+            # Hangs until the hedge wins
+            assert cancelled.wait(5)
+            slow_cancelled.set()
+            raise Unavailable('cancelled')
+        return {'config': config}
+
+    assert tracker.run('youtube', ['default', 'android'], attempt, hedge=True) == {'config': 'android'}
+    assert slow_cancelled.wait(5)
+    assert tracker.hedge_stats()['started'] == 1
+    assert tracker.hedge_stats()['won'] == 1
+
+
+def test_no_hedge_without_a_free_slot():
+    tracker = StrategyTracker(hedge_slots=1)
+    tracker.record('youtube', 'default', True, seconds=0.05)
+    release = threading.Event()
+    tried = []
+
+    def attempt(config, cancelled):
+        tried.append(config)
+        release.wait(5)
+        return {'config': config}
+
+    assert tracker._hedge_slots.acquire(blocking=False)
+    threading.Timer(0.3, release.set).start()
+    assert tracker.run('youtube', ['default', 'android'], attempt, hedge=True) == {'config': 'default'}
+    tracker._hedge_slots.release()
+    assert tried == ['default']
+    assert tracker.hedge_stats()['skipped_at_cap'] >= 1
@@ -0,0 +1,81 @@
+import os
+import uuid
+
+import pytest
+
+import file_serving
+from app import app
+from downloader_global import DOWNLOAD_FOLDER
+
+DATA = bytes(range(256)) * 40
+
+
+@pytest.fixture
+def download():
+    os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
+    filename = f"video_{uuid.uuid4().hex}.mp4"
+    path = os.path.join(DOWNLOAD_FOLDER, filename)
+    with open(path, 'wb') as f:
+        f.write(DATA)
+    yield f"/downloads/{filename}"
+    os.remove(path)
+
+
+def test_whole_file(download):
+    response = app.test_client().get(download)
+    assert response.status_code == 200
+    assert response.data == DATA
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.headers['Content-Length'] == str(len(DATA))
+    assert response.headers['Content-Disposition'].startswith('attachment; filename="video_')
+
+
+def test_single_range(download):
+    response = app.test_client().get(download, headers={'Range': 'bytes=100-199'})
+    assert response.status_code == 206
+    assert response.data == DATA[100:200]
+    assert response.headers['Content-Range'] == f'bytes 100-199/{len(DATA)}'
+    assert response.headers['Content-Length'] == '100'
+
+
+def test_suffix_range(download):
+    response = app.test_client().get(download, headers={'Range': 'bytes=-50'})
+    assert response.status_code == 206
+    assert response.data == DATA[-50:]
+    assert response.headers['Content-Range'] == f'bytes {len(DATA) - 50}-{len(DATA) - 1}/{len(DATA)}'
+
+
+def test_unsatisfiable_range(download):
+    response = app.test_client().get(download, headers={'Range': f'bytes={len(DATA)}-'})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{len(DATA)}'
+
+
+def test_range_of_an_older_copy_gets_the_whole_file(download):
+    response = app.test_client().get(download, headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+    assert response.status_code == 200
+    assert response.data == DATA
+
+
+def test_if_none_match(download):
+    client = app.test_client()
+    etag = client.head(download).headers['ETag']
+    response = client.get(download, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+    assert client.get(download, headers={'If-None-Match': '"other"'}).status_code == 200
+
+
+def test_x_accel_leaves_the_bytes_to_nginx(download, monkeypatch):
+    monkeypatch.setattr(file_serving, 'SERVE_MODE', 'x-accel')
+    response = app.test_client().get(download, headers={'Range': 'bytes=0-9'})
+    assert response.status_code == 200
+    assert response.data == b''
+    filename = download.rsplit('/', 1)[1]
+    assert response.headers['X-Accel-Redirect'] == file_serving.X_ACCEL_PREFIX + filename
+    assert 'ETag' in response.headers
+
+
+def test_missing_file():
+    assert app.test_client().get('/downloads/missing.mp4').status_code == 404
@@ -0,0 +1,67 @@
+import os
+import threading
+import time
+
+from metadata_cache import MetadataCache, options_profile, video_identity
+
+PLAYLIST = 'PLx0sYbCqOb8TBPRdmBHs5Iftvv9TPboYG'
+
+
+def test_videos_of_one_playlist_have_their_own_identity():
+    first = video_identity(f'https://www.youtube.com/watch?v=dQw4w9WgXcQ&list={PLAYLIST}')
+    second = video_identity(f'https://www.youtube.com/watch?v=jNQXAC9IVRw&list={PLAYLIST}&index=2')
+    assert first == ('Youtube', 'dQw4w9WgXcQ')
+    assert second == ('Youtube', 'jNQXAC9IVRw')
+
+
+def test_video_in_playlist_matches_the_plain_video_url():
+    assert video_identity(f'https://youtu.be/dQw4w9WgXcQ?list={PLAYLIST}') == \
+        video_identity('https://www.youtube.com/watch?v=dQw4w9WgXcQ')
+
+
+def test_playlist_page_keeps_playlist_identity():
+    assert video_identity(f'https://www.youtube.com/playlist?list={PLAYLIST}') == ('YoutubeTab', PLAYLIST)
+
+
+def test_noplaylist_is_part_of_the_key(tmp_path):
+    cache = MetadataCache(folder=str(tmp_path))
+    identity = ('Youtube', 'dQw4w9WgXcQ')
+    cache.put('download', identity, info={'title': 'video'}, noplaylist=True)
+    cache.put('download', identity, info={'title': 'playlist'}, noplaylist=False)
+
+    assert cache.get('download', identity, noplaylist=True)['info'] == {'title': 'video'}
+    assert cache.get('download', identity, noplaylist=False)['info'] == {'title': 'playlist'}
+    assert cache.get('formats', identity, noplaylist=True) is None
+
+
+def test_option_sets_get_their_own_profile():
+    api = options_profile('api-download-video', noplaylist=True, format='best', merge_output_format='mp4')
+    web = options_profile('download-video', noplaylist=True, format='best')
+    assert api != web
+    assert options_profile('download-video', format='best', noplaylist=True) == web
+    assert options_profile('download-video', format='worst', noplaylist=True) != web
+
+
+def test_sweep_removes_expired_entries(tmp_path):
+    cache = MetadataCache(folder=str(tmp_path))
+    cache.put('download', ('Youtube', 'dQw4w9WgXcQ'), info={'title': 'old'}, ttl=60)
+    cache.put('download', ('Youtube', 'jNQXAC9IVRw'), error='Private video', ttl=60)
+    cache.put('download', ('Youtube', 'aqz-KE-bpKQ'), info={'title': 'fresh'}, ttl=10 ** 6)
+
+    assert cache.sweep(now=time.time() + 3600) == 2
+    assert cache.get('download', ('Youtube', 'aqz-KE-bpKQ'))['info'] == {'title': 'fresh'}
+    assert len([name for _, _, names in os.walk(tmp_path) for name in names]) == 1
+
+
+def test_counters_are_not_lost_between_threads(tmp_path):
+    cache = MetadataCache(folder=str(tmp_path))
+
+    def count():
+        for _ in range(1000):
+            cache._count('misses')
+    threads = [threading.Thread(target=count) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert cache.stats()['misses'] == 8000
@@ -0,0 +1,19 @@
+import postprocess
+from postprocess import PostProcessPool
+
+
+def test_audio_is_mp3_unless_passthrough_is_enabled(monkeypatch, tmp_path):
+    commands = []
+    monkeypatch.setattr(postprocess, 'probe_audio_codec', lambda path: 'opus')
+    monkeypatch.setattr(postprocess, '_run', lambda args: commands.append(args) or open(args[-1], 'w').close())
+    pool = PostProcessPool(workers=1)
+
+    source = tmp_path / 'video.webm'
+    source.write_bytes(b'')
+    assert pool._extract_audio(str(source)) == str(tmp_path / 'video.mp3')
+    assert 'libmp3lame' in commands[-1]
+
+    monkeypatch.setattr(postprocess, 'AUDIO_PASSTHROUGH_CODECS', ['opus'])
+    source.write_bytes(b'')
+    assert pool._extract_audio(str(source)) == str(tmp_path / 'video.opus')
+    assert 'copy' in commands[-1]
@@ -0,0 +1,72 @@
+import threading
+import time
+import uuid
+
+import pytest
+
+import progress_stream
+from downloader_global import download_sessions
+from progress_stream import ProgressWatcher, progress_version, stream_progress, wait_for_progress
+
+
+@pytest.fixture
+def watcher(monkeypatch):
+    watcher = ProgressWatcher(interval=0.05, max_waiters=2)
+    monkeypatch.setattr(progress_stream, 'progress_watcher', watcher)
+    return watcher
+
+
+def new_session(**fields):
+    session_id = uuid.uuid4().hex
+    download_sessions.create(session_id, **dict({'percent': '0%', 'status': 'Downloading'}, **fields))
+    return session_id
+
+
+def test_long_poll_wakes_up_on_change(watcher):
+    session_id = new_session()
+    since = {session_id: progress_version(download_sessions.get(session_id))}
+    result = {}
+
+    def poll():
+        result.update(wait_for_progress([session_id], since, timeout=5))
+
+    thread = threading.Thread(target=poll)
+    started = time.monotonic()
+    thread.start()
+    time.sleep(0.2)
+    download_sessions.update(session_id, percent='50%')
+    thread.join(5)
+
+    assert result[session_id]['percent'] == '50%'
+    assert time.monotonic() - started < 2
+    assert watcher.stats()['waiters'] == 0
+
+
+def test_waiters_over_the_limit_are_answered_right_away(watcher):
+    session_id = new_session()
+    since = {session_id: progress_version(download_sessions.get(session_id))}
+    threads = [threading.Thread(target=wait_for_progress, args=([session_id], since, 1)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 5
+    while watcher.stats()['waiters'] < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    started = time.monotonic()
+    assert wait_for_progress([session_id], since, timeout=5)[session_id]['percent'] == '0%'
+    assert time.monotonic() - started < 0.5
+    assert watcher.stats()['turned_away'] == 1
+    for thread in threads:
+        thread.join()
+
+
+def test_stream_sends_changes_and_ends_when_finished(watcher):
+    session_id = new_session()
+    events = stream_progress([session_id])
+    assert next(events).startswith('retry:')
+    assert '"percent": "0%"' in next(events)
+
+    download_sessions.update(session_id, percent='100%', status='Completed', filename='video.mp4')
+    assert '"status": "Completed"' in next(events)
+    assert list(events) == []
+    assert watcher.stats()['sessions'] == 0
@@ -0,0 +1,42 @@
+import os
+import time
+
+from downloader_global import DOWNLOAD_FOLDER
+from metadata_cache import video_identity
+from rendition_cache import rendition_cache, rendition_key
+from staging import create_job_dir, remove_job_dir
+from storage_manager import StorageManager
+
+PLAYLIST = 'PLx0sYbCqOb8TBPRdmBHs5Iftvv9TPboYG'
+
+
+def test_videos_of_one_playlist_get_their_own_rendition():
+    first = rendition_key(video_identity(f'https://www.youtube.com/watch?v=dQw4w9WgXcQ&list={PLAYLIST}'),
+                          'download-video', noplaylist=True, format='best')
+    second = rendition_key(video_identity(f'https://www.youtube.com/watch?v=jNQXAC9IVRw&list={PLAYLIST}'),
+                           'download-video', noplaylist=True, format='best')
+    assert first != second
+
+
+def test_freshly_published_rendition_is_not_evicted(tmp_path):
+    key = rendition_key(('Youtube', 'dQw4w9WgXcQ'), 'download-video', noplaylist=True, format='best')
+    job_dir = create_job_dir()
+    staged = os.path.join(job_dir, 'video.mp4')
+    with open(staged, 'wb') as f:
+        f.write(b'x' * 1024)
+    rendition_cache.store(key, staged, 'video.mp4')
+    remove_job_dir(job_dir)
+
+    # Stored two days ago, longer than any idle limit
+    stored = os.path.join(rendition_cache.folder, key[:2], key + '.mp4')
+    old = time.time() - 2 * 24 * 3600
+    os.utime(stored, (old, old))
+
+    published = rendition_cache.publish(key, 'fresh')
+    assert os.path.samefile(os.path.dirname(published), DOWNLOAD_FOLDER)
+
+    storage = StorageManager(path=str(tmp_path / 'storage.db'), quota=1)
+    removed = storage.run_pass(force=True)
+    assert os.path.basename(published) not in removed
+    assert os.path.exists(published)
+    assert os.path.exists(stored)
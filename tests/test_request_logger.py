@@ -0,0 +1,82 @@
+import json
+import threading
+
+import pytest
+
+import request_logger
+from request_logger import append_log_entries, count_logs, query_logs
+
+
+@pytest.fixture
+def logs(tmp_path, monkeypatch):
+    db = str(tmp_path / 'request_logs.db')
+    monkeypatch.setattr(request_logger, 'LOG_DB_FILE', db)
+    monkeypatch.setattr(request_logger, 'LOG_LOCK_FILE', db + '.lock')
+    monkeypatch.setattr(request_logger, 'LOG_FILE', str(tmp_path / 'request_logs.json'))
+    monkeypatch.setattr(request_logger, 'LOG_FOLDER', str(tmp_path / 'request_logs'))
+    monkeypatch.setattr(request_logger, '_local', threading.local())
+    monkeypatch.setattr(request_logger, '_schema_ready', False)
+    return tmp_path
+
+
+def entry(day, ip='10.0.0.1', platform='youtube', request_type='download', is_extension=False):
+    return {
+        'timestamp': f'2026-10-{day:02d} 12:00:00',
+        'ip_address': ip,
+        'request_type': request_type,
+        'format_type': 'mp4',
+        'is_extension': is_extension,
+        'video_info': {'platform': platform, 'video_id': f'video{day}'},
+    }
+
+
+def test_pages_follow_the_cursor(logs):
+    append_log_entries([entry(day) for day in range(1, 8)])
+
+    seen = []
+    cursor = None
+    while True:
+        page, cursor = query_logs(limit=3, cursor=cursor)
+        seen.extend(log['video_info']['video_id'] for log in page)
+        if cursor is None:
+            break
+    assert seen == [f'video{day}' for day in range(7, 0, -1)]
+
+
+def test_filters(logs):
+    append_log_entries([
+        entry(1),
+        entry(2, ip='10.0.0.2'),
+        entry(3, platform='tiktok'),
+        entry(4, request_type='direct-links', is_extension=True),
+        entry(5),
+    ])
+
+    assert count_logs() == 5
+    assert count_logs(ip_address='10.0.0.2') == 1
+    assert count_logs(platform='tiktok') == 1
+    assert count_logs(is_extension='true') == 1
+    assert count_logs(request_type='direct-links', is_extension='true') == 1
+    page, _ = query_logs(date_from='2026-10-02', date_to='2026-10-04', platform='youtube')
+    assert [log['video_info']['video_id'] for log in page] == ['video4', 'video2']
+
+
+def test_legacy_logs_are_imported_once(logs):
+    folder = logs / 'request_logs'
+    folder.mkdir()
+    with open(folder / '2026-10-01.jsonl', 'w', encoding='utf-8') as f:
+        for day in (1, 2):
+            f.write(json.dumps(dict(entry(day), id=day)) + '\n')
+    # The oldest format goes first; the segment's entry with the same ID gets a new one
+    with open(logs / 'request_logs.json', 'w', encoding='utf-8') as f:
+        json.dump([dict(entry(3), id=2)], f)
+
+    page, _ = query_logs()
+
+    assert sorted((log['id'], log['video_info']['video_id']) for log in page) == \
+        [(1, 'video1'), (2, 'video3'), (3, 'video2')]
+    assert (folder / '2026-10-01.jsonl.migrated').exists()
+    assert (logs / 'request_logs.json.migrated').exists()
+    # New entries continue after the imported IDs
+    append_log_entries([entry(4)])
+    assert query_logs(limit=1)[0][0]['id'] == 4
@@ -0,0 +1,74 @@
+import fcntl
+import os
+import threading
+import time
+
+from metadata_cache import video_identity
+from single_flight import DownloadCoalescer, _flight_path, _open_lock, download_key, file_lock, remove_stale_locks
+
+PLAYLIST = 'PLx0sYbCqOb8TBPRdmBHs5Iftvv9TPboYG'
+
+
+def key(url, **options):
+    options = dict({'profile': 'api-download-video', 'format_type': 'mp4', 'format': 'best', 'noplaylist': True},
+                   **options)
+    return download_key('api', video_identity(url), **options)
+
+
+def test_videos_of_one_playlist_are_not_coalesced():
+    first = key(f'https://www.youtube.com/watch?v=dQw4w9WgXcQ&list={PLAYLIST}')
+    second = key(f'https://www.youtube.com/watch?v=jNQXAC9IVRw&list={PLAYLIST}')
+    assert first != second
+
+
+def test_same_video_and_options_are_coalesced():
+    assert key('https://youtu.be/dQw4w9WgXcQ') == key('https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=30')
+
+
+def test_options_that_change_the_output_are_part_of_the_key():
+    url = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+    keys = {
+        key(url),
+        key(url, format='worst'),
+        key(url, noplaylist=False),
+        key(url, profile='api-download-audio', format_type='audio', audio_bitrate='192k'),
+        key(url, profile='api-download-audio', format_type='audio', audio_bitrate='320k'),
+    }
+    assert len(keys) == 5
+
+
+def test_stale_locks_are_removed_unless_held():
+    held, idle = download_key('test', ('Youtube', 'held')), download_key('test', ('Youtube', 'idle'))
+    flights = DownloadCoalescer()
+    assert flights.join(held, 'leader') is None
+    with file_lock(_flight_path(idle, '.lock')):
+        pass
+
+    remove_stale_locks(max_age=0, now=time.time() + 1)
+
+    assert os.path.exists(_flight_path(held, '.lock'))
+    assert os.path.exists(_flight_path(held, '.json'))
+    assert not os.path.exists(_flight_path(idle, '.lock'))
+    # A removed lock file is created again by the next flight
+    assert flights.join(idle, 'other') is None
+    flights.finish(held)
+    flights.finish(idle)
+
+
+def test_lock_taken_on_a_removed_file_is_taken_again():
+    path = _flight_path(download_key('test', ('Youtube', 'race')), '.lock')
+    first = _open_lock(path)
+    waiting = {}
+
+    def wait():
+        with file_lock(path):
+            waiting['inode'] = os.stat(path).st_ino
+    thread = threading.Thread(target=wait)
+    thread.start()
+    time.sleep(0.1)
+    # The sweeper unlinks the file while the waiter blocks on the old one
+    os.remove(path)
+    fcntl.flock(first, fcntl.LOCK_UN)
+    first.close()
+    thread.join(5)
+    assert waiting['inode'] == os.stat(path).st_ino
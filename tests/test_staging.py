@@ -0,0 +1,18 @@
+import os
+
+from staging import create_job_dir, remove_job_dir, remove_stale_job_dirs
+
+
+def test_empty_shards_are_removed():
+    cancelled = create_job_dir()
+    remove_job_dir(cancelled)
+    running = create_job_dir()
+
+    remove_stale_job_dirs(max_age=600)
+
+    assert os.path.exists(running)
+    if os.path.dirname(cancelled) != os.path.dirname(running):
+        assert not os.path.exists(os.path.dirname(cancelled))
+    remove_job_dir(running)
+    remove_stale_job_dirs(max_age=600)
+    assert not os.path.exists(os.path.dirname(running))
@@ -0,0 +1,84 @@
+import os
+import time
+
+import pytest
+
+import storage_manager
+from rendition_cache import RenditionCache
+from storage_manager import StorageManager
+
+DAY = 24 * 3600
+
+
+@pytest.fixture
+def folder(tmp_path, monkeypatch):
+    folder = tmp_path / 'downloads'
+    renditions = folder / '.renditions'
+    (renditions / 'ab').mkdir(parents=True)
+    (tmp_path / 'pins').mkdir()
+    monkeypatch.setattr(storage_manager, 'RENDITION_FOLDER', str(renditions))
+    monkeypatch.setattr(storage_manager, 'PIN_FOLDER', str(tmp_path / 'pins'))
+    monkeypatch.setattr(storage_manager, 'rendition_cache',
+                        RenditionCache(folder=str(renditions), path=str(tmp_path / 'renditions.db')))
+    return folder
+
+
+def manager(folder, quota):
+    return StorageManager(folder=str(folder), path=str(folder.parent / 'storage.db'), quota=quota)
+
+
+def write(path, age=3600, size=100):
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_least_recently_accessed_files_go_first(folder):
+    for age, name in ((3000, 'a.mp4'), (2000, 'b.mp4'), (1000, 'c.mp4')):
+        write(folder / name, age)
+    storage = manager(folder, quota=320)
+    # Fetched just now, so b is the least recently accessed
+    storage.record_hit('a.mp4')
+
+    # 300 bytes is over the high watermark (288); one file brings it under the low one (240)
+    assert storage.run_pass(force=True) == ['b.mp4']
+    assert sorted(os.listdir(folder)) == ['.renditions', 'a.mp4', 'c.mp4']
+    assert storage.stats()['usage_bytes'] == 200
+
+
+def test_pinned_files_are_not_evicted(folder, monkeypatch):
+    monkeypatch.setattr(storage_manager, 'STORAGE_MIN_AGE', 0)
+    write(folder / 'other.mp4')
+    storage = manager(folder, quota=100)
+    with storage.pin('job_'):
+        write(folder / 'job_1.mp4', age=0)
+        assert storage.run_pass(force=True) == ['other.mp4']
+    assert storage.run_pass(force=True) == ['job_1.mp4']
+
+
+def test_linked_renditions_are_kept(folder):
+    renditions = folder / '.renditions' / 'ab'
+    # Stored long ago and published again, still linked from the download folder
+    linked = write(renditions / 'ab01.mp4', age=30 * DAY)
+    os.link(linked, folder / 'video.mp4')
+    unlinked = write(renditions / 'ab02.mp4', age=30 * DAY)
+    storage = manager(folder, quota=10 ** 9)
+    storage.record_hit('video.mp4')
+
+    assert storage.run_pass(force=True) == []
+    assert os.path.exists(linked)
+    assert not os.path.exists(unlinked)
+
+
+def test_unlinked_renditions_go_before_users_files(folder):
+    renditions = folder / '.renditions' / 'ab'
+    unlinked = write(renditions / 'ab02.mp4', age=60)
+    write(folder / 'video.mp4')
+    write(folder / 'other.mp4')
+    storage = manager(folder, quota=320)
+
+    assert storage.run_pass(force=True) == []
+    assert not os.path.exists(unlinked)
+    assert os.path.exists(folder / 'video.mp4')
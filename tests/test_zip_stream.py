@@ -0,0 +1,67 @@
+import io
+import os
+import threading
+import time
+import uuid
+import zipfile
+import zlib
+
+from app import app
+from zip_stream import remove_manifest, stream_zip, write_manifest
+
+
+def write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+    return str(path)
+
+
+def test_streamed_archive_is_a_valid_zip(tmp_path):
+    video = write(tmp_path / 'video.mp4', os.urandom(3 * 1024 * 1024 + 17))
+    notes = write(tmp_path / 'notes.txt', b'subtitles\n' * 1000)
+    late = write(tmp_path / 'late.mp3', os.urandom(1000))
+    zip_name = f"batch_{uuid.uuid4().hex}.zip"
+    items = [
+        {'path': video, 'status': 'ready'},
+        {'path': late, 'status': 'pending'},
+        {'path': None, 'status': 'failed'},
+        {'path': notes, 'status': 'ready'},
+    ]
+    write_manifest(zip_name, items)
+
+    def finish_late():
+        time.sleep(0.3)
+        items[1]['status'] = 'ready'
+        write_manifest(zip_name, items)
+    threading.Thread(target=finish_late).start()
+
+    # The writer never seeks: the archive is the concatenation of the chunks
+    data = b''.join(stream_zip(zip_name))
+    remove_manifest(zip_name)
+
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        # Ready files first, the late one once it finished
+        assert archive.namelist() == ['video.mp4', 'notes.txt', 'late.mp3']
+        for path in (video, notes, late):
+            entry = archive.getinfo(os.path.basename(path))
+            assert entry.file_size == os.path.getsize(path)
+            with open(path, 'rb') as f:
+                assert archive.read(entry) == f.read()
+        assert archive.getinfo('video.mp4').compress_type == zipfile.ZIP_STORED
+        assert archive.getinfo('notes.txt').compress_type == zipfile.ZIP_DEFLATED
+
+
+def test_download_route_streams_the_batch(tmp_path):
+    path = write(tmp_path / 'video.webm', os.urandom(5000))
+    zip_name = f"batch_{uuid.uuid4().hex}.zip"
+    write_manifest(zip_name, [{'path': path, 'status': 'ready'}])
+
+    response = app.test_client().get(f'/downloads/{zip_name}')
+    remove_manifest(zip_name)
+
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'application/zip'
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        assert archive.namelist() == ['video.webm']
+        assert archive.getinfo('video.webm').CRC == zlib.crc32(open(path, 'rb').read())
@@ -3,11 +3,24 @@ import os
 import threading
 import zipfile
 from functools import wraps
-from flask import  render_template, request, jsonify, session, Blueprint, redirect, url_for, send_file
-import yt_dlp
+from flask import  render_template, request, jsonify, session, Blueprint, redirect, url_for
 from uuid import uuid4
-from downloader_global import DOWNLOAD_FOLDER,download_sessions
+from bandwidth import bandwidth_shaper
+from cancellation import JobCancelled
+from download_engines import engine_for, engine_options
+from downloader_global import download_sessions
+from file_catalog import file_catalog
+from job_scheduler import scheduler, QueueFullError, PRIORITY_NORMAL, PRIORITY_LOW
+from metadata_cache import cached_extract_info, options_profile, peek_cached_info, video_identity
+from postprocess import audio_settings, postprocess_pool
+from progress_stream import progress_watcher, sse_response
+from rendition_cache import rendition_cache, rendition_key
 from request_logger import log_request
+from single_flight import download_flights, download_key
+from staging import create_job_dir, publish, remove_job_dir
+from ydl_pool import ydl_pool
+from storage_manager import storage
+from zip_stream import ZIP_MODE, write_manifest, remove_manifest
 
 # Admin password - change this to your desired password
 ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'admin123')
@@ -45,6 +58,22 @@ def index():
         quality="best"
     )
 
+WEB_DOWNLOAD_OPTIONS = {
+    'format': 'best',
+    'quiet': True,
+    'cookiefile': 'app/cookies.txt',
+}
+ydl_pool.register('download-video', WEB_DOWNLOAD_OPTIONS)
+ydl_pool.register('download-audio', dict(WEB_DOWNLOAD_OPTIONS, **{
+    # Audio is extracted by postprocess_pool, outside the download slot
+    'format': 'bestaudio/best',
+}))
+ydl_pool.register('formats', {
+    'quiet': True,
+    'skip_download': True,
+    'force_generic_extractor': False,
+})
+
 @web_bp.route('/download', methods=['GET', 'POST'])
 def download_video():
     if request.method == 'GET':
@@ -78,110 +107,238 @@ def download_video():
         'language': request.headers.get('X-Language', '')
     }
 
-    download_sessions[session_id] = {
-        "percent": "0%",
-        "status": "Downloading",
-        "filename": None,
-        "size": None
-    }
+    download_sessions.create(
+        session_id,
+        percent="0%",
+        status="Queued",
+        filename=None,
+        size=None,
+        queue_position=None
+    )
 
-    def progress_hook(d):
-        if d['status'] == 'downloading':
-            download_sessions[session_id]['percent'] = d.get('_percent_str', '0.0%').strip()
-            download_sessions[session_id]['status'] = "Downloading"
-        elif d['status'] == 'finished':
-            download_sessions[session_id]['percent'] = "100%"
-            download_sessions[session_id]['status'] = "Processing..."
+    # Per-URL progress, aggregated into the session's overall percentage
+    items = [{"url": url, "percent": "0%", "status": "Queued", "filename": None} for url in urls]
+    items_lock = threading.Lock()
+
+    def update_item(idx, **fields):
+        with items_lock:
+            if all(items[idx].get(key) == value for key, value in fields.items()):
+                # Hooks fire many times per second, only write real changes
+                return
+            items[idx].update(fields)
+            total = 0.0
+            for item in items:
+                if item['status'] == "Downloading":
+                    try:
+                        total += float(item['percent'].rstrip('%'))
+                    except ValueError:
+                        pass
+                elif item['status'] != "Queued":
+                    total += 100
+            overall = f"{total / len(items):.1f}%"
+            running = any(item['status'] in ("Queued", "Downloading") for item in items)
+            progress = {"percent": overall, "status": "Downloading" if running else "Processing..."}
+            if len(items) > 1:
+                progress['items'] = [dict(item) for item in items]
+            download_sessions.update(session_id, **progress)
+
+    def make_progress_hook(idx):
+        def progress_hook(d):
+            if d['status'] == 'downloading':
+                update_item(idx, percent=d.get('_percent_str', '0.0%').strip(), status="Downloading")
+            elif d['status'] == 'finished':
+                update_item(idx, percent="100%", status="Processing...")
+        return progress_hook
+
+    timestamp = int(time.time())
+    # Unique per job, two users can start a batch in the same second
+    base_name = f'download_{timestamp}_{uuid4().hex[:8]}'
+
+    # In stream mode the batch zip is generated by /downloads/ from this
+    # manifest; entries are sent as soon as their file is ready
+    stream_zip_name = f"{base_name}.zip" if ZIP_MODE == 'stream' and len(urls) > 1 else None
+    zip_items = [{"path": None, "status": "pending"} for _ in urls]
+
+    def update_zip_item(idx, path, status):
+        if stream_zip_name is None:
+            return
+        with items_lock:
+            zip_items[idx] = {"path": path, "status": status}
+            write_manifest(stream_zip_name, zip_items)
+        if status == "ready":
+            download_sessions.update(session_id, filename=stream_zip_name, streaming=True)
+
+    profile = 'download-audio' if format_type == 'audio' else 'download-video'
+    overrides = {'noplaylist': not playlist}
+    if format_type != 'audio':
+        overrides['format'] = quality
+    # Extracted info is cached per options profile and overrides
+    info_profile = options_profile(profile, **overrides)
+
+    def download_one(idx, url):
+        output_name = f"{base_name}_{idx}"
+        downloaded = []
+
+        # Someone already got this exact file: publish another link to it
+        identity = None if playlist else video_identity(url)
+        render_key = None
+        if identity:
+            render_key = rendition_key(identity, profile, **overrides,
+                                       **(audio_settings() if format_type == 'audio' else {}))
+        cached = rendition_cache.publish(render_key, output_name)
+        if cached:
+            try:
+                log_request(url, peek_cached_info(url, info_profile, noplaylist=not playlist), format_type, 'download', request_data=request_data)
+            except Exception as log_err:
+                print(f"Error in log_request: {log_err}")
+            update_item(idx, percent="100%", status="Completed", filename=os.path.basename(cached))
+            update_zip_item(idx, cached, "ready")
+            return cached, os.path.getsize(cached)
+
+        # Download into a private staging directory, publish when finished
+        job_dir = create_job_dir()
+        engine = engine_options(engine_for(url))
+        with ydl_pool.acquire(profile, progress_hooks=[make_progress_hook(idx)], post_hooks=[downloaded.append],
+                              outtmpl=os.path.join(job_dir, '%(id)s.%(ext)s'), **overrides, **engine) as ydl:
+            try:
+                info = ydl.extract_info(url, download=True)
+                if format_type == 'audio':
+                    # CPU-bound, runs on its own pool while this job's download slot is lent out
+                    downloaded[:] = [postprocess_pool.extract_audio(file_path)
+                                     for file_path in downloaded if os.path.exists(file_path)]
+                if len(downloaded) == 1 and os.path.exists(downloaded[0]):
+                    rendition_cache.store(render_key, downloaded[0],
+                                          output_name + os.path.splitext(downloaded[0])[1])
+                published = [
+                    publish(file_path, output_name + os.path.splitext(file_path)[1])
+                    for file_path in downloaded if os.path.exists(file_path)
+                ]
+                if not published:
+                    raise RuntimeError("No file found after download")
+                # Log the request with captured request data
+                try:
+                    log_request(url, info, format_type, 'download', request_data=request_data)
+                except Exception as log_err:
+                    print(f"Error in log_request: {log_err}")
+                    import traceback
+                    traceback.print_exc()
+            except JobCancelled:
+                update_zip_item(idx, None, "failed")
+                raise
+            except Exception as e:
+                # Try to extract info without downloading for logging
+                try:
+                    info = cached_extract_info(ydl, url, info_profile)
+                    try:
+                        log_request(url, info, format_type, 'download', request_data=request_data)
+                    except Exception as log_err:
+                        print(f"Error in log_request: {log_err}")
+                except:
+                    # Log with minimal info if extraction fails
+                    try:
+                        log_request(url, None, format_type, 'download', request_data=request_data)
+                    except Exception as log_err:
+                        print(f"Error logging failed request: {log_err}")
+                update_item(idx, status=f"Error: {str(e)}")
+                update_zip_item(idx, None, "failed")
+                raise e
+            finally:
+                remove_job_dir(job_dir)
+
+            for file_path in published:
+                file_catalog.add(file_path)
+            # A playlist URL publishes every entry, the first one is reported
+            filename = published[0]
+            update_item(idx, percent="100%", status="Completed", filename=os.path.basename(filename))
+            update_zip_item(idx, filename, "ready")
+            return filename, info.get('filesize') or info.get('filesize_approx')
 
     def download():
+        if stream_zip_name:
+            write_manifest(stream_zip_name, zip_items)
         try:
-            timestamp = int(time.time())
-            ext = 'mp3' if format_type == 'audio' else 'mp4'
-            base_name = f'download_{timestamp}'
-            out_files = []
-
-            for idx, url in enumerate(urls):
-                output_name = f"{base_name}_{idx}"
-                output_template = os.path.join(DOWNLOAD_FOLDER, f"{output_name}.%(ext)s")
-
-                ydl_opts = {
-                    'progress_hooks': [progress_hook],
-                    'outtmpl': output_template,
-                    'noplaylist': not playlist,
-                    'format': quality,
-                    'quiet': True,
-                    'cookiefile': 'app/cookies.txt',
-                }
-
-                if format_type == 'audio':
-                    ydl_opts.update({
-                        'format': 'bestaudio/best',
-                        'postprocessors': [{
-                            'key': 'FFmpegExtractAudio',
-                            'preferredcodec': 'mp3',
-                            'preferredquality': '192',
-                        }],
-                    })
-
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    try:
-                        info = ydl.extract_info(url, download=True)
-                        # Log the request with captured request data
-                        try:
-                            log_request(url, info, format_type, 'download', request_data=request_data)
-                        except Exception as log_err:
-                            print(f"Error in log_request: {log_err}")
-                            import traceback
-                            traceback.print_exc()
-                    except Exception as e:
-                        # Try to extract info without downloading for logging
-                        try:
-                            ydl_opts_log = ydl_opts.copy()
-                            ydl_opts_log['skip_download'] = True
-                            with yt_dlp.YoutubeDL(ydl_opts_log) as ydl_log:
-                                info = ydl_log.extract_info(url, download=False)
-                                try:
-                                    log_request(url, info, format_type, 'download', request_data=request_data)
-                                except Exception as log_err:
-                                    print(f"Error in log_request: {log_err}")
-                        except:
-                            # Log with minimal info if extraction fails
-                            try:
-                                log_request(url, None, format_type, 'download', request_data=request_data)
-                            except Exception as log_err:
-                                print(f"Error logging failed request: {log_err}")
-                        raise e
-                    filesize = info.get('filesize') or info.get('filesize_approx')
-                    if filesize:
-                        mb_size = round(filesize / (1024 * 1024), 2)
-                        download_sessions[session_id]['size'] = f"{mb_size} MB"
-                    else:
-                        download_sessions[session_id]['size'] = "Unknown"
-                    if isinstance(info, dict):
-                        filename = ydl.prepare_filename(info)
-                        if format_type == 'audio':
-                            filename = filename.rsplit('.', 1)[0] + ".mp3"
-                        out_files.append(filename)
-
-            if len(out_files) > 1:
-                zip_name = f"{base_name}.zip"
-                zip_path = os.path.join(DOWNLOAD_FOLDER, zip_name)
-                with zipfile.ZipFile(zip_path, 'w') as zipf:
-                    for file_path in out_files:
-                        zipf.write(file_path, os.path.basename(file_path))
-                download_sessions[session_id]['filename'] = zip_name
+            # URLs of a batch run in parallel; a failed URL does not stop the others
+            results = scheduler.run_batch(urls, download_one)
+            out_files = [result[0] for ok, result in results if ok]
+            if not out_files:
+                if stream_zip_name:
+                    remove_manifest(stream_zip_name)
+                raise results[0][1]
+
+            sizes = [result[1] for ok, result in results if ok]
+            if all(sizes):
+                mb_size = round(sum(sizes) / (1024 * 1024), 2)
+                download_sessions.update(session_id, size=f"{mb_size} MB")
+            else:
+                download_sessions.update(session_id, size="Unknown")
+
+            if stream_zip_name:
+                download_sessions.update(session_id, filename=stream_zip_name)
+            elif len(out_files) > 1:
+                zip_dir = create_job_dir()
+                try:
+                    staged_zip = os.path.join(zip_dir, f"{base_name}.zip")
+                    with zipfile.ZipFile(staged_zip, 'w') as zipf:
+                        for file_path in out_files:
+                            zipf.write(file_path, os.path.basename(file_path))
+                    zip_path = publish(staged_zip, f"{base_name}.zip")
+                finally:
+                    remove_job_dir(zip_dir)
+                zip_name = os.path.basename(zip_path)
+                file_catalog.add(zip_path)
+                download_sessions.update(session_id, filename=zip_name)
             else:
-                download_sessions[session_id]['filename'] = os.path.basename(out_files[0])
+                download_sessions.update(session_id, filename=os.path.basename(out_files[0]))
 
-            total_size = sum(os.path.getsize(f) for f in out_files)
-            # download_sessions[session_id]['size'] = f"{round(total_size / (1024 * 1024), 2)} MB"
-            download_sessions[session_id]['status'] = "Completed"
+            failed = len(results) - len(out_files)
+            download_sessions.update(session_id, percent="100%", status="Completed", failed_items=failed)
 
         except Exception as e:
-            download_sessions[session_id]['status'] = f"Error: {str(e)}"
-            download_sessions[session_id]['filename'] = None
-
-    threading.Thread(target=download, daemon=True).start()
+            download_sessions.update(session_id, status=f"Error: {str(e)}", filename=None)
+        finally:
+            if stream_zip_name:
+                # Never leave a streaming response waiting for an item that will not come
+                with items_lock:
+                    if any(item['status'] == "pending" for item in zip_items):
+                        for item in zip_items:
+                            if item['status'] == "pending":
+                                item['status'] = "failed"
+                        write_manifest(stream_zip_name, zip_items)
+
+    # Identical single-video requests share one download
+    flight_key = None
+    if len(urls) == 1 and not playlist:
+        identity = video_identity(urls[0])
+        if identity:
+            # overrides carry the quality and the playlist flag
+            flight_key = download_key('web', identity, profile=profile, format_type=format_type, **overrides,
+                                      **(audio_settings() if format_type == 'audio' else {}))
+    def pinned_download():
+        # The storage manager must not evict files while this job writes them;
+        # the batch shares one bandwidth lease for its client
+        with storage.pin(base_name), bandwidth_shaper.lease(session_id, request_data['ip_address']):
+            download()
+
+    job = download_flights.attach(flight_key, session_id, pinned_download)
+
+    priority = PRIORITY_LOW if playlist or len(urls) > 1 else PRIORITY_NORMAL
+    try:
+        if job is not None:
+            # A job cancelled before it starts must still release its flight
+            scheduler.submit(session_id, job, priority=priority, on_cancel=lambda: download_flights.finish(flight_key))
+    except QueueFullError as e:
+        download_flights.finish(flight_key)
+        download_sessions.pop(session_id, None)
+        response = render_template(
+            'index.html',
+            status="Idle",
+            error=f"The server is busy. Please try again in {e.retry_after} seconds.",
+            url="\n".join(urls),
+            format=format_type,
+            size=None,
+            quality=quality
+        )
+        return response, 503, {'Retry-After': str(e.retry_after)}
 
     return render_template(
         'index.html',
@@ -189,7 +346,7 @@ def download_video():
         error=None,
         url="\n".join(urls),
         format=format_type,
-        size=download_sessions[session_id]['size'],
+        size=download_sessions.get(session_id, {}).get('size'),
         quality=quality
     )
 
@@ -204,6 +361,12 @@ def get_progress():
     }))
 
 
+@web_bp.route('/progress/stream')
+def stream_progress():
+    session_id = session.get('id')
+    return sse_response([session_id] if session_id else ['-'])
+
+
 @web_bp.route('/privacy')
 def privacy_policy():
     return render_template('privacy.html')
@@ -227,46 +390,96 @@ def admin_logout():
 @web_bp.route('/admin')
 @admin_required
 def admin_panel():
-    import os
     from datetime import datetime
-    from downloader_global import DOWNLOAD_FOLDER
     
-    files_info = []
-    if os.path.exists(DOWNLOAD_FOLDER):
-        for filename in os.listdir(DOWNLOAD_FOLDER):
-            file_path = os.path.join(DOWNLOAD_FOLDER, filename)
-            if os.path.isfile(file_path):
-                file_size = os.path.getsize(file_path)
-                file_mtime = os.path.getmtime(file_path)
-                file_date = datetime.fromtimestamp(file_mtime).strftime('%Y-%m-%d %H:%M:%S')
-                
-                # Format file size
-                if file_size < 1024:
-                    size_str = f"{file_size} B"
-                elif file_size < 1024 * 1024:
-                    size_str = f"{file_size / 1024:.2f} KB"
-                else:
-                    size_str = f"{file_size / (1024 * 1024):.2f} MB"
-                
-                files_info.append({
-                    'name': filename,
-                    'size': size_str,
-                    'size_bytes': file_size,
-                    'date': file_date,
-                    'path': file_path
-                })
+    def format_size(size):
+        if size < 1024:
+            return f"{size} B"
+        elif size < 1024 * 1024:
+            return f"{size / 1024:.2f} KB"
+        return f"{size / (1024 * 1024):.2f} MB"
+    
+    sort = request.args.get('sort', 'date')
+    order = request.args.get('order', 'desc')
+    try:
+        page = max(1, int(request.args.get('page', 1)))
+        per_page = min(500, max(1, int(request.args.get('per_page', 50))))
+        entries, pages = file_catalog.page(sort=sort, reverse=order != 'asc', page=page, per_page=per_page)
+    except ValueError:
+        return redirect(url_for('web.admin_panel'))
     
-    # Sort by date (newest first)
-    files_info.sort(key=lambda x: x['date'], reverse=True)
+    # Served from the in-memory catalog, no stat per file
+    files_info = [{
+        'name': name,
+        'size': format_size(size),
+        'size_bytes': size,
+        'date': datetime.fromtimestamp(mtime).strftime('%Y-%m-%d %H:%M:%S'),
+    } for name, size, mtime in entries]
     
-    # Calculate total size
-    total_size = sum(f['size_bytes'] for f in files_info)
+    total_files, total_size = file_catalog.totals()
     if total_size < 1024 * 1024:
         total_size_str = f"{total_size / 1024:.2f} KB"
     else:
         total_size_str = f"{total_size / (1024 * 1024):.2f} MB"
     
-    return render_template('admin.html', files=files_info, total_files=len(files_info), total_size=total_size_str)
+    renditions = rendition_cache.stats()
+    
+    return render_template(
+        'admin.html',
+        files=files_info,
+        total_files=total_files,
+        total_size=total_size_str,
+        rendition_hit_ratio=f"{renditions['hit_ratio'] * 100:.1f}%" if renditions['hit_ratio'] is not None else "n/a",
+        rendition_hits=renditions['hits'],
+        rendition_lookups=renditions['hits'] + renditions['misses'],
+        sort=sort,
+        order=order,
+        page=page,
+        pages=pages,
+        per_page=per_page
+    )
+
+@web_bp.route('/admin/stats')
+@admin_required
+def admin_stats():
+    """Counters for monitoring (per worker unless noted)"""
+    from metadata_cache import metadata_cache
+    from request_logger import log_writer
+    from ydl_cache import cache_counters
+    from download_engines import stats as download_engine_stats
+    
+    return jsonify({
+        "success": True,
+        "scheduler": scheduler.stats(),
+        # Shared by all workers
+        "sessions": download_sessions.stats(),
+        "progress_streams": progress_watcher.stats(),
+        "metadata_cache": metadata_cache.stats(),
+        "request_log_writer": log_writer.stats(),
+        "ydl_pool": ydl_pool.stats(),
+        "ydl_cache": cache_counters.stats(),
+        "postprocess": postprocess_pool.stats(),
+        "download_engines": download_engine_stats(),
+        "bandwidth": bandwidth_shaper.stats(),
+        # Shared by all workers
+        "renditions": rendition_cache.stats(),
+        # Shared by all workers
+        "storage": storage.stats(),
+    })
+
+@web_bp.route('/admin/extraction-strategies')
+@admin_required
+def admin_extraction_strategies():
+    """Success rate, latency, circuit state and hedging of the direct-links configs (per worker)"""
+    from extraction_strategy import strategy_tracker
+    from api_routes import DIRECT_LINK_CONFIGS
+    
+    return jsonify({
+        "success": True,
+        "configs": list(DIRECT_LINK_CONFIGS),
+        "strategies": strategy_tracker.stats(),
+        "hedging": strategy_tracker.hedge_stats(),
+    })
 
 @web_bp.route('/admin/delete-file', methods=['POST'])
 @admin_required
@@ -286,6 +499,7 @@ def delete_file():
     
     try:
         os.remove(file_path)
+        file_catalog.remove(filename)
         return jsonify({"success": True, "message": f"File {filename} deleted successfully"})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
@@ -316,6 +530,7 @@ def delete_files_bulk():
         
         try:
             os.remove(file_path)
+            file_catalog.remove(filename)
             deleted.append(filename)
         except Exception as e:
             failed.append({"filename": filename, "error": str(e)})
@@ -327,49 +542,66 @@ def delete_files_bulk():
         "message": f"Deleted {len(deleted)} file(s)" + (f", {len(failed)} failed" if failed else "")
     })
 
+REQUEST_LOG_FILTERS = ('date_from', 'date_to', 'platform', 'ip_address', 'video_id', 'request_type', 'is_extension')
+
 @web_bp.route('/admin/requests')
 @admin_required
 def admin_requests():
-    import json
-    import os
-    from request_logger import LOG_FILE
+    from request_logger import query_logs, count_logs
     
-    logs = []
-    if os.path.exists(LOG_FILE):
-        try:
-            with open(LOG_FILE, 'r', encoding='utf-8') as f:
-                logs = json.load(f)
-            # Reverse to show newest first
-            logs.reverse()
-        except (json.JSONDecodeError, IOError):
-            logs = []
+    filters = {key: request.args.get(key) for key in REQUEST_LOG_FILTERS if request.args.get(key)}
+    try:
+        # Newest first, one page at a time
+        logs, next_cursor = query_logs(limit=request.args.get('limit', 50), cursor=request.args.get('cursor'), **filters)
+        total_requests = count_logs(**filters)
+    except ValueError:
+        return redirect(url_for('web.admin_requests'))
     
-    return render_template('admin_requests.html', requests=logs, total_requests=len(logs))
+    return render_template(
+        'admin_requests.html',
+        requests=logs,
+        total_requests=total_requests,
+        filters=filters,
+        next_cursor=next_cursor,
+        is_first_page=not request.args.get('cursor')
+    )
+
+@web_bp.route('/admin/api/requests')
+@admin_required
+def admin_requests_api():
+    from request_logger import query_logs
+    
+    filters = {key: request.args.get(key) for key in REQUEST_LOG_FILTERS if request.args.get(key)}
+    try:
+        logs, next_cursor = query_logs(limit=request.args.get('limit', 50), cursor=request.args.get('cursor'), **filters)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
+    return jsonify({
+        "success": True,
+        "requests": logs,
+        "next_cursor": next_cursor
+    })
 
 @web_bp.route('/admin/export-logs')
 @admin_required
 def export_logs():
-    import json
-    import os
-    from flask import send_file
-    from request_logger import LOG_FILE
+    from flask import Response
+    from request_logger import iter_logs_json
     
-    if os.path.exists(LOG_FILE):
-        return send_file(LOG_FILE, as_attachment=True, download_name='request_logs.json')
-    else:
-        return "No logs file found", 404
+    return Response(
+        iter_logs_json(),
+        mimetype='application/json',
+        headers={'Content-Disposition': 'attachment; filename=request_logs.json'}
+    )
 
 @web_bp.route('/admin/reset-logs', methods=['POST'])
 @admin_required
 def reset_logs():
-    import json
-    import os
-    from request_logger import LOG_FILE
+    from request_logger import clear_logs
     
     try:
-        # Clear the log file by writing an empty array
-        with open(LOG_FILE, 'w', encoding='utf-8') as f:
-            json.dump([], f, indent=2, ensure_ascii=False)
+        clear_logs()
         return jsonify({"success": True, "message": "All logs have been cleared"})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
@@ -377,39 +609,15 @@ def reset_logs():
 @web_bp.route('/admin/delete-requests-bulk', methods=['POST'])
 @admin_required
 def delete_requests_bulk():
-    import json
-    import os
-    from request_logger import LOG_FILE
+    from request_logger import delete_logs
     
     request_ids = request.json.get('request_ids', [])
     if not request_ids or not isinstance(request_ids, list):
         return jsonify({"success": False, "error": "Request IDs array is required"}), 400
     
     try:
-        # Load existing logs
-        logs = []
-        if os.path.exists(LOG_FILE):
-            try:
-                with open(LOG_FILE, 'r', encoding='utf-8') as f:
-                    logs = json.load(f)
-            except (json.JSONDecodeError, IOError):
-                logs = []
-        
-        # Convert request_ids to integers for comparison
-        request_ids_int = [int(rid) for rid in request_ids]
-        
-        # Filter out the requests to delete
-        original_count = len(logs)
-        logs = [log for log in logs if log.get('id') not in request_ids_int]
-        deleted_count = original_count - len(logs)
-        
-        # Re-index the remaining logs
-        for idx, log in enumerate(logs, start=1):
-            log['id'] = idx
-        
-        # Save updated logs
-        with open(LOG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(logs, f, indent=2, ensure_ascii=False)
+        # IDs are stable, so the remaining entries are not renumbered
+        deleted_count = delete_logs(int(rid) for rid in request_ids)
         
         return jsonify({
             "success": True,
@@ -426,14 +634,8 @@ def get_formats():
         return jsonify({'error': 'URL missing'}), 400
 
     try:
-        ydl_opts = {
-            'quiet': True,
-            'skip_download': True,
-            'force_generic_extractor': False,
-        }
-
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
+        with ydl_pool.acquire('formats') as ydl:
+            info = cached_extract_info(ydl, url, 'formats')
             formats = info.get('formats', [])
 
             mp4_formats = []
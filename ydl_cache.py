@@ -0,0 +1,119 @@
+import fcntl
+import os
+import threading
+import time
+
+from yt_dlp.cache import Cache
+
+from downloader_global import STATE_FOLDER
+
+# yt-dlp's on-disk cache (YouTube player JS, signature and n-parameter
+# solutions...). One directory for every worker; mount it as a volume so it
+# survives restarts. Writes are atomic renames, so workers can share it.
+YTDLP_CACHE_DIR = os.environ.get('YTDLP_CACHE_DIR', os.path.join(STATE_FOLDER, 'yt-dlp-cache'))
+os.makedirs(YTDLP_CACHE_DIR, exist_ok=True)
+
+# Extracted once at startup to fill the cache before real requests arrive ('' = no warmup)
+YTDLP_WARMUP_URLS = [url.strip() for url in
+                     os.environ.get('YTDLP_WARMUP_URLS', 'https://www.youtube.com/watch?v=jNQXAC9WgRc').split(',')
+                     if url.strip()]
+# A warmup this recent (by any worker) is not repeated
+YTDLP_WARMUP_MIN_INTERVAL = int(os.environ.get('YTDLP_WARMUP_MIN_INTERVAL', '600'))
+
+_WARMUP_STAMP = os.path.join(YTDLP_CACHE_DIR, '.warmup')
+
+
+class CacheCounters:
+    """Hits, misses and stores of the yt-dlp cache per section, for this worker"""
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+        self.warmup = None
+
+    def count(self, section, kind):
+        with self._lock:
+            counts = self._counts.setdefault(section, {'hits': 0, 'misses': 0, 'stores': 0})
+            counts[kind] += 1
+
+    def stats(self):
+        with self._lock:
+            sections = {section: dict(counts) for section, counts in sorted(self._counts.items())}
+        hits = sum(counts['hits'] for counts in sections.values())
+        misses = sum(counts['misses'] for counts in sections.values())
+        return {
+            "cachedir": YTDLP_CACHE_DIR,
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / (hits + misses), 3) if hits + misses else None,
+            "sections": sections,
+            "warmup": self.warmup,
+        }
+
+
+cache_counters = CacheCounters()
+
+
+class CountingCache(Cache):
+    """yt-dlp's Cache, counting hits and misses in cache_counters"""
+
+    def load(self, section, key, dtype='json', default=None, *, min_ver=None):
+        data = super().load(section, key, dtype, default, min_ver=min_ver)
+        if self.enabled:
+            cache_counters.count(section, 'misses' if data is default else 'hits')
+        return data
+
+    def store(self, section, key, data, dtype='json'):
+        super().store(section, key, data, dtype)
+        if self.enabled:
+            cache_counters.count(section, 'stores')
+
+
+def warm_up():
+    """
+    Extract YTDLP_WARMUP_URLS once so the player JS and its solutions are cached.
+
+    Only one worker warms up at a time, and not again within
+    YTDLP_WARMUP_MIN_INTERVAL; the other workers read what it cached.
+    """
+    from ydl_pool import ydl_pool
+
+    with open(_WARMUP_STAMP + '.lock', 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            cache_counters.warmup = {"status": "skipped", "reason": "another worker is warming up"}
+            return
+        try:
+            try:
+                if time.time() - os.stat(_WARMUP_STAMP).st_mtime < YTDLP_WARMUP_MIN_INTERVAL:
+                    cache_counters.warmup = {"status": "skipped", "reason": "warmed up recently"}
+                    return
+            except FileNotFoundError:
+                pass
+
+            started = time.monotonic()
+            failed = []
+            for url in YTDLP_WARMUP_URLS:
+                try:
+                    with ydl_pool.acquire('minimal') as ydl:
+                        ydl.extract_info(url, download=False)
+                except Exception as e:
+                    failed.append(url)
+                    print(f"[YDL Cache] Warmup of {url} failed: {e}")
+            seconds = round(time.monotonic() - started, 2)
+            cache_counters.warmup = {"status": "done", "seconds": seconds, "failed": failed}
+            if len(failed) < len(YTDLP_WARMUP_URLS):
+                with open(_WARMUP_STAMP, 'w'):
+                    pass
+            print(f"[YDL Cache] Warmup finished in {seconds}s, {len(YTDLP_WARMUP_URLS) - len(failed)} URL(s) extracted")
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def start_warmup():
+    """Warm up in a background thread, so the worker can serve requests meanwhile"""
+    if not YTDLP_WARMUP_URLS or cache_counters.warmup is not None:
+        return
+    cache_counters.warmup = {"status": "running"}
+    threading.Thread(target=warm_up, daemon=True, name='ydl-cache-warmup').start()
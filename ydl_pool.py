@@ -0,0 +1,185 @@
+import copy
+import os
+import threading
+from contextlib import contextmanager
+
+import yt_dlp
+from yt_dlp.cookies import YoutubeDLCookieJar
+
+from bandwidth import bandwidth_shaper
+from cancellation import current_job
+from ydl_cache import YTDLP_CACHE_DIR, CountingCache
+
+# Idle instances kept per profile; more are built under load and dropped after
+YDL_POOL_SIZE = int(os.environ.get('YDL_POOL_SIZE', '8'))
+
+
+class _SharedCookieJar:
+    """One cookie jar per cookie file, reloaded in place when the file changes"""
+
+    def __init__(self, path):
+        self.path = path
+        self.jar = YoutubeDLCookieJar(path)
+        self._mtime = None
+        self._lock = threading.Lock()
+        self.reloads = 0
+        self.refresh()
+
+    def refresh(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            try:
+                # Same jar object, so every pooled instance sees the new cookies
+                self.jar.clear()
+                self.jar.load(ignore_discard=True, ignore_expires=True)
+            except Exception as e:
+                print(f"[YDL Pool] Could not load cookies from {self.path}: {e}")
+                return
+            self._mtime = mtime
+            self.reloads += 1
+
+
+class YoutubeDLPool:
+    """
+    Pre-built YoutubeDL instances per options profile.
+
+    Building a YoutubeDL parses the cookie file and sets up a new HTTP
+    opener; pooled instances keep their keep-alive connections and share one
+    cookie jar per cookie file. An instance is used by one request at a time
+    (see acquire()), and per-request settings are undone when it is returned.
+    Cookies are read from the cookie file but not written back to it.
+    """
+
+    def __init__(self, size=YDL_POOL_SIZE):
+        self.size = size
+        self._profiles = {}
+        self._idle = {}
+        self._jars = {}
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    def register(self, profile, options):
+        """Define the base YoutubeDL options of a profile"""
+        with self._lock:
+            self._profiles[profile] = dict(options)
+            self._idle.setdefault(profile, [])
+
+    def _jar(self, path):
+        with self._lock:
+            shared = self._jars.get(path)
+            if shared is None:
+                shared = self._jars[path] = _SharedCookieJar(path)
+        shared.refresh()
+        return shared.jar
+
+    def _build(self, profile):
+        options = self._profiles[profile]
+        # YoutubeDL keeps the dict it is given as its params, so each instance needs its own
+        params = copy.deepcopy(options)
+        params.setdefault('cachedir', YTDLP_CACHE_DIR)
+        ydl = yt_dlp.YoutubeDL(params)
+        ydl.cache = CountingCache(ydl)
+        if options.get('cookiefile'):
+            # Must be set before the first request builds the request director
+            ydl.__dict__['cookiejar'] = self._jar(options['cookiefile'])
+        ydl._pool_defaults = {
+            'params': dict(ydl.params),
+            'format_selector': ydl.format_selector,
+        }
+        self.created += 1
+        return ydl
+
+    def _reset(self, ydl):
+        defaults = ydl._pool_defaults
+        ydl.params.clear()
+        ydl.params.update(defaults['params'])
+        ydl.format_selector = defaults['format_selector']
+        ydl._progress_hooks.clear()
+        ydl._post_hooks.clear()
+        ydl._postprocessor_hooks.clear()
+        for pps in ydl._pps.values():
+            for pp in pps:
+                pp._progress_hooks.clear()
+        # Undo per-request method overrides such as extraction_strategy.cancellable() and CancelToken.guard()
+        ydl.__dict__.pop('urlopen', None)
+        ydl.__dict__.pop('_bandwidth_lease', None)
+        ydl._num_downloads = 0
+        ydl._download_retcode = 0
+
+    @contextmanager
+    def acquire(self, profile, progress_hooks=(), post_hooks=(), outtmpl=None, **params):
+        """
+        Borrow a YoutubeDL of profile for one request.
+
+        outtmpl, format and other params override the profile's options for
+        this request only; the hooks are added for this request only. Inside
+        a scheduler job the instance stops when the job is cancelled, and
+        downloads at the job's bandwidth share (see bandwidth.py).
+        """
+        with self._lock:
+            idle = self._idle.get(profile)
+            if idle is None:
+                raise KeyError(f"Unknown YoutubeDL profile: {profile}")
+            ydl = idle.pop() if idle else None
+        if ydl is None:
+            ydl = self._build(profile)
+        else:
+            self.reused += 1
+            cookiefile = self._profiles[profile].get('cookiefile')
+            if cookiefile:
+                self._jar(cookiefile)
+
+        try:
+            if outtmpl is not None:
+                ydl.params['outtmpl'] = dict(ydl.params['outtmpl'], default=outtmpl)
+            if 'format' in params and params['format'] != ydl.params.get('format'):
+                ydl.format_selector = ydl.build_format_selector(params['format'])
+            ydl.params.update(params)
+            for hook in progress_hooks:
+                ydl.add_progress_hook(hook)
+            for hook in post_hooks:
+                ydl.add_post_hook(hook)
+            token = current_job()
+            if token is not None:
+                token.guard(ydl)
+                bandwidth_shaper.attach(ydl, token)
+            yield ydl
+        finally:
+            self._reset(ydl)
+            with self._lock:
+                idle = self._idle[profile]
+                if len(idle) < self.size:
+                    idle.append(ydl)
+                    ydl = None
+            if ydl is not None:
+                # Pool is full; close without writing the shared jar to the cookie file
+                ydl.params['cookiefile'] = None
+                ydl.close()
+
+    def stats(self):
+        with self._lock:
+            idle = {profile: len(instances) for profile, instances in self._idle.items()}
+            reloads = {path: shared.reloads for path, shared in self._jars.items()}
+        return {
+            "created": self.created,
+            "reused": self.reused,
+            "idle": idle,
+            "cookie_reloads": reloads,
+        }
+
+
+ydl_pool = YoutubeDLPool()
+
+# Bare options, used to get basic info when every other config failed
+ydl_pool.register('minimal', {
+    'quiet': True,
+    'skip_download': True,
+})
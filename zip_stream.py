@@ -0,0 +1,141 @@
+import json
+import os
+import tempfile
+import time
+import zipfile
+
+from flask import Response
+
+from downloader_global import STATE_FOLDER
+
+BATCH_FOLDER = os.path.join(STATE_FOLDER, 'batches')
+os.makedirs(BATCH_FOLDER, exist_ok=True)
+
+# 'stream' builds multi-file archives on the fly, 'disk' writes a zip file first
+ZIP_MODE = os.environ.get('ZIP_MODE', 'stream')
+# Give up on items that are still not finished after this long
+STREAM_WAIT_SECONDS = int(os.environ.get('ZIP_STREAM_WAIT_SECONDS', str(2 * 3600)))
+CHUNK_SIZE = 1024 * 1024
+
+# Media formats that are already compressed, deflating them only costs CPU
+STORED_EXTENSIONS = {
+    '.mp4', '.m4a', '.m4v', '.webm', '.mkv', '.mov', '.flv', '.3gp', '.avi',
+    '.mp3', '.aac', '.opus', '.ogg', '.oga', '.flac', '.wav',
+    '.jpg', '.jpeg', '.png', '.webp', '.gif', '.zip',
+}
+
+
+def _manifest_path(zip_name):
+    return os.path.join(BATCH_FOLDER, os.path.basename(zip_name) + '.json')
+
+
+def write_manifest(zip_name, items):
+    """
+    Record the state of a batch archive.
+
+    items is a list of {'path', 'status'} dicts in archive order, status is
+    'pending', 'ready' or 'failed'.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=BATCH_FOLDER, suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump({'items': items}, f)
+    os.replace(tmp_path, _manifest_path(zip_name))
+
+
+def read_manifest(zip_name):
+    try:
+        with open(_manifest_path(zip_name), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def remove_manifest(zip_name):
+    try:
+        os.remove(_manifest_path(zip_name))
+    except OSError:
+        pass
+
+
+class _StreamBuffer:
+    """Write-only file object that collects what ZipFile writes"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(zip_name):
+    """
+    Generate the archive for a batch from its manifest.
+
+    Entries are written in the order the files become ready, so the client
+    starts receiving data as soon as the first download has finished.
+    Nothing is written to disk. Media files are STORED, other files DEFLATED.
+    """
+    buffer = _StreamBuffer()
+    sent = set()
+    deadline = time.monotonic() + STREAM_WAIT_SECONDS
+
+    with zipfile.ZipFile(buffer, 'w', allowZip64=True) as zipf:
+        while True:
+            manifest = read_manifest(zip_name)
+            if manifest is None:
+                break
+            items = manifest['items']
+
+            for index, item in enumerate(items):
+                if index in sent or item['status'] != 'ready':
+                    continue
+                sent.add(index)
+                path = item['path']
+                ext = os.path.splitext(path)[1].lower()
+                try:
+                    zinfo = zipfile.ZipInfo.from_file(path, os.path.basename(path))
+                    src = open(path, 'rb')
+                except OSError:
+                    # Removed by the storage manager since the batch finished
+                    continue
+                zinfo.compress_type = zipfile.ZIP_STORED if ext in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+                with src, zipf.open(zinfo, 'w') as dest:
+                    while True:
+                        chunk = src.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        dest.write(chunk)
+                        yield buffer.take()
+                yield buffer.take()
+
+            finished = all(item['status'] in ('ready', 'failed') for item in items)
+            if (finished and len(sent) == sum(item['status'] == 'ready' for item in items)) \
+                    or time.monotonic() > deadline:
+                break
+            time.sleep(0.5)
+
+    # Central directory
+    yield buffer.take()
+
+
+def zip_response(zip_name):
+    """Flask response streaming the archive of a batch"""
+    return Response(
+        stream_zip(zip_name),
+        mimetype='application/zip',
+        headers={
+            'Content-Disposition': f'attachment; filename="{os.path.basename(zip_name)}"',
+            'Cache-Control': 'no-store',
+            # Let nginx pass entries on while later ones are still downloading
+            'X-Accel-Buffering': 'no',
+        }
+    )